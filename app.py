@@ -1,17 +1,44 @@
+import asyncio
+from contextlib import ExitStack, asynccontextmanager
+from dataclasses import replace
+
 import gradio as gr
-import boto3
-import json
 import os
 import socket
 import logging
-import time
-import pandas as pd
 from botocore.exceptions import ClientError
 
 # タブ機能をインポート
 from tabs.pdf_to_yaml_tab import create_pdf_to_yaml_tab
 from tabs.pdf_to_markdown_tab import create_pdf_to_markdown_tab
-from utils.file_loader import load_ui_text
+from tabs.pdf_multi_format_tab import create_pdf_multi_format_tab
+from tabs.jobs_tab import create_jobs_tab, create_owner_state, ensure_owner_token
+from utils.file_loader import get_prompt_registry, load_ui_text
+from utils.scheduler import QUEUE_MAX_SIZE, estimate_request_tokens, get_scheduler
+from utils.bedrock_client import LazyProcessor, start_credential_check, verify_aws_credentials
+from utils.async_bedrock import aclose_async_clients
+from utils.bedrock_processor import (
+    BedrockDocumentProcessor,
+    ConversionResult,
+    PreparedRequest,
+    format_client_error,
+    format_result_text,
+    sanitize_document_name,
+)
+from utils.document_loader import MAX_UPLOAD_BYTES, open_document
+from utils.job_worker import JOB_WORKERS, enable_embedded_workers
+from utils.metrics import METRICS_ENABLED, metrics_response_body
+from utils.model_router import AUTO_HINT, get_model_router
+from utils.qa_session import QASession, get_session_store
+from utils.usage_ledger import user_from_request
+from utils.result_cache import hash_document, make_cache_key
+from utils.retrieval_index import (
+    RETRIEVAL_TOP_K,
+    format_page_ranges,
+    get_retrieval_index,
+    map_citations,
+    retrieve_documents,
+)
 
 # カスタムテーマをインポート
 from theme import create_custom_theme
@@ -20,23 +47,24 @@ from theme import create_custom_theme
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 logger = logging.getLogger(__name__)
 
+# テーマデモタブを表示するか（本番では BEDROCK_THEME_DEMO=0 で外し、起動時の読み込みを減らす）
+THEME_DEMO_ENABLED = os.environ.get("BEDROCK_THEME_DEMO", "1") == "1"
+
 
-class BedrockPDFProcessor:
+class BedrockPDFProcessor(BedrockDocumentProcessor):
     """AWS BedrockでPDF処理を行うクラス"""
     
+    tab_name = "qa"
+    
     def __init__(self, region="ap-northeast-1"):
         try:
-            self.bedrock_client = boto3.client("bedrock-runtime", region_name=region)
-            sts_client = boto3.client('sts', region_name=region)
-            identity = sts_client.get_caller_identity()
-            logger.info(f"AWS認証成功: {identity['Arn']}")
+            super().__init__(region)
+            verify_aws_credentials(region)
         except Exception as e:
             logger.error(f"AWS認証エラー: {str(e)}")
             raise
-            
-        self.model_id = "apac.anthropic.claude-sonnet-4-20250514-v1:0"
     
-    def process_pdf(self, pdf_file, question):
+    def process_pdf(self, pdf_file, question, user=None, model_hint=None):
         """PDFファイルを処理して質問に回答"""
         if not pdf_file:
             return "PDFファイルを選択してください。"
@@ -45,62 +73,298 @@ class BedrockPDFProcessor:
             return "質問を入力してください。"
         
         try:
-            # ファイル形式を取得
-            input_document_format = pdf_file.split(".")[-1]
+            result = self.run_document_request(
+                pdf_file, question, citations=True, user=user, model_hint=model_hint
+            )
             
-            # ドキュメントを読み込み
-            with open(pdf_file, 'rb') as f:
-                input_document = f.read()
+            result_text = format_result_text(result, include_citations=True)
+            result_text += f"\n🔗 Citations機能: 有効"
+            return result_text
             
-            # ファイル名をサニタイズ
-            base_name = os.path.splitext(os.path.basename(pdf_file))[0]
-            sanitized_name = ''.join(c for c in base_name if c.isalnum()) or "PDF"
+        except ClientError as e:
+            return format_client_error(e)
+        except Exception as e:
+            return f"エラー: {str(e)}"
+    
+    def process_pdf_stream(self, pdf_file, question, user=None, model_hint=None):
+        """PDFファイルを処理して質問に回答（ストリーミング）"""
+        if not pdf_file:
+            yield "PDFファイルを選択してください。"
+            return
+        
+        if not question.strip():
+            yield "質問を入力してください。"
+            return
+        
+        try:
+            result = None
+            for result in self.stream_document_request(
+                pdf_file, question, citations=True, user=user, model_hint=model_hint
+            ):
+                yield result.text
             
-            # メッセージを構築
-            message = {
-                "role": "user",
-                "content": [
-                    {"text": question},
-                    {
-                        "document": {
-                            "name": sanitized_name,
-                            "format": input_document_format,
-                            "source": {"bytes": input_document},
-                            "citations": {"enabled": True},  
-                        }
-                    },
-                ],
-            }
+            if result is not None:
+                result_text = format_result_text(result, include_citations=True)
+                result_text += "\n🔗 Citations機能: 有効"
+                yield result_text
             
-            # Converse APIを呼び出し
-            response = self.bedrock_client.converse(
-                modelId=self.model_id,
-                messages=[message]
+        except ClientError as e:
+            yield format_client_error(e)
+        except Exception as e:
+            yield f"エラー: {str(e)}"
+    
+    async def aprocess_pdf(self, pdf_file, question, user=None, model_hint=None):
+        """process_pdfの非同期版"""
+        if not pdf_file:
+            return "PDFファイルを選択してください。"
+        
+        if not question.strip():
+            return "質問を入力してください。"
+        
+        try:
+            result = await self.arun_document_request(
+                pdf_file, question, citations=True, user=user, model_hint=model_hint
             )
             
-            # レスポンスから結果を抽出
-            output_message = response['output']['message']
-            result_text = ""
+            result_text = format_result_text(result, include_citations=True)
+            result_text += "\n🔗 Citations機能: 有効"
+            return result_text
+            
+        except ClientError as e:
+            return format_client_error(e)
+        except Exception as e:
+            return f"エラー: {str(e)}"
+    
+    async def aprocess_pdf_stream(self, pdf_file, question, user=None, model_hint=None):
+        """process_pdf_streamの非同期版"""
+        if not pdf_file:
+            yield "PDFファイルを選択してください。"
+            return
+        
+        if not question.strip():
+            yield "質問を入力してください。"
+            return
+        
+        try:
+            result = None
+            async for result in self.astream_document_request(
+                pdf_file, question, citations=True, user=user, model_hint=model_hint
+            ):
+                yield result.text
+            
+            if result is not None:
+                result_text = format_result_text(result, include_citations=True)
+                result_text += "\n🔗 Citations機能: 有効"
+                yield result_text
             
-            for content in output_message['content']:
-                if 'text' in content:
-                    result_text += content['text']
+        except ClientError as e:
+            yield format_client_error(e)
+        except Exception as e:
+            yield f"エラー: {str(e)}"
+
+    def _prepare_retrieval_request(self, pdf_files, question, top_k, user=None, model_hint=None):
+        """検索インデックスで質問に関係するページを選び、Converse呼び出しの準備を行う
+        
+        戻り値は (PreparedRequest, [RetrievedDocument, ...])。関係するページがなければ (None, [])。
+        """
+        trace = self._new_trace()
+        index = get_retrieval_index()
+        documents = {}
+        # 元のPDFは関係するページを抜き出すまでメモリマップで開いておく
+        with ExitStack() as stack:
+            for pdf_file in pdf_files:
+                with trace.span("file_read"):
+                    document = stack.enter_context(open_document(pdf_file, max_bytes=MAX_UPLOAD_BYTES))
+                document_name = sanitize_document_name(pdf_file)
+                with trace.span("retrieval"):
+                    document_hash = index.add_document(document.data, document_name)
+                documents[document_hash] = (document_name, document.data)
             
-            # トークン使用量を追加
-            if 'usage' in response:
-                token_usage = response['usage']
-                result_text += f"\n\n---\n📊 トークン使用量: 入力 {token_usage.get('inputTokens', 'N/A')}, 出力 {token_usage.get('outputTokens', 'N/A')}, 合計 {token_usage.get('totalTokens', 'N/A')}"
+            with trace.span("retrieval"):
+                retrieved = retrieve_documents(index, documents, question, top_k=top_k)
+        if not retrieved:
+            return None, []
+        
+        # モデルは抜き出したページの合計で選ぶ
+        model_id = self._route(
+            sum(len(d.pages) for d in retrieved), sum(len(d.document_bytes) for d in retrieved), model_hint
+        )
+        
+        # キャッシュキーは選ばれたページの組み合わせと質問から作る
+        selection = "|".join(f"{d.document_hash}:{d.pages}" for d in retrieved)
+        cache_key = None
+        if self.result_cache is not None:
+            cache_key = make_cache_key(
+                hash_document(selection.encode("utf-8")), model_id, question, True
+            )
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                logger.info("結果キャッシュヒット: 検索モード")
+                result = ConversionResult(
+                    text=cached["text"],
+                    usage=cached["usage"],
+                    model_id=model_id,
+                    cache_hit=True,
+                    citations=cached.get("citations", []),
+                )
+                return PreparedRequest(cache_key=cache_key, cached=result, trace=trace, user=user), retrieved
+        
+        content = []
+        used_names = set()
+        for document in retrieved:
+            name = document.request_name
+            if name in used_names:
+                name = f"{name} [{len(used_names) + 1}]"
+            used_names.add(name)
+            content.append(
+                {
+                    "document": {
+                        "name": name,
+                        "format": "pdf",
+                        "source": {"bytes": document.document_bytes},
+                        "citations": {"enabled": True},
+                    }
+                }
+            )
+        
+        page_notes = "\n".join(
+            f"- {d.document_name}: {format_page_ranges(d.page_ranges)}（全 {d.page_count} ページ）" for d in retrieved
+        )
+        content.append(
+            {
+                "text": f"{question}\n\n※ 各ドキュメントは、検索で質問に関係すると判断した次のページだけを抜き出したものです。\n{page_notes}"
+            }
+        )
+        
+        request = {
+            "modelId": model_id,
+            "messages": [{"role": "user", "content": content}],
+        }
+        prepared = PreparedRequest(
+            cache_key=cache_key,
+            request=request,
+            estimated_tokens=estimate_request_tokens(sum(len(d.pages) for d in retrieved), question),
+            trace=trace,
+            user=user,
+        )
+        return prepared, retrieved
+    
+    async def aprocess_pdf_retrieval_stream(
+        self, pdf_files, question, top_k=RETRIEVAL_TOP_K, user=None, model_hint=None
+    ):
+        """検索モードでPDF（複数可）への質問に回答（非同期ストリーミング）
+        
+        ページ単位の検索インデックスで上位のページだけを抜き出して送信し、
+        引用位置は元のドキュメントのページ番号に戻して表示する。
+        """
+        if not pdf_files:
+            yield "PDFファイルを選択してください。"
+            return
+        
+        if not question.strip():
+            yield "質問を入力してください。"
+            return
+        
+        try:
+            yield "🔎 関係するページを検索しています..."
+            prepared, retrieved = await asyncio.to_thread(
+                self._prepare_retrieval_request, pdf_files, question, top_k, user, model_hint
+            )
+            if prepared is None:
+                yield "質問に関係するページが見つかりませんでした。質問の言い回しを変えるか、検索モードを無効にして試してください。"
+                return
             
-            result_text += f"\n🔗 Citations機能: 有効"
-            return result_text
+            result = None
+            async for result in self._astream(prepared):
+                yield result.text
+            
+            if result is not None:
+                result = replace(result, citations=map_citations(result.citations, retrieved))
+                result_text = format_result_text(result, include_citations=True)
+                result_text += "\n🔎 検索モード: " + " / ".join(
+                    f"{d.document_name} {format_page_ranges(d.page_ranges)}" for d in retrieved
+                )
+                result_text += "\n🔗 Citations機能: 有効"
+                yield result_text
             
         except ClientError as e:
-            error_msg = str(e)
-            if "Extra inputs are not permitted" in error_msg and "citations" in error_msg:
-                return f"❌ Citations機能エラー: {error_msg}\n\n対処法: リージョンを ap-northeast-1 に変更し、AWSサポートに機能の利用可能性を確認してください。"
-            return f"AWS APIエラー: {error_msg}"
+            yield format_client_error(e)
         except Exception as e:
-            return f"エラー: {str(e)}"
+            yield f"エラー: {str(e)}"
+    
+    def _prepare_session_request(self, session, question, user=None, model_hint=None):
+        """会話セッションからConverse呼び出しの準備を行う"""
+        if not session.has_history:
+            # 最初の質問は通常の単発リクエストと同じ（結果キャッシュも利用）。最適化は読み込み時に済んでいる
+            prepared = self._prepare_bytes_request(
+                session.document_bytes,
+                session.document_name,
+                session.document_format,
+                question,
+                True,
+                user=user,
+                model_hint=model_hint,
+                preflight=False,
+            )
+            prepared.preflight = session.preflight
+            return prepared
+        
+        model_id = self._route(session.page_count, len(session.document_bytes), model_hint)
+        messages = session.build_messages(question, citations=True, prompt_caching=self.prompt_caching)
+        return PreparedRequest(
+            request={"modelId": model_id, "messages": messages},
+            estimated_tokens=estimate_request_tokens(session.page_count, question),
+            user=user,
+        )
+    
+    async def _asummarize(self, session, overflow, user=None):
+        """ウィンドウから溢れた会話を要約してセッションに保持"""
+        # 要約はドキュメントを含まない短い処理のため、ルールで軽量なモデルを選べるようにする
+        request = {"modelId": self._route(0, 0), "messages": session.build_summary_messages(overflow)}
+        try:
+            result = await self._aexecute(
+                PreparedRequest(request=request, estimated_tokens=estimate_request_tokens(0), user=user)
+            )
+            session.summary = result.text
+        except Exception as e:
+            logger.warning(f"会話の要約に失敗しました: {str(e)}")
+    
+    async def aprocess_pdf_session_stream(self, session, pdf_file, question, user=None, model_hint=None):
+        """会話セッションを使ってPDFへの質問に回答（非同期ストリーミング）
+        
+        ドキュメントはセッションに1回だけ読み込まれ、追加の質問では直近の履歴とともに送られる。
+        """
+        if not pdf_file:
+            yield "PDFファイルを選択してください。"
+            return
+        
+        if not question.strip():
+            yield "質問を入力してください。"
+            return
+        
+        try:
+            await asyncio.to_thread(session.load_document, pdf_file)
+            prepared = await asyncio.to_thread(
+                self._prepare_session_request, session, question, user, model_hint
+            )
+            
+            result = None
+            async for result in self._astream(prepared):
+                yield result.text
+            
+            if result is not None:
+                overflow = session.add_turn(question, result.text)
+                if overflow:
+                    await self._asummarize(session, overflow, user)
+                
+                result_text = format_result_text(result, include_citations=True)
+                result_text += "\n🔗 Citations機能: 有効"
+                yield result_text
+            
+        except ClientError as e:
+            yield format_client_error(e)
+        except Exception as e:
+            yield f"エラー: {str(e)}"
 
 
 def find_available_port(start_port=7860, max_port=7870):
@@ -117,10 +381,44 @@ def find_available_port(start_port=7860, max_port=7870):
 
 def create_pdf_qa_tab():
     """PDF Q&Aタブを作成（元の機能）"""
-    processor = BedrockPDFProcessor()
+    # プロセッサ（boto3クライアント・AWS認証）は最初の質問時に作成する
+    processor = LazyProcessor(BedrockPDFProcessor)
+    
+    async def handle_upload(
+        pdf_file, question, session_id, use_retrieval, extra_pdfs, top_k, model_hint, request: gr.Request
+    ):
+        # セッションはストアから読み込む（共有バックエンドなら別のレプリカで作られたセッションも続けられる）
+        store = get_session_store()
+        session = await asyncio.to_thread(store.load, session_id) if session_id else None
+        if session is None:
+            session = QASession()
+        try:
+            processor.get()
+        except Exception as e:
+            yield f"エラー: AWSの初期化に失敗しました: {str(e)}", session.chat_history(), session.session_id
+            return
+        user = user_from_request(request)
+        
+        if use_retrieval:
+            # 検索モードは単発の質問として扱い、会話履歴には追加しない
+            pdf_files = [f for f in [pdf_file] + list(extra_pdfs or []) if f]
+            async for text in processor.aprocess_pdf_retrieval_stream(
+                pdf_files, question, int(top_k), user=user, model_hint=model_hint
+            ):
+                yield text, session.chat_history(), session.session_id
+            return
+        
+        async for text in processor.aprocess_pdf_session_stream(
+            session, pdf_file, question, user=user, model_hint=model_hint
+        ):
+            yield text, session.chat_history(), session.session_id
+        if session.document_bytes is not None:
+            await asyncio.to_thread(store.save, session)
     
-    def handle_upload(pdf_file, question):
-        return processor.process_pdf(pdf_file, question)
+    def reset_session(session_id):
+        if session_id:
+            get_session_store().delete(session_id)
+        return "", [], ""
     
     def show_file_info(pdf_file):
         if not pdf_file:
@@ -156,6 +454,31 @@ def create_pdf_qa_tab():
                     placeholder="PDFについて質問してください...",
                     lines=3
                 )
+                with gr.Accordion("🔎 検索モード（大きなPDF・複数PDF向け）", open=False):
+                    use_retrieval = gr.Checkbox(
+                        label="関係するページだけを送信する",
+                        value=False,
+                        info="ページごとのテキストをローカルで検索し、上位のページだけをBedrockに送ります"
+                    )
+                    extra_pdfs = gr.File(
+                        label="📚 追加のPDF（複数可・検索モードのみ）",
+                        file_types=[".pdf"],
+                        file_count="multiple",
+                        type="filepath"
+                    )
+                    top_k = gr.Slider(
+                        label="検索するページ数（上位k件）",
+                        minimum=1,
+                        maximum=20,
+                        value=RETRIEVAL_TOP_K,
+                        step=1
+                    )
+                model_hint = gr.Dropdown(
+                    label="🤖 モデル",
+                    choices=get_model_router().hint_choices(),
+                    value=AUTO_HINT,
+                    info="auto: ページ数・サイズ・処理の種類からモデルを自動で選びます"
+                )
                 submit_btn = gr.Button("🚀 分析開始", variant="primary")
             
             with gr.Column():
@@ -164,10 +487,27 @@ def create_pdf_qa_tab():
                     lines=15,
                     show_copy_button=True
                 )
+                chat_history = gr.Chatbot(
+                    label="💬 会話履歴",
+                    type="messages",
+                    height=300
+                )
+                reset_btn = gr.Button("🗑️ 会話をリセット", variant="secondary")
+        
+        # 会話セッションのID（ドキュメントと履歴はセッションストアに保持し、一定時間で破棄）
+        # IDはブラウザ側に持たせ、リクエストが別のレプリカに届いても同じセッションを使えるようにする
+        session_state = gr.Textbox(value="", visible=False)
         
         # イベント設定
         pdf_input.change(show_file_info, pdf_input, file_info)
-        submit_btn.click(handle_upload, [pdf_input, question_input], output)
+        reset_btn.click(reset_session, session_state, [output, chat_history, session_state])
+        submit_btn.click(
+            handle_upload,
+            [pdf_input, question_input, session_state, use_retrieval, extra_pdfs, top_k, model_hint],
+            [output, chat_history, session_state],
+            concurrency_limit=get_scheduler().tab_limit("qa"),
+            concurrency_id="bedrock_qa"
+        )
         
         # 使用方法
         with gr.Accordion("📖 PDF Q&A機能について", open=False):
@@ -179,14 +519,6 @@ def create_comprehensive_demo():
     """包括的なデモアプリケーションを作成"""
     theme = create_custom_theme()
     
-    # サンプルデータ
-    sample_data = pd.DataFrame({
-        "ファイル名": ["document1.pdf", "report2.pdf", "manual3.pdf", "guide4.pdf"],
-        "サイズ": ["2.5MB", "1.8MB", "4.2MB", "3.1MB"],
-        "ページ数": [15, 25, 8, 12],
-        "処理状況": ["完了", "処理中", "待機", "完了"]
-    })
-    
     # カスタムCSS
     css = """
     /* ヘッダー */
@@ -231,31 +563,60 @@ def create_comprehensive_demo():
         </div>
         """)
         
+        # ジョブの所有者を表すブラウザごとの識別子（マイジョブは本人のジョブのみ表示する）
+        owner_state = create_owner_state()
+        
         # タブ機能を追加
         with gr.Tabs():
             with gr.Tab("📄❓ PDF Q&A"):
                 create_pdf_qa_tab()
             
             with gr.Tab("📄➡️📋 PDF→YAML変換"):
-                create_pdf_to_yaml_tab()
+                create_pdf_to_yaml_tab(owner_state)
             
             with gr.Tab("📄➡️📝 PDF→マークダウン変換"):
-                create_pdf_to_markdown_tab()
+                create_pdf_to_markdown_tab(owner_state)
+            
+            with gr.Tab("📄➡️🗂️ まとめて変換"):
+                create_pdf_multi_format_tab()
+            
+            with gr.Tab("📋 マイジョブ"):
+                create_jobs_tab(owner_state)
             
             # 新しいデモタブを追加
-            with gr.Tab("🎨 テーマデモ"):
-                create_theme_demo_tab(sample_data)
+            if THEME_DEMO_ENABLED:
+                with gr.Tab("🎨 テーマデモ"):
+                    create_theme_demo_tab()
         
         # 全体的な情報
         with gr.Accordion("ℹ️ アプリケーション情報", open=False):
             app_info = load_ui_text("app_info")
             gr.Markdown(app_info)
+        
+        app.load(ensure_owner_token, owner_state, owner_state)
+    
+    # キューを有効化（待機中のユーザーには順番が表示される）
+    app.queue(
+        default_concurrency_limit=get_scheduler().global_limit,
+        max_size=QUEUE_MAX_SIZE
+    )
     
     return app
 
 
-def create_theme_demo_tab(sample_data):
+def create_theme_demo_tab():
     """テーマデモタブを作成"""
+    # pandasはこのタブでしか使わないため、タブを作るときに読み込む
+    import pandas as pd
+    
+    # サンプルデータ
+    sample_data = pd.DataFrame({
+        "ファイル名": ["document1.pdf", "report2.pdf", "manual3.pdf", "guide4.pdf"],
+        "サイズ": ["2.5MB", "1.8MB", "4.2MB", "3.1MB"],
+        "ページ数": [15, 25, 8, 12],
+        "処理状況": ["完了", "処理中", "待機", "完了"]
+    })
+    
     with gr.Column():
         gr.Markdown("## 🎨 カスタムテーマデモ")
         gr.Markdown("指定されたカラーパレット（#2C3540, #5D6973, #F2CA80, #F2E9D8, #732922）を使用したUIコンポーネント")
@@ -424,6 +785,27 @@ def create_app():
     return create_comprehensive_demo()
 
 
+@asynccontextmanager
+async def close_bedrock_connections(_app):
+    """サーバー停止時にBedrockへの非同期HTTP接続を閉じる"""
+    yield
+    await aclose_async_clients()
+
+
+def create_server_app(demo):
+    """Gradioアプリと /metrics（Prometheus形式）を同じポートで提供するFastAPIアプリを作成"""
+    from fastapi import FastAPI, Response
+    
+    server = FastAPI(lifespan=close_bedrock_connections)
+    
+    @server.get("/metrics")
+    def metrics():
+        body, content_type = metrics_response_body()
+        return Response(content=body, media_type=content_type)
+    
+    return gr.mount_gradio_app(server, demo, path="/")
+
+
 if __name__ == "__main__":
     import argparse
 
@@ -433,14 +815,15 @@ if __name__ == "__main__":
     parser.add_argument("--port", type=int, default=None, help="起動するポート番号 (例: 7860)")
     args = parser.parse_args()
 
-    # AWS認証確認
+    # AWS認証確認はバックグラウンドで1回だけ行い、起動を待たせない
+    # （結果はプロセス内で共有され、最初のリクエストでプロセッサを作るときに再利用される）
+    start_credential_check()
+
+    # プロンプトを読み込んでおく（ファイルや設定したバリアントが見つからなければ、ここで起動を中止する）
     try:
-        session = boto3.Session()
-        sts = session.client('sts', region_name="ap-northeast-1")
-        identity = sts.get_caller_identity()
-        print(f"✅ AWS認証: {identity['Arn']}")
-    except Exception as e:
-        print(f"❌ AWS認証エラー: {e}")
+        get_prompt_registry()
+    except (OSError, ValueError) as e:
+        print(f"❌ プロンプトを読み込めません: {str(e)}")
         exit(1)
 
     # ポート決定
@@ -454,9 +837,21 @@ if __name__ == "__main__":
             exit(1)
         print(f"🌐 自動選択ポート {port} で起動します")
 
+    # 変換ジョブのワーカープロセスは最初のジョブの登録時に起動する（BEDROCK_JOB_WORKERS=0 なら job_worker.py を別に動かす）
+    if JOB_WORKERS > 0:
+        enable_embedded_workers(JOB_WORKERS)
+        print(f"📥 変換ジョブワーカー: 最大 {JOB_WORKERS} プロセス（最初のジョブの登録時に起動）")
+
     app = create_comprehensive_demo()
-    app.launch(
-        server_name="0.0.0.0",
-        server_port=port,
-        share=False
-    )
\ No newline at end of file
+    if METRICS_ENABLED:
+        import uvicorn
+        
+        print(f"📈 メトリクス: http://localhost:{port}/metrics")
+        uvicorn.run(create_server_app(app), host="0.0.0.0", port=port)
+    else:
+        app.launch(
+            server_name="0.0.0.0",
+            server_port=port,
+            share=False,
+            app_kwargs={"lifespan": close_bedrock_connections},
+        )
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""
+PDF一括変換コマンド
+UIを起動せずに、ディレクトリ内のPDFをマークダウン/YAMLへまとめて変換する
+
+使用例:
+    uv run python batch_convert.py ./documents --format markdown yaml --workers 8
+
+    # 1回の変換からマークダウン・YAML・JSON・CSVをまとめて出力（Bedrock呼び出しはPDFごとに1回）
+    uv run python batch_convert.py ./documents --format markdown yaml json csv --single-pass
+
+    # Bedrockバッチ推論ジョブで変換（夜間の大量変換向け）
+    uv run python batch_convert.py ./documents --format yaml --batch-inference \
+        --s3-input s3://my-bucket/input --s3-output s3://my-bucket/output \
+        --role-arn arn:aws:iam::123456789012:role/BedrockBatchRole
+
+    # S3とBedrockをローカルの代替実装に置き換えて動作確認
+    uv run python batch_convert.py ./documents --batch-inference --local-store ./.batch_store
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+from utils import batch_inference
+from utils.batch_runner import (
+    OUTPUT_FORMATS,
+    SINGLE_PASS_PROCESSOR,
+    create_processors,
+    find_pdf_files,
+    run_batch,
+)
+from utils.model_router import AUTO_HINT, DEFAULT_MODEL_ID
+from utils.multi_format import RENDERED_FORMATS
+from utils.bedrock_client import verify_aws_credentials
+from utils.pdf_chunker import DEFAULT_PAGES_PER_CHUNK
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def run_batch_inference(args):
+    """Bedrockバッチ推論ジョブで変換"""
+    if len(args.format) != 1:
+        print("❌ バッチ推論モードでは --format を1つだけ指定してください")
+        return 1
+    output_format = args.format[0]
+
+    if args.local_store:
+        object_store = batch_inference.LocalObjectStore(args.local_store)
+        control_plane = batch_inference.LocalBatchControlPlane(object_store)
+        input_uri = args.s3_input or "s3://local-batch/input"
+        output_uri = args.s3_output or "s3://local-batch/output"
+    else:
+        if not (args.s3_input and args.s3_output and args.role_arn):
+            print("❌ --s3-input, --s3-output, --role-arn を指定してください")
+            return 1
+        object_store = batch_inference.S3ObjectStore()
+        control_plane = batch_inference.BedrockBatchControlPlane(args.role_arn)
+        input_uri = args.s3_input
+        output_uri = args.s3_output
+
+    # 前回投入したジョブが未回収ならポーリングから再開（ローカル実行のジョブはプロセス内のみ有効）
+    state = batch_inference.load_job_state(args.directory)
+    if state is not None and not args.local_store:
+        print(f"🔁 前回のジョブを再開します: {len(state['jobs'])} 件")
+    else:
+        pdf_files = find_pdf_files(args.directory)
+        if not pdf_files:
+            print("❌ PDFファイルが見つかりません")
+            return 1
+        state = batch_inference.submit_batch_job(
+            pdf_files,
+            args.directory,
+            output_format,
+            object_store,
+            control_plane,
+            input_uri,
+            output_uri,
+            args.model_id,
+        )
+        if state["rejected"]:
+            print(f"❌ 上限を超えるため {len(state['rejected'])} 件のPDFを除外しました")
+        if not state["jobs"]:
+            print("⏭️ 投入するPDFがありません")
+            return 1 if state["rejected"] else 0
+        for job in state["jobs"]:
+            print(f"📤 {len(job['records'])} 件のPDFでジョブを投入しました: {job['job_arn']}")
+
+    started = time.monotonic()
+    batch_inference.wait_for_jobs(
+        control_plane,
+        state,
+        poll_interval=1 if args.local_store else args.poll_interval,
+        status_callback=lambda job_state, job: print(
+            f"⏳ ジョブ状態: {job_state['job_name']} {job['status']}", flush=True
+        ),
+    )
+    for job_state in state["jobs"]:
+        if job_state["status"] not in ("Completed", "PartiallyCompleted"):
+            print(f"❌ ジョブが完了しませんでした: {job_state['job_name']} {job_state['status']} {job_state['message']}")
+
+    succeeded, failed, input_tokens, output_tokens = batch_inference.collect_batch_results(
+        args.directory, state, object_store
+    )
+    print(
+        f"✅ 変換 {succeeded} 件 / ❌ 失敗 {failed} 件 "
+        f"(⏱️ {time.monotonic() - started:.1f}秒, 入力 {input_tokens} / 出力 {output_tokens} トークン)"
+    )
+    return 1 if failed or state.get("rejected") else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AWS Bedrock PDF 一括変換")
+    parser.add_argument("directory", help="PDFを含むディレクトリ")
+    parser.add_argument(
+        "--format",
+        nargs="+",
+        choices=sorted(set(OUTPUT_FORMATS) | set(RENDERED_FORMATS)),
+        default=["markdown"],
+        help="出力形式（複数指定可。json / csv は --single-pass のみ）",
+    )
+    parser.add_argument(
+        "--single-pass",
+        action="store_true",
+        help="PDFごとに1回だけ変換し、指定した形式をまとめて書き出す（形式ごとにBedrockを呼ばない）",
+    )
+    parser.add_argument("--workers", type=int, default=4, help="並列ワーカー数")
+    parser.add_argument("--chunked", action="store_true", help="ページ範囲に分割して変換する")
+    parser.add_argument(
+        "--pages-per-chunk", type=int, default=DEFAULT_PAGES_PER_CHUNK, help="1チャンクあたりのページ数"
+    )
+    parser.add_argument("--skip-failed", action="store_true", help="前回失敗したファイルを再試行しない")
+    parser.add_argument(
+        "--model", default=AUTO_HINT, help="使うモデル（auto でページ数・サイズから選択、sonnet / haiku やモデルIDも可）"
+    )
+    parser.add_argument("--user", default="batch", help="使用量台帳に記録するユーザー名（トークン予算の対象）")
+    parser.add_argument("--batch-inference", action="store_true", help="Bedrockバッチ推論ジョブで変換する")
+    parser.add_argument("--s3-input", help="バッチ入力JSONLの配置先 (s3://bucket/prefix)")
+    parser.add_argument("--s3-output", help="バッチ出力の配置先 (s3://bucket/prefix)")
+    parser.add_argument("--role-arn", help="バッチ推論ジョブ用のIAMロールARN")
+    parser.add_argument("--model-id", default=DEFAULT_MODEL_ID, help="バッチ推論に使うモデルID")
+    parser.add_argument(
+        "--poll-interval", type=int, default=batch_inference.POLL_INTERVAL, help="ジョブ状態の確認間隔（秒）"
+    )
+    parser.add_argument(
+        "--local-store", help="S3とBedrockの代わりに使うローカルディレクトリ（オフライン動作確認用）"
+    )
+    args = parser.parse_args(argv)
+
+    print("🚀 PDF一括変換を開始します...")
+
+    rendered_only = sorted(set(args.format) - set(OUTPUT_FORMATS))
+    if rendered_only and not args.single_pass:
+        print(f"❌ {', '.join(rendered_only)} の出力には --single-pass を指定してください")
+        return 1
+    if args.single_pass and args.batch_inference:
+        print("❌ --single-pass と --batch-inference は同時に指定できません")
+        return 1
+
+    if args.batch_inference and args.local_store:
+        return run_batch_inference(args)
+
+    # AWS認証確認
+    try:
+        identity = verify_aws_credentials()
+        print(f"✅ AWS認証: {identity['Arn']}")
+    except Exception as e:
+        print(f"❌ AWS認証エラー: {e}")
+        return 1
+
+    if args.batch_inference:
+        return run_batch_inference(args)
+
+    def show_progress(stats, total):
+        done = stats.converted + stats.failed
+        print(f"📄 {done}/{total} 件処理済み（失敗 {stats.failed} 件）", flush=True)
+
+    stats = run_batch(
+        args.directory,
+        create_processors([SINGLE_PASS_PROCESSOR] if args.single_pass else args.format),
+        formats=args.format,
+        max_workers=args.workers,
+        chunked=args.chunked,
+        pages_per_chunk=args.pages_per_chunk,
+        retry_failed=not args.skip_failed,
+        progress_callback=show_progress,
+        user=args.user,
+        model_hint=args.model,
+        single_pass=args.single_pass,
+    )
+
+    print(stats.summary())
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+変換スループット・レイテンシのベンチマーク
+モックサーバーを別プロセスで起動し、合成PDFで process_pdf / convert_pdf_to_yaml /
+convert_pdf_to_markdown を計測してJSONに保存する
+
+使用例:
+    uv run python benchmark.py --requests 20 --concurrency 4
+
+    # 前回の結果と比較（p95レイテンシ・ファイル/秒が20%以上悪化したら終了コード1）
+    uv run python benchmark.py --compare benchmark_results/baseline.json
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from utils.mock_bedrock import MockConfig
+
+
+def find_free_port():
+    """空いているローカルポートを取得"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(port, args):
+    """モックサーバーを別プロセスで起動し、応答するまで待つ"""
+    command = [
+        sys.executable,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_bedrock_server.py"),
+        "--port", str(port),
+        "--latency", str(args.latency),
+        "--tokens-per-second", str(args.tokens_per_second),
+        "--output-tokens", str(args.output_tokens),
+        "--throttle-rate", str(args.throttle_rate),
+        "--error-rate", str(args.error_rate),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/ping", timeout=1):
+                return process
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+
+    process.terminate()
+    raise RuntimeError("モックサーバーを起動できませんでした")
+
+
+def main(argv=None):
+    defaults = MockConfig()
+    parser = argparse.ArgumentParser(description="AWS Bedrock PDF 変換ベンチマーク（モックバックエンド）")
+    parser.add_argument("--tasks", nargs="+", choices=["qa", "yaml", "markdown"], default=["qa", "yaml", "markdown"])
+    parser.add_argument(
+        "--profiles",
+        nargs="+",
+        help="合成PDFの条件（名前:ページ数:サイズKB、例: small:1:50 large:100:4096）",
+    )
+    parser.add_argument("--requests", type=int, default=20, help="シナリオごとのリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時実行数")
+    parser.add_argument("--sync", action="store_true", help="ストリーミングではなく一括応答の関数を計測する")
+    parser.add_argument("--endpoint-url", help="起動済みのモックサーバーを使う場合のURL")
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="モックの最初のトークンまでの遅延（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--output-tokens", type=int, default=defaults.output_tokens)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="結果JSONの保存先（既定: benchmark_results/bench-日時.json）")
+    parser.add_argument("--compare", help="比較対象の結果JSON")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="劣化とみなす変化率")
+    args = parser.parse_args(argv)
+
+    server_process = None
+    endpoint_url = args.endpoint_url
+    if endpoint_url is None:
+        port = find_free_port()
+        server_process = start_mock_server(port, args)
+        endpoint_url = f"http://127.0.0.1:{port}"
+
+    # 設定はモジュール読み込み時に参照されるため、アプリのモジュールより先に環境変数を設定する
+    os.environ["BEDROCK_BACKEND"] = "mock"
+    os.environ["BEDROCK_ENDPOINT_URL"] = endpoint_url
+    os.environ["BEDROCK_PDF_CACHE_DISABLED"] = "1"
+    os.environ.setdefault("BEDROCK_RPM", "0")
+    os.environ.setdefault("BEDROCK_TPM", "0")
+
+    import logging
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s: %(message)s", force=True)
+
+    from app import BedrockPDFProcessor
+    from tabs.pdf_to_markdown_tab import PDFToMarkdownProcessor
+    from tabs.pdf_to_yaml_tab import PDFToYAMLProcessor
+    from utils import benchmark
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    profiles = [benchmark.parse_profile(p) for p in args.profiles] if args.profiles else benchmark.DEFAULT_PROFILES
+    streaming = not args.sync
+
+    qa = BedrockPDFProcessor()
+    yaml_processor = PDFToYAMLProcessor()
+    markdown_processor = PDFToMarkdownProcessor()
+    question = "この文書の要点を3つ挙げてください。"
+
+    def task_call(task, pdf_file):
+        if task == "qa":
+            if streaming:
+                return lambda: qa.process_pdf_stream(pdf_file, question)
+            return lambda: qa.process_pdf(pdf_file, question)
+        if task == "yaml":
+            if streaming:
+                return lambda: yaml_processor.convert_pdf_to_yaml_stream(pdf_file)
+            return lambda: yaml_processor.convert_pdf_to_yaml(pdf_file)
+        if streaming:
+            return lambda: markdown_processor.convert_pdf_to_markdown_stream(pdf_file)
+        return lambda: markdown_processor.convert_pdf_to_markdown(pdf_file)
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            for profile in profiles:
+                pdf_file = os.path.join(work_dir, f"{profile.name}.pdf")
+                pdf_bytes = benchmark.make_synthetic_pdf(profile.pages, profile.target_bytes)
+                with open(pdf_file, "wb") as f:
+                    f.write(pdf_bytes)
+
+                for task in args.tasks:
+                    name = f"{task}-{profile.name}"
+                    print(f"⏱️ {name}（{profile.pages} ページ, {len(pdf_bytes) / 1024:.0f}KB）...", flush=True)
+                    results.append(
+                        benchmark.run_scenario(
+                            name,
+                            task,
+                            task_call(task, pdf_file),
+                            streaming,
+                            len(pdf_bytes),
+                            profile.pages,
+                            args.requests,
+                            args.concurrency,
+                        )
+                    )
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait()
+
+    report = benchmark.build_report(
+        results,
+        {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "mode": "stream" if streaming else "sync",
+            "mock": {
+                "latency": args.latency,
+                "tokens_per_second": args.tokens_per_second,
+                "output_tokens": args.output_tokens,
+                "throttle_rate": args.throttle_rate,
+                "error_rate": args.error_rate,
+            },
+        },
+    )
+    output = args.output or os.path.join("benchmark_results", f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    benchmark.save_report(report, output)
+
+    print()
+    print(benchmark.format_report(report))
+    print(f"\n💾 結果を保存しました: {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        lines, regressed = benchmark.compare_reports(baseline, report, args.max_regression)
+        print(f"\n📈 {args.compare} との比較:")
+        print("\n".join(lines) or "比較できるシナリオがありません")
+        if regressed:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+変換ジョブのワーカー起動コマンド
+UIから登録された変換ジョブを、アプリとは別のプロセスで処理する
+複数のアプリ・ワーカーが同じジョブキュー（BEDROCK_JOB_QUEUE_PATH）を共有できる
+
+使用例:
+    uv run python job_worker.py --workers 4
+
+    # YAML変換のジョブだけを処理
+    uv run python job_worker.py --format yaml
+"""
+
+import argparse
+import logging
+import sys
+
+from utils.batch_runner import OUTPUT_FORMATS
+from utils.bedrock_client import verify_aws_credentials
+from utils.job_worker import start_worker_processes
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AWS Bedrock PDF 変換ジョブワーカー")
+    parser.add_argument("--workers", type=int, default=2, help="ワーカープロセス数")
+    parser.add_argument(
+        "--format",
+        nargs="+",
+        choices=sorted(OUTPUT_FORMATS),
+        default=sorted(OUTPUT_FORMATS),
+        help="処理するジョブの出力形式",
+    )
+    args = parser.parse_args(argv)
+
+    print("🚀 変換ジョブワーカーを起動します...")
+
+    # AWS認証確認
+    try:
+        identity = verify_aws_credentials()
+        print(f"✅ AWS認証: {identity['Arn']}")
+    except Exception as e:
+        print(f"❌ AWS認証エラー: {e}")
+        return 1
+
+    processes = start_worker_processes(max(1, args.workers), args.format)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("🛑 ワーカーを停止します...")
+        for process in processes:
+            process.terminate()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""
+Bedrockモックサーバー
+AWSに接続せずにアプリやベンチマークを動かすため、Converse/ConverseStream APIを模倣する
+
+使用例:
+    uv run python mock_bedrock_server.py --latency 0.8 --tokens-per-second 150
+
+    # 別のターミナルでモックバックエンドを使ってアプリを起動
+    BEDROCK_BACKEND=mock uv run python app.py
+"""
+
+import argparse
+import logging
+import sys
+
+from utils.mock_bedrock import DEFAULT_HOST, DEFAULT_PORT, MockBedrockServer, MockConfig
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def main(argv=None):
+    defaults = MockConfig()
+    parser = argparse.ArgumentParser(description="Bedrock Converse/ConverseStream モックサーバー")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="待ち受けアドレス")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="待ち受けポート")
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="最初のトークンまでの遅延（秒）")
+    parser.add_argument(
+        "--tokens-per-second", type=float, default=defaults.tokens_per_second, help="出力トークンの生成速度（0で即時）"
+    )
+    parser.add_argument("--output-tokens", type=int, default=defaults.output_tokens, help="1応答あたりの出力トークン数")
+    parser.add_argument(
+        "--tokens-per-chunk", type=int, default=defaults.tokens_per_chunk, help="ストリーミング1イベントあたりのトークン数"
+    )
+    parser.add_argument(
+        "--throttle-rate", type=float, default=defaults.throttle_rate, help="ThrottlingException を返す確率（0〜1）"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=defaults.error_rate, help="InternalServerException を返す確率（0〜1）"
+    )
+    parser.add_argument(
+        "--stream-error-rate",
+        type=float,
+        default=defaults.stream_error_rate,
+        help="ストリーミングの途中で modelStreamErrorException を返す確率（0〜1）",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=defaults.max_concurrency,
+        help="同時実行数の上限（超過分はスロットリング、0で無制限）",
+    )
+    parser.add_argument(
+        "--fast-model-speedup",
+        type=float,
+        default=defaults.fast_model_speedup,
+        help=f"モデルIDに {defaults.fast_model_pattern} を含む軽量モデルの速度倍率",
+    )
+    parser.add_argument("--seed", type=int, help="エラー注入の乱数シード")
+    args = parser.parse_args(argv)
+
+    config = MockConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        output_tokens=args.output_tokens,
+        tokens_per_chunk=args.tokens_per_chunk,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        stream_error_rate=args.stream_error_rate,
+        max_concurrency=args.max_concurrency,
+        seed=args.seed,
+        fast_model_speedup=args.fast_model_speedup,
+    )
+    server = MockBedrockServer(args.host, args.port, config)
+    print(f"🧪 Bedrockモックサーバーを起動しました: {server.endpoint_url}")
+    print(f"   BEDROCK_BACKEND=mock BEDROCK_ENDPOINT_URL={server.endpoint_url} で接続できます")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n🛑 停止しました（{server.stats}）")
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+マイジョブタブ
+バックグラウンドで実行する変換ジョブの一覧・状態・結果を表示する
+ブラウザを閉じても変換は続き、ジョブIDで後から結果を取得できる
+ジョブを見られるのは所有者（ログイン名、ログインしていなければブラウザに保存した推測できない識別子）のみ
+"""
+
+import hashlib
+import logging
+import os
+import secrets
+import time
+
+import gradio as gr
+
+from utils.document_loader import MAX_UPLOAD_BYTES, check_document_size
+from utils.job_queue import DEFAULT_JOB_QUEUE_PATH, STATUS_DONE, STATUS_FAILED, STATUS_QUEUED, get_job_queue
+from utils.job_worker import ensure_embedded_workers
+from utils.usage_ledger import user_from_request
+
+logger = logging.getLogger(__name__)
+
+# 一覧を自動更新する間隔（秒）
+REFRESH_INTERVAL = 5
+
+# ブラウザの識別子を保存する localStorage のキー
+OWNER_STORAGE_KEY = "bedrock_pdf_job_owner"
+
+# ブラウザに保存する値の暗号化キー（未設定ならジョブキューと同じ場所のファイルに生成し、再起動・複数のレプリカで共有する）
+BROWSER_STATE_SECRET = os.environ.get("BEDROCK_BROWSER_STATE_SECRET", "")
+BROWSER_STATE_SECRET_PATH = os.path.join(os.path.dirname(DEFAULT_JOB_QUEUE_PATH) or ".", "browser_state_secret")
+
+JOB_KIND_LABELS = {
+    "yaml": "📋 YAML",
+    "markdown": "📝 マークダウン",
+}
+
+JOB_TABLE_HEADERS = ["ジョブID", "種類", "ファイル", "状態", "登録", "完了", "モデル"]
+
+
+def format_time(timestamp):
+    """UNIX時刻を表示用に整形"""
+    if not timestamp:
+        return ""
+    return time.strftime("%m/%d %H:%M:%S", time.localtime(timestamp))
+
+
+def browser_state_secret(path=BROWSER_STATE_SECRET_PATH):
+    """ブラウザに保存する値の暗号化キーを取得（なければ生成してファイルに保存）"""
+    if BROWSER_STATE_SECRET:
+        return BROWSER_STATE_SECRET
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    secret = secrets.token_urlsafe(32)
+    try:
+        # 同時に起動した他のプロセスが先に作っていれば、そちらを使う
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip()
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(secret)
+    return secret
+
+
+def create_owner_state():
+    """ジョブの所有者を表すブラウザごとの識別子（localStorageに暗号化して保存）"""
+    return gr.BrowserState("", storage_key=OWNER_STORAGE_KEY, secret=browser_state_secret())
+
+
+def ensure_owner_token(token):
+    """ブラウザの識別子がなければ作成する（ページの読み込み時に呼ぶ）"""
+    return token or secrets.token_urlsafe(32)
+
+
+def job_owner(request, token):
+    """ジョブの所有者（ログイン名、なければブラウザの識別子のハッシュ。識別できなければNone）
+
+    接続元IPやヘッダーは他の利用者が名乗れるため使わない。
+    """
+    username = getattr(request, "username", None)
+    if username:
+        return username
+    if not token:
+        return None
+    return "browser:" + hashlib.sha256(token.encode("utf-8")).hexdigest()[:32]
+
+
+def submit_conversion_job(kind, pdf_file, chunked, pages_per_chunk, model_hint, owner_token, request):
+    """変換をジョブとして登録し、登録結果のメッセージを返す"""
+    if not pdf_file:
+        return "PDFファイルを選択してください。"
+    owner = job_owner(request, owner_token)
+    if owner is None:
+        return "エラー: ブラウザを識別できません。ページを再読み込みしてください。"
+
+    try:
+        # 分割変換を選べるため、ここではファイル全体の上限で確認する
+        check_document_size(pdf_file, MAX_UPLOAD_BYTES)
+        job_id = get_job_queue().submit(
+            user_from_request(request),
+            kind,
+            pdf_file,
+            options={
+                "chunked": bool(chunked),
+                "pages_per_chunk": int(pages_per_chunk),
+                "model_hint": model_hint,
+            },
+            owner=owner,
+        )
+    except Exception as e:
+        return f"エラー: {str(e)}"
+
+    # app.py から起動するワーカーは、最初のジョブの登録時に起動する
+    ensure_embedded_workers()
+    return (
+        f"📥 ジョブを登録しました（ジョブID: {job_id}）\n"
+        "バックグラウンドで変換します。ブラウザを閉じても処理は続き、"
+        "「📋 マイジョブ」タブで状態と結果を確認できます。"
+    )
+
+
+def list_my_jobs(owner_token, request: gr.Request):
+    """利用者のジョブ一覧を表の行として返す"""
+    owner = job_owner(request, owner_token)
+    if owner is None:
+        return []
+    jobs = get_job_queue().list_jobs(owner)
+    if any(not job.finished for job in jobs):
+        # 再起動前に登録された未完了のジョブも処理されるよう、ワーカーが動いていなければ起動する
+        ensure_embedded_workers()
+    return [
+        [
+            job.job_id,
+            JOB_KIND_LABELS.get(job.kind, job.kind),
+            job.document_name,
+            job.status_label,
+            format_time(job.created_at),
+            format_time(job.finished_at),
+            job.model_id or "",
+        ]
+        for job in jobs
+    ]
+
+
+def show_job(job_id, owner_token, request: gr.Request):
+    """ジョブの状態と結果（完了していれば結果ファイル）を返す"""
+    job_id = (job_id or "").strip()
+    if not job_id:
+        return "ジョブIDを入力するか、一覧の行を選択してください。", None
+
+    queue = get_job_queue()
+    owner = job_owner(request, owner_token)
+    job = queue.get(job_id, owner=owner) if owner is not None else None
+    if job is None:
+        return "ジョブが見つかりません（登録した本人のジョブのみ表示できます）。", None
+
+    if job.status == STATUS_DONE:
+        return job.result_text, job.output_path
+    if job.status == STATUS_FAILED:
+        return f"{job.status_label}（{format_time(job.finished_at)}）\n{job.error}", None
+    if job.status == STATUS_QUEUED:
+        position = queue.queue_position(job.job_id)
+        waiting = f"（前に {position} 件）" if position else ""
+        return f"{job.status_label}{waiting}", None
+    return f"{job.status_label}（開始 {format_time(job.started_at)}、{job.attempts} 回目）", None
+
+
+def create_jobs_tab(owner_state):
+    """マイジョブタブを作成（owner_state は create_owner_state のブラウザの識別子）"""
+
+    def select_job(evt: gr.SelectData):
+        return evt.row_value[0]
+
+    with gr.Column():
+        gr.Markdown("## 📋 マイジョブ")
+        gr.Markdown("「ジョブとして登録」した変換の状態と結果を確認できます")
+
+        with gr.Row():
+            refresh_btn = gr.Button("🔄 一覧を更新", size="sm")
+
+        jobs_table = gr.Dataframe(
+            headers=JOB_TABLE_HEADERS,
+            datatype=["str"] * len(JOB_TABLE_HEADERS),
+            interactive=False,
+            wrap=True,
+        )
+
+        with gr.Row():
+            job_id_input = gr.Textbox(label="🔑 ジョブID", placeholder="一覧の行を選択するとここに入ります")
+            show_btn = gr.Button("📄 結果を表示", variant="primary")
+
+        with gr.Row():
+            result_output = gr.Textbox(label="📋 結果", lines=20, show_copy_button=True)
+            result_file = gr.File(label="💾 結果ファイル")
+
+        # イベント設定
+        timer = gr.Timer(REFRESH_INTERVAL)
+        timer.tick(list_my_jobs, owner_state, jobs_table, show_progress="hidden")
+        refresh_btn.click(list_my_jobs, owner_state, jobs_table)
+        jobs_table.select(select_job, None, job_id_input).then(
+            show_job, [job_id_input, owner_state], [result_output, result_file]
+        )
+        show_btn.click(show_job, [job_id_input, owner_state], [result_output, result_file])
+
+    return jobs_table
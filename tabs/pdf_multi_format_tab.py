@@ -0,0 +1,124 @@
+"""
+PDFを複数の形式にまとめて変換するタブ
+Bedrockの呼び出しは1回だけで、マークダウン・YAML・JSON・CSVは取り出した構造からローカルで書き出す
+"""
+
+import asyncio
+import logging
+import os
+import tempfile
+from dataclasses import replace
+
+import gradio as gr
+from botocore.exceptions import ClientError
+
+from tabs.pdf_to_yaml_tab import PDFToYAMLProcessor
+from utils.bedrock_client import LazyProcessor
+from utils.bedrock_processor import format_client_error, format_result_text, sanitize_document_name
+from utils.file_loader import load_ui_text
+from utils.model_router import AUTO_HINT, get_model_router
+from utils.multi_format import RENDERED_FORMATS, extract_structure, write_outputs
+from utils.pdf_chunker import DEFAULT_PAGES_PER_CHUNK
+from utils.scheduler import get_scheduler
+from utils.usage_ledger import user_from_request
+
+logger = logging.getLogger(__name__)
+
+
+def create_pdf_multi_format_tab():
+    """まとめて変換タブを作成"""
+    # YAML変換と同じプロンプトで構造を取り出すため、YAML変換のプロセッサを共有する
+    processor = LazyProcessor(PDFToYAMLProcessor)
+    format_choices = [(spec.label, name) for name, spec in RENDERED_FORMATS.items()]
+
+    async def handle_conversion(
+        pdf_file, formats, chunked, pages_per_chunk, model_hint, request: gr.Request, progress=gr.Progress()
+    ):
+        if not pdf_file:
+            return "PDFファイルを選択してください。", None
+        if not formats:
+            return "出力形式を1つ以上選択してください。", None
+
+        try:
+            result, data = await asyncio.to_thread(
+                extract_structure,
+                processor.get(),
+                pdf_file,
+                chunked=chunked,
+                pages_per_chunk=int(pages_per_chunk),
+                progress_callback=lambda done, total: progress((done, total), desc="チャンク変換中"),
+                user=user_from_request(request),
+                model_hint=model_hint,
+            )
+            output_dir = tempfile.mkdtemp(prefix="bedrock_multi_format_")
+            paths = write_outputs(data, formats, os.path.join(output_dir, sanitize_document_name(pdf_file)))
+        except ClientError as e:
+            return format_client_error(e), None
+        except Exception as e:
+            return f"エラー: {str(e)}", None
+
+        labels = "、".join(RENDERED_FORMATS[name].label for name in paths)
+        sections = data.get("sections")
+        summary = f"✅ 1回の変換から {len(paths)} 形式を出力しました: {labels}\n"
+        summary += f"📑 セクション: {len(sections) if isinstance(sections, list) else 0} 件"
+        # 本文は出力ファイルにあるため、フッター（使用量・モデル・検証結果）だけを表示する
+        return format_result_text(replace(result, text=summary)), list(paths.values())
+
+    with gr.Column():
+        gr.Markdown("## 📄➡️🗂️ まとめて変換")
+        gr.Markdown("PDFを1回だけ変換し、マークダウン・YAML・JSON・CSVを同じ内容からまとめて出力します")
+
+        with gr.Row():
+            with gr.Column():
+                pdf_input = gr.File(
+                    label="📄 PDFファイル",
+                    file_types=[".pdf"],
+                    type="filepath"
+                )
+                formats_input = gr.CheckboxGroup(
+                    choices=format_choices,
+                    label="出力形式（複数選択可）",
+                    value=["markdown", "yaml"]
+                )
+                with gr.Accordion("⚙️ 大きなPDFの分割変換", open=False):
+                    chunked_input = gr.Checkbox(
+                        label="ページ範囲に分割して並列変換する",
+                        value=False
+                    )
+                    pages_per_chunk_input = gr.Slider(
+                        minimum=5,
+                        maximum=100,
+                        value=DEFAULT_PAGES_PER_CHUNK,
+                        step=5,
+                        label="📑 1チャンクあたりのページ数"
+                    )
+                model_hint_input = gr.Dropdown(
+                    label="🤖 モデル",
+                    choices=get_model_router().hint_choices(),
+                    value=AUTO_HINT,
+                    info="auto: ページ数・サイズからモデルを自動で選びます（分割変換ではチャンクごと）"
+                )
+                convert_btn = gr.Button("🔄 まとめて変換開始", variant="primary")
+
+            with gr.Column():
+                output = gr.Textbox(
+                    label="📋 変換結果",
+                    lines=8,
+                    show_copy_button=True,
+                    placeholder="変換結果の概要がここに表示されます..."
+                )
+                files_output = gr.File(label="💾 出力ファイル", file_count="multiple")
+
+        # イベント設定（呼び出すのはYAML変換と同じ処理のため、同時実行数も共有する）
+        convert_btn.click(
+            handle_conversion,
+            [pdf_input, formats_input, chunked_input, pages_per_chunk_input, model_hint_input],
+            [output, files_output],
+            concurrency_limit=get_scheduler().tab_limit("yaml"),
+            concurrency_id="bedrock_yaml"
+        )
+
+        # 使用方法
+        with gr.Accordion("📖 まとめて変換について", open=False):
+            help_text = load_ui_text("pdf_multi_format_help")
+            gr.Markdown(help_text)
@@ -3,101 +3,179 @@ PDFをマークダウンに変換するタブ
 AWS Bedrock Claude Sonnet 4を使用してPDFを読みやすいマークダウン形式に変換
 """
 
+import asyncio
 import gradio as gr
-import boto3
 import os
 import logging
 from botocore.exceptions import ClientError
 from utils.file_loader import load_prompt, load_ui_text
+from utils.bedrock_client import LazyProcessor
+from utils.bedrock_processor import (
+    DEFAULT_CHUNK_WORKERS,
+    BedrockDocumentProcessor,
+    format_client_error,
+    format_result_text,
+)
+from utils.scheduler import get_scheduler
+from utils.usage_ledger import user_from_request
+from utils.model_router import AUTO_HINT, get_model_router
+from utils.document_loader import describe_document
+from tabs.jobs_tab import submit_conversion_job
+from utils.pdf_chunker import DEFAULT_PAGES_PER_CHUNK, count_pages, merge_markdown_chunks
 
 logger = logging.getLogger(__name__)
 
 
-class PDFToMarkdownProcessor:
+class PDFToMarkdownProcessor(BedrockDocumentProcessor):
     """PDFをマークダウン形式に変換するクラス"""
     
+    tab_name = "markdown"
+    prompt_as_system = True
+    
     def __init__(self, region="ap-northeast-1"):
         try:
-            self.bedrock_client = boto3.client("bedrock-runtime", region_name=region)
+            super().__init__(region)
             logger.info("PDF→マークダウン変換機能用AWS認証成功")
         except Exception as e:
             logger.error(f"PDF→マークダウン変換機能AWS認証エラー: {str(e)}")
             raise
-            
-        self.model_id = "apac.anthropic.claude-sonnet-4-20250514-v1:0"
     
-    def convert_pdf_to_markdown(self, pdf_file):
+    def convert_pdf_to_markdown(self, pdf_file, user=None, model_hint=None):
         """PDFファイルをマークダウン形式に変換"""
         if not pdf_file:
             return "PDFファイルを選択してください。"
         
         try:
-            # ファイル形式を取得
-            input_document_format = pdf_file.split(".")[-1]
-            
-            # ドキュメントを読み込み
-            with open(pdf_file, 'rb') as f:
-                input_document = f.read()
-            
-            # ファイル名をサニタイズ
-            base_name = os.path.splitext(os.path.basename(pdf_file))[0]
-            sanitized_name = ''.join(c for c in base_name if c.isalnum()) or "PDF"
-            
             # マークダウン変換用のプロンプトを外部ファイルから読み込み
-            conversion_prompt = load_prompt("pdf_to_markdown_prompt")
+            conversion_prompt = load_prompt("pdf_to_markdown_prompt", user)
             
-            # メッセージを構築
-            message = {
-                "role": "user",
-                "content": [
-                    {"text": conversion_prompt},
-                    {
-                        "document": {
-                            "name": sanitized_name,
-                            "format": input_document_format,
-                            "source": {"bytes": input_document},
-                            "citations": {"enabled": True},  
-                        }
-                    },
-                ],
-            }
+            result = self.run_document_request(pdf_file, conversion_prompt, user=user, model_hint=model_hint)
+            return format_result_text(result)
             
-            # Converse APIを呼び出し
-            response = self.bedrock_client.converse(
-                modelId=self.model_id,
-                messages=[message]
+        except ClientError as e:
+            return format_client_error(e)
+        except Exception as e:
+            return f"エラー: {str(e)}"
+    
+    def convert_pdf_to_markdown_chunked(
+        self,
+        pdf_file,
+        pages_per_chunk=DEFAULT_PAGES_PER_CHUNK,
+        max_workers=DEFAULT_CHUNK_WORKERS,
+        progress_callback=None,
+        user=None,
+        model_hint=None,
+    ):
+        """PDFをページ範囲に分割して並列にマークダウン変換し、結果をマージ"""
+        if not pdf_file:
+            return "PDFファイルを選択してください。"
+        
+        try:
+            conversion_prompt = load_prompt("pdf_to_markdown_prompt", user)
+            
+            result = self.run_chunked_document_request(
+                pdf_file,
+                conversion_prompt,
+                merge_markdown_chunks,
+                pages_per_chunk=pages_per_chunk,
+                max_workers=max_workers,
+                progress_callback=progress_callback,
+                user=user,
+                model_hint=model_hint,
             )
+            return format_result_text(result)
             
-            # レスポンスから結果を抽出
-            output_message = response['output']['message']
-            result_text = ""
+        except ClientError as e:
+            return format_client_error(e)
+        except Exception as e:
+            return f"エラー: {str(e)}"
+    
+    def convert_pdf_to_markdown_stream(self, pdf_file, user=None, model_hint=None):
+        """PDFファイルをマークダウン形式に変換（ストリーミング）"""
+        if not pdf_file:
+            yield "PDFファイルを選択してください。"
+            return
+        
+        try:
+            conversion_prompt = load_prompt("pdf_to_markdown_prompt", user)
             
-            for content in output_message['content']:
-                if 'text' in content:
-                    result_text += content['text']
+            for result in self.stream_document_request(pdf_file, conversion_prompt, user=user, model_hint=model_hint):
+                yield format_result_text(result)
             
-            # トークン使用量を追加
-            if 'usage' in response:
-                token_usage = response['usage']
-                result_text += f"\n\n---\n📊 トークン使用量: 入力 {token_usage.get('inputTokens', 'N/A')}, 出力 {token_usage.get('outputTokens', 'N/A')}, 合計 {token_usage.get('totalTokens', 'N/A')}"
+        except ClientError as e:
+            yield format_client_error(e)
+        except Exception as e:
+            yield f"エラー: {str(e)}"
+    
+    async def aconvert_pdf_to_markdown(self, pdf_file, user=None, model_hint=None):
+        """convert_pdf_to_markdownの非同期版"""
+        if not pdf_file:
+            return "PDFファイルを選択してください。"
+        
+        try:
+            conversion_prompt = load_prompt("pdf_to_markdown_prompt", user)
             
-            return result_text
+            result = await self.arun_document_request(pdf_file, conversion_prompt, user=user, model_hint=model_hint)
+            return format_result_text(result)
             
         except ClientError as e:
-            error_msg = str(e)
-            if "Extra inputs are not permitted" in error_msg and "citations" in error_msg:
-                return f"❌ Citations機能エラー: {error_msg}\n\n対処法: リージョンを ap-northeast-1 に変更し、AWSサポートに機能の利用可能性を確認してください。"
-            return f"AWS APIエラー: {error_msg}"
+            return format_client_error(e)
         except Exception as e:
             return f"エラー: {str(e)}"
+    
+    async def aconvert_pdf_to_markdown_stream(self, pdf_file, user=None, model_hint=None):
+        """convert_pdf_to_markdown_streamの非同期版"""
+        if not pdf_file:
+            yield "PDFファイルを選択してください。"
+            return
+        
+        try:
+            conversion_prompt = load_prompt("pdf_to_markdown_prompt", user)
+            
+            async for result in self.astream_document_request(pdf_file, conversion_prompt, user=user, model_hint=model_hint):
+                yield format_result_text(result)
+            
+        except ClientError as e:
+            yield format_client_error(e)
+        except Exception as e:
+            yield f"エラー: {str(e)}"
 
 
-def create_pdf_to_markdown_tab():
+def create_pdf_to_markdown_tab(owner_state):
     """PDF→マークダウン変換タブを作成"""
-    processor = PDFToMarkdownProcessor()
+    # プロセッサ（boto3クライアント・AWS認証）は最初の変換時に作成する
+    processor = LazyProcessor(PDFToMarkdownProcessor)
+    
+    async def handle_conversion(
+        pdf_file, chunked, pages_per_chunk, model_hint, request: gr.Request, progress=gr.Progress()
+    ):
+        try:
+            processor.get()
+        except Exception as e:
+            yield f"エラー: AWSの初期化に失敗しました: {str(e)}"
+            return
+        
+        user = user_from_request(request)
+        if not chunked:
+            async for text in processor.aconvert_pdf_to_markdown_stream(
+                pdf_file, user=user, model_hint=model_hint
+            ):
+                yield text
+            return
+        
+        # 分割変換はチャンクごとのスレッドプールで実行する
+        yield "⏳ ページ範囲ごとに並列変換しています..."
+        yield await asyncio.to_thread(
+            processor.convert_pdf_to_markdown_chunked,
+            pdf_file,
+            pages_per_chunk=int(pages_per_chunk),
+            progress_callback=lambda done, total: progress((done, total), desc="チャンク変換中"),
+            user=user,
+            model_hint=model_hint,
+        )
     
-    def handle_conversion(pdf_file):
-        return processor.convert_pdf_to_markdown(pdf_file)
+    def handle_job_submit(pdf_file, chunked, pages_per_chunk, model_hint, owner_token, request: gr.Request):
+        return submit_conversion_job("markdown", pdf_file, chunked, pages_per_chunk, model_hint, owner_token, request)
     
     def show_file_info(pdf_file):
         if not pdf_file:
@@ -107,10 +185,15 @@ def create_pdf_to_markdown_tab():
         base_name = os.path.splitext(original)[0]
         sanitized = ''.join(c for c in base_name if c.isalnum()) or "PDF"
         
-        file_size = os.path.getsize(pdf_file) / (1024 * 1024)  # MB
+        # サイズとページ数はメモリマップで読み、上限を超えていれば注意を表示
+        file_size, page_count, warnings = describe_document(pdf_file, count_pages)
         
         info = f"📄 ファイル名: {original}\n"
-        info += f"📏 ファイルサイズ: {file_size:.2f} MB\n"
+        info += f"📏 ファイルサイズ: {file_size / (1024 * 1024):.2f} MB\n"
+        if page_count is not None:
+            info += f"📑 ページ数: {page_count}\n"
+        for warning in warnings:
+            info += f"⚠️ {warning}\n"
         
         if base_name != sanitized:
             info += f"⚠️ 使用される名前: {sanitized}.pdf"
@@ -135,7 +218,26 @@ def create_pdf_to_markdown_tab():
                     lines=3,
                     interactive=False
                 )
+                with gr.Accordion("⚙️ 大きなPDFの分割変換", open=False):
+                    chunked_input = gr.Checkbox(
+                        label="ページ範囲に分割して並列変換する",
+                        value=False
+                    )
+                    pages_per_chunk_input = gr.Slider(
+                        minimum=5,
+                        maximum=100,
+                        value=DEFAULT_PAGES_PER_CHUNK,
+                        step=5,
+                        label="📑 1チャンクあたりのページ数"
+                    )
+                model_hint_input = gr.Dropdown(
+                    label="🤖 モデル",
+                    choices=get_model_router().hint_choices(),
+                    value=AUTO_HINT,
+                    info="auto: ページ数・サイズからモデルを自動で選びます（分割変換ではチャンクごと）"
+                )
                 convert_btn = gr.Button("🔄 マークダウン変換開始", variant="primary")
+                job_btn = gr.Button("📥 ジョブとして登録（バックグラウンドで変換）")
             
             with gr.Column():
                 output = gr.Textbox(
@@ -147,7 +249,18 @@ def create_pdf_to_markdown_tab():
         
         # イベント設定
         pdf_input.change(show_file_info, pdf_input, file_info)
-        convert_btn.click(handle_conversion, pdf_input, output)
+        convert_btn.click(
+            handle_conversion,
+            [pdf_input, chunked_input, pages_per_chunk_input, model_hint_input],
+            output,
+            concurrency_limit=get_scheduler().tab_limit("markdown"),
+            concurrency_id="bedrock_markdown"
+        )
+        job_btn.click(
+            handle_job_submit,
+            [pdf_input, chunked_input, pages_per_chunk_input, model_hint_input, owner_state],
+            output
+        )
         
         # 使用方法
         with gr.Accordion("📖 PDF→マークダウン変換について", open=False):
@@ -0,0 +1,132 @@
+"""
+リトライ予算とサーキットブレーカーの状態遷移のテスト
+予算はリクエスト数に応じて積み立てた分だけ再試行を許し、ブレーカーは
+closed → open → half_open（試しの1件）→ closed / open と遷移することを確認する
+"""
+
+import pytest
+
+from utils import failover
+from utils.failover import CircuitBreaker, FailoverTarget, RetryBudget
+
+THRESHOLD = 3
+COOLDOWN = 30
+TARGET = FailoverTarget("ap-northeast-1", "apac.anthropic.claude-sonnet-4-20250514-v1:0")
+
+
+class FakeClock:
+    """failover の time を置き換え、クールダウンの経過を再現する"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(failover, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker(TARGET, failure_threshold=THRESHOLD, cooldown=COOLDOWN)
+
+
+def open_breaker(breaker):
+    for _ in range(THRESHOLD):
+        breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_retry_budget_allows_minimum_then_refills_by_ratio():
+    budget = RetryBudget(ratio=0.5, minimum=2)
+
+    assert budget.withdraw()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+    # リクエスト2件で再試行1回分が貯まる
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+    assert budget.balance == 0
+
+
+def test_retry_budget_is_capped():
+    budget = RetryBudget(ratio=0.5, minimum=2)
+    for _ in range(1000):
+        budget.deposit()
+
+    assert budget.balance == budget.capacity
+    withdrawn = 0
+    while budget.withdraw():
+        withdrawn += 1
+    assert withdrawn == int(budget.capacity)
+
+
+def test_breaker_opens_after_consecutive_failures(breaker):
+    for _ in range(THRESHOLD - 1):
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_success_resets_failure_count(breaker):
+    for _ in range(THRESHOLD - 1):
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(THRESHOLD - 1):
+        breaker.record_failure()
+
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_one_probe_through_and_closes_on_success(clock, breaker):
+    open_breaker(breaker)
+
+    clock.advance(COOLDOWN)
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_breaker(clock, breaker):
+    open_breaker(breaker)
+    clock.advance(COOLDOWN)
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    clock.advance(COOLDOWN)
+    assert breaker.allow()
+
+
+def test_abandoned_probe_is_replaced_after_cooldown(clock, breaker):
+    open_breaker(breaker)
+    clock.advance(COOLDOWN)
+    # 試しの呼び出しの結果が記録されないまま
+    assert breaker.allow()
+
+    clock.advance(COOLDOWN - 1)
+    assert not breaker.allow()
+    clock.advance(1)
+    assert breaker.allow()
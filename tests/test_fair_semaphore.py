@@ -0,0 +1,129 @@
+"""
+FairSemaphore の割り当て順のテスト
+同期・非同期の待ち手が到着順に割り当てられ、空きがあっても後から来た要求が先頭を追い越さないことを確認する
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.fair_semaphore import FairSemaphore
+
+
+def wait_for_waiters(semaphore, count, timeout=5):
+    """待ち行列に count 件が並ぶまで待つ（スレッドの到着順を固定するため）"""
+    deadline = time.monotonic() + timeout
+    while len(semaphore._waiters) < count:
+        assert time.monotonic() < deadline, "待ち手が並びませんでした"
+        time.sleep(0.001)
+
+
+def start_waiter(semaphore, amount, name, order):
+    def run():
+        semaphore.acquire(amount)
+        order.append(name)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_sync_waiters_are_granted_in_arrival_order():
+    semaphore = FairSemaphore(1)
+    semaphore.acquire()
+    order = []
+    threads = []
+    for index, name in enumerate(["a", "b", "c"], start=1):
+        threads.append(start_waiter(semaphore, 1, name, order))
+        wait_for_waiters(semaphore, index)
+
+    # 1件ずつ返却し、そのたびに先頭の待ち手だけが割り当てられる
+    for thread in threads:
+        semaphore.release()
+        thread.join(timeout=5)
+
+    assert order == ["a", "b", "c"]
+    assert semaphore.in_use == 1
+
+
+def test_small_request_does_not_overtake_queued_large_request():
+    semaphore = FairSemaphore(4)
+    semaphore.acquire(1)
+    semaphore.acquire(2)
+    order = []
+    large = start_waiter(semaphore, 3, "large", order)
+    wait_for_waiters(semaphore, 1)
+
+    # 1 の空きはあるが、先頭の待ち手（3）を追い越さない
+    assert not semaphore.try_acquire(1)
+    small = start_waiter(semaphore, 1, "small", order)
+    wait_for_waiters(semaphore, 2)
+
+    # 空きが2になっても先頭は入らないため、後ろの待ち手も割り当てられない
+    semaphore.release(1)
+    time.sleep(0.05)
+    assert order == []
+    assert len(semaphore._waiters) == 2
+
+    semaphore.release(2)
+    large.join(timeout=5)
+    small.join(timeout=5)
+    assert sorted(order) == ["large", "small"]
+    assert semaphore.in_use == 4
+
+
+def test_async_waiter_is_not_overtaken_by_later_sync_waiter():
+    semaphore = FairSemaphore(1)
+    semaphore.acquire()
+    order = []
+
+    async def main():
+        task = asyncio.ensure_future(semaphore.acquire_async())
+        while not semaphore._waiters:
+            await asyncio.sleep(0.001)
+        thread = start_waiter(semaphore, 1, "sync", order)
+        await asyncio.to_thread(wait_for_waiters, semaphore, 2)
+
+        semaphore.release()
+        await task
+        order.append("async")
+        semaphore.release()
+        await asyncio.to_thread(thread.join, 5)
+
+    asyncio.run(main())
+    assert order == ["async", "sync"]
+
+
+def test_cancelled_async_waiter_is_removed_and_next_waiter_is_granted():
+    semaphore = FairSemaphore(1)
+    semaphore.acquire()
+    order = []
+
+    async def main():
+        task = asyncio.ensure_future(semaphore.acquire_async())
+        while not semaphore._waiters:
+            await asyncio.sleep(0.001)
+        thread = start_waiter(semaphore, 1, "sync", order)
+        await asyncio.to_thread(wait_for_waiters, semaphore, 2)
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert len(semaphore._waiters) == 1
+
+        semaphore.release()
+        await asyncio.to_thread(thread.join, 5)
+
+    asyncio.run(main())
+    assert order == ["sync"]
+    assert semaphore.in_use == 1
+
+
+def test_release_more_than_acquired_raises():
+    semaphore = FairSemaphore(2)
+    semaphore.acquire(1)
+    with pytest.raises(ValueError):
+        semaphore.release(2)
+    assert semaphore.in_use == 1
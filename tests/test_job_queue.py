@@ -0,0 +1,192 @@
+"""
+変換ジョブキューの取り出し（claim）のテスト
+SQLite版とRedis版（fakeredis）で、同じジョブを2つのワーカーが取り出さないこと、
+ハートビートが途絶えたジョブの引き継ぎ、試行回数の上限での打ち切りを確認する
+"""
+
+import threading
+
+import pytest
+
+from utils import job_queue
+from utils.job_queue import (
+    STATUS_FAILED,
+    STATUS_QUEUED,
+    STATUS_RUNNING,
+    JobQueue,
+    RedisJobQueue,
+)
+
+LEASE_SECONDS = 30
+MAX_ATTEMPTS = 2
+
+
+class FakeClock:
+    """job_queue の time を置き換え、時刻を進めてハートビートの期限切れを再現する"""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(job_queue, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def pdf_file(tmp_path):
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(b"%PDF-1.4\n")
+    return str(path)
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def make_queue(request, tmp_path):
+    """同じ保存先を共有するキューを作る関数（呼ぶたびに別のワーカー・レプリカに相当する接続を作る）"""
+    files_dir = str(tmp_path / "files")
+    if request.param == "sqlite":
+        path = str(tmp_path / "jobs.db")
+
+        def make():
+            return JobQueue(path=path, files_dir=files_dir, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS)
+
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        server = fakeredis.FakeServer()
+
+        def make():
+            return RedisJobQueue(
+                client=fakeredis.FakeStrictRedis(server=server),
+                files_dir=files_dir,
+                lease_seconds=LEASE_SECONDS,
+                max_attempts=MAX_ATTEMPTS,
+            )
+
+    return make
+
+
+def test_claim_returns_oldest_queued_job(clock, make_queue, pdf_file):
+    queue = make_queue()
+    first = queue.submit("u1", "yaml", pdf_file)
+    clock.advance(1)
+    second = queue.submit("u1", "yaml", pdf_file)
+
+    job = queue.claim("w1")
+    assert job.job_id == first
+    assert job.status == STATUS_RUNNING
+    assert job.worker_id == "w1"
+    assert job.attempts == 1
+    assert queue.get(second).status == STATUS_QUEUED
+
+
+def test_claim_filters_by_kind(clock, make_queue, pdf_file):
+    queue = make_queue()
+    queue.submit("u1", "yaml", pdf_file)
+    clock.advance(1)
+    markdown = queue.submit("u1", "markdown", pdf_file)
+
+    assert queue.claim("w1", kinds=["markdown"]).job_id == markdown
+    assert queue.claim("w1", kinds=["markdown"]) is None
+
+
+def test_concurrent_claims_take_each_job_once(clock, make_queue, pdf_file):
+    queues = [make_queue() for _ in range(4)]
+    job_ids = []
+    for _ in range(20):
+        job_ids.append(queues[0].submit("u1", "yaml", pdf_file))
+        clock.advance(1)
+
+    claimed = []
+    claimed_lock = threading.Lock()
+
+    def work(queue, worker_id):
+        while True:
+            job = queue.claim(worker_id)
+            if job is None:
+                return
+            with claimed_lock:
+                claimed.append(job.job_id)
+
+    threads = [threading.Thread(target=work, args=(queue, f"w{i}")) for i, queue in enumerate(queues)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == sorted(job_ids)
+    assert all(queues[0].get(job_id).attempts == 1 for job_id in job_ids)
+
+
+def test_running_job_is_not_taken_while_heartbeat_is_fresh(clock, make_queue, pdf_file):
+    first, second = make_queue(), make_queue()
+    job_id = first.submit("u1", "yaml", pdf_file)
+    assert first.claim("w1").job_id == job_id
+
+    clock.advance(LEASE_SECONDS - 1)
+    assert second.claim("w2") is None
+
+    # ハートビートを送り続けている間は、期限を過ぎても引き継がれない
+    assert first.heartbeat(job_id, "w1")
+    clock.advance(LEASE_SECONDS - 1)
+    assert second.claim("w2") is None
+    assert second.get(job_id).worker_id == "w1"
+
+
+def test_stale_job_is_taken_over(clock, make_queue, pdf_file):
+    first, second = make_queue(), make_queue()
+    job_id = first.submit("u1", "yaml", pdf_file)
+    first.claim("w1")
+
+    clock.advance(LEASE_SECONDS + 1)
+    job = second.claim("w2")
+    assert job.job_id == job_id
+    assert job.worker_id == "w2"
+    assert job.attempts == 2
+
+    # 引き継がれた後は、元のワーカーのハートビート・完了は反映されない
+    assert not first.heartbeat(job_id, "w1")
+    first.complete(job_id, "w1", "stale result")
+    job = second.get(job_id)
+    assert job.status == STATUS_RUNNING
+    assert job.worker_id == "w2"
+    assert job.result_text is None
+
+
+def test_job_fails_after_max_attempts(clock, make_queue, pdf_file):
+    queue = make_queue()
+    job_id = queue.submit("u1", "yaml", pdf_file)
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        job = queue.claim(f"w{attempt}")
+        assert job.job_id == job_id
+        assert job.attempts == attempt
+        clock.advance(LEASE_SECONDS + 1)
+
+    assert queue.claim("w-last") is None
+    job = queue.get(job_id)
+    assert job.status == STATUS_FAILED
+    assert job.error == "ワーカーが応答しなくなったため中止しました"
+    assert job.finished_at == clock.now
+
+
+def test_abandoned_job_does_not_block_later_jobs(clock, make_queue, pdf_file):
+    queue = make_queue()
+    stale = queue.submit("u1", "yaml", pdf_file)
+    clock.advance(1)
+    later = queue.submit("u1", "yaml", pdf_file)
+
+    for _ in range(MAX_ATTEMPTS):
+        assert queue.claim("w1").job_id == stale
+        clock.advance(LEASE_SECONDS + 1)
+
+    # 試行回数を使い切ったジョブを打ち切ったうえで、次のジョブを取り出す
+    assert queue.claim("w2").job_id == later
+    assert queue.get(stale).status == STATUS_FAILED
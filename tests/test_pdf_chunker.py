@@ -0,0 +1,84 @@
+"""
+チャンクごとの変換結果の結合のテスト
+マークダウンは見出しレベルを揃えて連結し、YAMLはトップレベルキー単位でマージすることを確認する
+"""
+
+import yaml
+
+from utils.pdf_chunker import merge_markdown_chunks, merge_yaml_chunks
+
+
+def load_merged(text):
+    assert text.startswith("```yaml\n") and text.endswith("```")
+    return yaml.safe_load(text[len("```yaml\n"):-3])
+
+
+def test_markdown_headings_are_shifted_below_document_title():
+    merged = merge_markdown_chunks(
+        [
+            "```markdown\n# タイトル\n\n## 1章\n本文\n```",
+            "# 2章\n本文\n\n## 2.1節",
+        ]
+    )
+
+    assert merged == "# タイトル\n\n## 1章\n本文\n\n## 2章\n本文\n\n### 2.1節"
+
+
+def test_markdown_headings_are_aligned_to_first_chunk_level():
+    merged = merge_markdown_chunks(["## 1章\n\n## 2章", "# 3章\n### 3.1節"])
+
+    assert merged == "## 1章\n\n## 2章\n\n## 3章\n#### 3.1節"
+
+
+def test_markdown_headings_in_code_blocks_are_kept():
+    merged = merge_markdown_chunks(["# タイトル", "# 2章\n```\n# コメント\n```"])
+
+    assert merged == "# タイトル\n\n## 2章\n```\n# コメント\n```"
+
+
+def test_markdown_without_chunks_is_empty():
+    assert merge_markdown_chunks([]) == ""
+
+
+def test_yaml_chunks_are_merged_by_top_level_key():
+    first = """```yaml
+document:
+  title: "報告書"
+  pages: 10
+summary:
+  overview: "前半の概要"
+  key_points: ["a", "b"]
+sections:
+  - title: "1章"
+```"""
+    second = """```yaml
+document:
+  title: "別のタイトル"
+  language: "ja"
+summary:
+  overview: "後半の概要"
+  key_points: ["b", "c"]
+sections:
+  - title: "2章"
+tables:
+  - caption: "表1"
+```"""
+
+    merged = load_merged(merge_yaml_chunks([first, second], [(1, 10), (11, 20)], 20))
+
+    # スカラーは先勝ち、ページ数は全体のページ数、リストは連結（同じ値は1つ）
+    assert merged["document"] == {"title": "報告書", "pages": 20, "language": "ja"}
+    assert merged["summary"]["overview"] == "前半の概要\n後半の概要"
+    assert merged["summary"]["key_points"] == ["a", "b", "c"]
+    assert [section["title"] for section in merged["sections"]] == ["1章", "2章"]
+    assert merged["tables"] == [{"caption": "表1"}]
+
+
+def test_unparsable_yaml_chunk_is_kept_as_section():
+    broken = "```yaml\nsections: [\n```"
+    merged = load_merged(
+        merge_yaml_chunks(["```yaml\nsections:\n  - title: \"1章\"\n```", broken], [(1, 5), (6, 9)], 9)
+    )
+
+    assert merged["sections"][0] == {"title": "1章"}
+    assert merged["sections"][1] == {"title": "p.6-9（YAML解析失敗）", "content": broken}
@@ -0,0 +1,104 @@
+"""
+結果キャッシュ（SQLite版）の追い出しのテスト
+最後に参照した時刻が古い順（LRU）に件数・バイト数の上限まで追い出し、TTLを過ぎたエントリは返さないことを確認する
+"""
+
+import pytest
+
+from utils import result_cache
+from utils.result_cache import ResultCache
+
+
+class FakeClock:
+    """result_cache の time を置き換え、参照時刻と期限切れを再現する"""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(result_cache, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def make_cache(tmp_path):
+    def make(**kwargs):
+        kwargs.setdefault("max_entries", 100)
+        kwargs.setdefault("max_bytes", 1024 * 1024)
+        kwargs.setdefault("ttl_seconds", 0)
+        return ResultCache(path=str(tmp_path / "cache.db"), **kwargs)
+
+    return make
+
+
+def test_get_returns_stored_result(clock, make_cache):
+    cache = make_cache()
+    cache.set("k", "text", {"inputTokens": 3}, [{"page": 1}], validation={"issues": []})
+
+    assert cache.get("k") == {
+        "text": "text",
+        "usage": {"inputTokens": 3},
+        "citations": [{"page": 1}],
+        "validation": {"issues": []},
+    }
+    assert cache.get("missing") is None
+
+
+def test_least_recently_used_entry_is_evicted(clock, make_cache):
+    cache = make_cache(max_entries=2)
+    cache.set("a", "A", {})
+    clock.advance(1)
+    cache.set("b", "B", {})
+    clock.advance(1)
+    # a を参照すると、最後に参照した時刻が b より新しくなる
+    assert cache.get("a") is not None
+    clock.advance(1)
+    cache.set("c", "C", {})
+
+    assert cache.get("b") is None
+    assert cache.get("a")["text"] == "A"
+    assert cache.get("c")["text"] == "C"
+    assert cache.stats()["entries"] == 2
+
+
+def test_entries_are_evicted_until_total_size_fits(clock, make_cache):
+    cache = make_cache(max_bytes=250)
+    for key in ["a", "b", "c"]:
+        cache.set(key, key * 100, {})
+        clock.advance(1)
+
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+    assert cache.get("c") is not None
+    assert cache.stats()["bytes"] <= 250
+
+
+def test_expired_entry_is_not_returned(clock, make_cache):
+    cache = make_cache(ttl_seconds=60)
+    cache.set("k", "text", {})
+
+    clock.advance(59)
+    assert cache.get("k") is not None
+    # 参照しても期限は延びない（作成時刻から数える）
+    clock.advance(2)
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_set_removes_expired_entries(clock, make_cache):
+    cache = make_cache(ttl_seconds=60)
+    cache.set("old", "text", {})
+    clock.advance(61)
+    cache.set("new", "text", {})
+
+    assert cache.stats()["entries"] == 1
+    assert cache.get("new") is not None
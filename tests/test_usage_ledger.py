@@ -0,0 +1,62 @@
+"""
+接続元アドレスの判定のテスト
+直接の接続元が信頼するプロキシの場合だけ X-Forwarded-For を右から見て、
+クライアントが書き換えられる左側の値で利用者を偽れないことを確認する
+"""
+
+from types import SimpleNamespace
+
+from utils.usage_ledger import client_address, parse_networks
+
+TRUSTED = parse_networks("10.0.0.0/8, 192.168.1.10")
+
+
+def make_request(host, forwarded_for=None):
+    headers = {"x-forwarded-for": forwarded_for} if forwarded_for is not None else {}
+    return SimpleNamespace(client=SimpleNamespace(host=host), headers=headers)
+
+
+def test_untrusted_peer_ignores_forwarded_header():
+    request = make_request("203.0.113.5", "198.51.100.1")
+
+    assert client_address(request, TRUSTED) == "203.0.113.5"
+
+
+def test_trusted_proxy_uses_rightmost_untrusted_hop():
+    # 左端はクライアントが送ってきた値（偽装できる）
+    request = make_request("10.0.0.2", "1.2.3.4, 198.51.100.7, 10.0.0.3")
+
+    assert client_address(request, TRUSTED) == "198.51.100.7"
+
+
+def test_single_address_in_trusted_network():
+    request = make_request("192.168.1.10", "198.51.100.7")
+    assert client_address(request, TRUSTED) == "198.51.100.7"
+
+    # /32 として扱うため、同じネットワークの別アドレスは信頼しない
+    request = make_request("192.168.1.11", "198.51.100.7")
+    assert client_address(request, TRUSTED) == "192.168.1.11"
+
+
+def test_all_hops_trusted_returns_leftmost_hop():
+    request = make_request("10.0.0.2", "10.1.1.1, 10.0.0.3")
+
+    assert client_address(request, TRUSTED) == "10.1.1.1"
+
+
+def test_trusted_proxy_without_forwarded_header_returns_peer():
+    assert client_address(make_request("10.0.0.2"), TRUSTED) == "10.0.0.2"
+    assert client_address(make_request("10.0.0.2", " , "), TRUSTED) == "10.0.0.2"
+
+
+def test_malformed_hop_is_not_trusted():
+    request = make_request("10.0.0.2", "unknown, 10.0.0.3")
+
+    assert client_address(request, TRUSTED) == "unknown"
+
+
+def test_no_trusted_proxies_uses_peer():
+    request = make_request("10.0.0.2", "198.51.100.7")
+
+    assert client_address(request, []) == "10.0.0.2"
+    assert client_address(SimpleNamespace(), []) is None
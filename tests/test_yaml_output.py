@@ -0,0 +1,113 @@
+"""
+YAML出力の解析・検証のテスト
+壊れたトップレベルキーだけを問題として扱い、他のキーは解析結果を残すこと、
+ストリーミング中の途中解析が書き終わったキーだけを検証することを確認する
+"""
+
+from utils.yaml_output import IncrementalYAMLParser, parse_yaml_output
+
+SCHEMA = {
+    "document": {"title": "", "pages": 0},
+    "metadata": {"author": ""},
+    "summary": {"overview": "", "key_points": [""]},
+    "sections": [{"title": "", "content": ""}],
+}
+
+VALID = """説明文
+```yaml
+document:
+  title: "報告書"
+  pages: 3
+metadata:
+  author: null
+summary:
+  overview: "概要"
+  key_points: ["a"]
+sections:
+  - title: "1章"
+    content: "本文"
+```"""
+
+
+def test_valid_output_has_no_issues():
+    output = parse_yaml_output(VALID, SCHEMA)
+
+    assert output.valid
+    assert output.data["document"] == {"title": "報告書", "pages": 3}
+    assert output.data["sections"] == [{"title": "1章", "content": "本文"}]
+
+
+def test_broken_key_is_reported_and_other_keys_are_kept():
+    text = VALID.replace('  - title: "1章"', "  - title: 1章: 壊れた: [")
+    output = parse_yaml_output(text, SCHEMA)
+
+    assert output.failed_keys == ["sections"]
+    assert "YAMLの構文エラー" in output.issues[0].message
+    assert list(output.data) == ["document", "metadata", "summary"]
+    # 解析できなかったキーは元のテキストのまま書き戻す
+    assert "sections" in output.raw_blocks
+    assert "1章: 壊れた: [" in output.to_text(SCHEMA)
+
+
+def test_missing_key_and_wrong_shape_are_reported():
+    text = VALID.replace('metadata:\n  author: null\n', "").replace('  key_points: ["a"]', '  key_points: "a"')
+    output = parse_yaml_output(text, SCHEMA)
+
+    issues = {issue.path: issue.message for issue in output.issues}
+    assert issues["metadata"] == "キーがありません"
+    assert issues["summary.key_points"] == "リストが必要です（値）"
+    assert output.failed_keys == ["metadata", "summary"]
+
+
+def test_nested_list_items_are_validated():
+    text = VALID.replace('    content: "本文"', "    content:\n      nested: true")
+    output = parse_yaml_output(text, SCHEMA)
+
+    assert [str(issue) for issue in output.issues] == ["sections[0].content: 値が必要です（マッピング）"]
+
+
+def test_truncated_block_is_parsed():
+    # 出力上限で切れて閉じていないブロックも取り出す
+    text = VALID[: VALID.index("sections:")]
+    output = parse_yaml_output(text, SCHEMA)
+
+    assert output.failed_keys == ["sections"]
+    assert output.data["summary"]["overview"] == "概要"
+
+
+def test_keys_limit_parsing_to_repaired_keys():
+    repaired = '```yaml\nsummary:\n  overview: "o"\n  key_points: []\nsections:\n  - title: "x"\n    content: "y"\n```'
+    output = parse_yaml_output(repaired, SCHEMA, keys=["sections"])
+
+    assert output.valid
+    assert list(output.data) == ["sections"]
+
+
+def test_incremental_parser_checks_only_completed_keys():
+    text = VALID.replace("  author: null", "  author: [")
+    parser = IncrementalYAMLParser(SCHEMA)
+
+    # 次のキーが現れるまでは書き途中として扱う
+    parser.feed(text[: text.index("metadata:")])
+    assert parser.results == {}
+    assert parser.progress() == "🧩 YAML: ⏳ document"
+
+    parser.feed(text[: text.index("summary:") + len("summary:\n")])
+    assert parser.results["document"] == []
+    assert "YAMLの構文エラー" in parser.results["metadata"][0].message
+    assert list(parser.results) == ["document", "metadata"]
+
+    # 1文字ずつ与えても、閉じた時点で最後のキーまで1回ずつ検証される
+    for end in range(1, len(text) + 1):
+        parser.feed(text[:end])
+    assert list(parser.results) == ["document", "metadata", "summary", "sections"]
+    assert parser.results["sections"] == []
+    assert parser.progress() == "🧩 YAML: ✅ document ⚠️ metadata ✅ summary ✅ sections"
+
+
+def test_incremental_parser_counts_items_of_current_key():
+    parser = IncrementalYAMLParser(SCHEMA)
+    parser.feed(VALID[: VALID.index("```", 10)].replace('    content: "本文"\n', '    content: "本文"\n  - title: "2章"\n'))
+
+    assert parser.current_key == "sections"
+    assert parser.progress().endswith("⏳ sections（2件）")
@@ -0,0 +1,52 @@
+"""
+トークン使用量・コストのレポート
+使用量台帳の日別集計を、ユーザー・タブ・モデルIDなどの単位でまとめて表示する
+
+使用例:
+    uv run python usage_report.py --by user --since 2025-01-01
+    uv run python usage_report.py --by day tab model_id
+"""
+
+import argparse
+import sys
+
+from utils.usage_ledger import ROLLUP_KEYS, UsageLedger, today
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AWS Bedrock PDF トークン使用量レポート")
+    parser.add_argument(
+        "--by", nargs="*", choices=ROLLUP_KEYS, default=["day", "user"], help="集計の単位（複数指定可）"
+    )
+    parser.add_argument("--since", help="集計開始日（YYYY-MM-DD）")
+    parser.add_argument("--until", help="集計終了日（YYYY-MM-DD）")
+    parser.add_argument("--today", action="store_true", help="本日分のみ集計する")
+    args = parser.parse_args(argv)
+
+    since, until = (today(), today()) if args.today else (args.since, args.until)
+    ledger = UsageLedger()
+    rows = ledger.rollup(group_by=args.by, since=since, until=until)
+    if not rows:
+        print("📭 記録された使用量はありません")
+        return 0
+
+    header = [*args.by, "requests", "cache_hits", "input", "output", "cache_read", "cache_write", "total", "cost_usd"]
+    print(" | ".join(header))
+    for row in rows:
+        values = [str(row[key]) for key in args.by]
+        values += [
+            str(row["requests"]),
+            str(row["cache_hits"]),
+            f"{row['input_tokens']:,}",
+            f"{row['output_tokens']:,}",
+            f"{row['cache_read_tokens']:,}",
+            f"{row['cache_write_tokens']:,}",
+            f"{row['total_tokens']:,}",
+            f"{row['cost_usd']:.4f}",
+        ]
+        print(" | ".join(values))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
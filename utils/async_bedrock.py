@@ -0,0 +1,191 @@
+"""
+非同期Converseクライアント
+httpxとbotocoreのSigV4署名でConverse/ConverseStream APIを直接呼び出し、
+Gradioのイベントループ上でスレッドを占有せずにBedrockの応答を待つ
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import mmap
+import os
+import threading
+from urllib.parse import quote
+
+import httpx
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.eventstream import EventStreamBuffer
+from botocore.exceptions import ClientError
+
+from utils.bedrock_client import (
+    BEDROCK_ENDPOINT_URL,
+    CONNECT_TIMEOUT,
+    DEFAULT_REGION,
+    READ_TIMEOUT,
+    get_aws_credentials,
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_ASYNC_CONNECTIONS = int(os.environ.get("BEDROCK_MAX_ASYNC_CONNECTIONS", "200"))
+
+# bedrock-runtimeのSigV4署名サービス名
+SIGNING_NAME = "bedrock"
+
+
+def _encode_blobs(value):
+    """bytes値をConverse APIのJSON表現（base64文字列）に変換"""
+    if isinstance(value, dict):
+        return {key: _encode_blobs(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_encode_blobs(item) for item in value]
+    if isinstance(value, (bytes, bytearray, memoryview, mmap.mmap)):
+        return base64.b64encode(value).decode("ascii")
+    return value
+
+
+def _client_error(status_code, headers, body, operation_name):
+    """HTTPエラー応答をboto3と同じClientErrorに変換"""
+    try:
+        payload = json.loads(body) if body else {}
+    except ValueError:
+        payload = {}
+
+    code = headers.get("x-amzn-ErrorType") or payload.get("__type") or str(status_code)
+    code = code.split(":")[0].split("#")[-1]
+    message = payload.get("message") or payload.get("Message") or body
+
+    return ClientError(
+        {
+            "Error": {"Code": code, "Message": message},
+            "ResponseMetadata": {"HTTPStatusCode": status_code},
+        },
+        operation_name,
+    )
+
+
+class AsyncConverseClient:
+    """Converse/ConverseStream APIの非同期クライアント"""
+
+    def __init__(self, region=DEFAULT_REGION, endpoint_url=None):
+        self.region = region
+        self.endpoint_url = endpoint_url or f"https://bedrock-runtime.{region}.amazonaws.com"
+        # httpxのクライアントはイベントループをまたいで使えないため、ループごとに1つ持つ
+        self._http = {}
+        self._http_lock = threading.Lock()
+
+    def _http_client(self):
+        """実行中のイベントループに紐づくhttpxクライアントを取得"""
+        loop = asyncio.get_running_loop()
+        with self._http_lock:
+            client = self._http.get(loop)
+            if client is None:
+                self._discard_closed_loops()
+                client = httpx.AsyncClient(
+                    timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                    limits=httpx.Limits(
+                        max_connections=MAX_ASYNC_CONNECTIONS,
+                        max_keepalive_connections=MAX_ASYNC_CONNECTIONS,
+                    ),
+                )
+                self._http[loop] = client
+            return client
+
+    def _discard_closed_loops(self):
+        """終了したイベントループのクライアントを手放す
+
+        閉じたループ上では aclose() を実行できないため参照だけを外し、残った接続はGCで閉じる。
+        ループを終える前に aclose() を呼べば、接続はその場で閉じられる。
+        """
+        for loop in [loop for loop in self._http if loop.is_closed()]:
+            del self._http[loop]
+
+    def _build_request(self, operation, modelId, **params):
+        """署名済みのURL・ヘッダー・ボディを作成"""
+        url = f"{self.endpoint_url}/model/{quote(modelId, safe='')}/{operation}"
+        body = json.dumps(_encode_blobs(params), ensure_ascii=False).encode("utf-8")
+
+        request = AWSRequest(
+            method="POST",
+            url=url,
+            data=body,
+            headers={"Content-Type": "application/json"},
+        )
+        credentials = get_aws_credentials()
+        if credentials is not None:
+            SigV4Auth(credentials.get_frozen_credentials(), SIGNING_NAME, self.region).add_auth(request)
+
+        return url, dict(request.headers.items()), body
+
+    async def converse(self, **kwargs):
+        """Converse APIを呼び出し、boto3と同じ形式のレスポンスを返す"""
+        # JSON・base64への変換と認証情報の取得・SigV4署名はCPUとI/Oを使うため、イベントループの外で行う
+        url, headers, body = await asyncio.to_thread(self._build_request, "converse", **kwargs)
+        response = await self._http_client().post(url, headers=headers, content=body)
+
+        if response.status_code >= 400:
+            raise _client_error(response.status_code, response.headers, response.text, "Converse")
+        return response.json()
+
+    async def converse_stream(self, **kwargs):
+        """ConverseStream APIを呼び出し、boto3と同じ形式のイベントを逐次yieldする"""
+        url, headers, body = await asyncio.to_thread(self._build_request, "converse-stream", **kwargs)
+
+        async with self._http_client().stream("POST", url, headers=headers, content=body) as response:
+            if response.status_code >= 400:
+                error_body = (await response.aread()).decode("utf-8", errors="replace")
+                raise _client_error(response.status_code, response.headers, error_body, "ConverseStream")
+
+            buffer = EventStreamBuffer()
+            async for chunk in response.aiter_bytes():
+                buffer.add_data(chunk)
+                for message in buffer:
+                    message_headers = message.headers
+                    payload = json.loads(message.payload) if message.payload else {}
+
+                    if message_headers.get(":message-type") == "exception":
+                        raise ClientError(
+                            {
+                                "Error": {
+                                    "Code": message_headers.get(":exception-type", "Unknown"),
+                                    "Message": payload.get("message", ""),
+                                }
+                            },
+                            "ConverseStream",
+                        )
+
+                    event_type = message_headers.get(":event-type")
+                    if event_type:
+                        yield {event_type: payload}
+
+    async def aclose(self):
+        """実行中のイベントループのHTTP接続を閉じる"""
+        with self._http_lock:
+            client = self._http.pop(asyncio.get_running_loop(), None)
+            self._discard_closed_loops()
+        if client is not None:
+            await client.aclose()
+
+
+_lock = threading.Lock()
+_clients = {}
+
+
+def get_async_bedrock_client(region=DEFAULT_REGION):
+    """リージョンごとに共有される非同期Converseクライアントを取得"""
+    with _lock:
+        client = _clients.get(region)
+        if client is None:
+            client = AsyncConverseClient(region, endpoint_url=BEDROCK_ENDPOINT_URL)
+            _clients[region] = client
+        return client
+
+
+async def aclose_async_clients():
+    """共有の非同期クライアントのHTTP接続を閉じる（サーバー停止時に呼ぶ）"""
+    with _lock:
+        clients = list(_clients.values())
+    for client in clients:
+        await client.aclose()
@@ -0,0 +1,498 @@
+"""
+Bedrockバッチ推論による一括変換
+複数のPDFと変換プロンプトをバッチ推論用のJSONLにまとめてS3に配置し、
+ジョブの投入・ポーリング・結果の展開（PDFごとの出力ファイル）までを行う
+
+S3とBedrockのコントロールプレーンはローカルの代替実装（LocalObjectStore /
+LocalBatchControlPlane）に差し替えられるため、AWSに接続せずに動作確認できる。
+※ 実際のバッチ推論ジョブには入力ファイルのサイズ・1ジョブあたりのレコード数などのクォータがあるため、
+  上限を超える場合は入力を複数のファイルに分け、ファイルごとにジョブを投入する。
+"""
+
+import base64
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+from utils.batch_runner import OUTPUT_FORMATS, BatchManifest, output_path_for
+from utils.bedrock_client import DEFAULT_REGION
+from utils.document_loader import MAX_DOCUMENT_BYTES, check_page_count, open_document
+from utils.file_loader import load_prompt
+from utils.pdf_chunker import count_pages, strip_code_fence
+
+logger = logging.getLogger(__name__)
+
+ANTHROPIC_VERSION = "bedrock-2023-05-31"
+MAX_OUTPUT_TOKENS = int(os.environ.get("BEDROCK_BATCH_MAX_TOKENS", "8192"))
+POLL_INTERVAL = int(os.environ.get("BEDROCK_BATCH_POLL_INTERVAL", "60"))
+JOB_STATE_NAME = ".bedrock_batch_job.json"
+
+# 1ジョブの入力に収めるレコード数・入力ファイルのバイト数（Bedrockのバッチ推論のクォータに合わせる）
+MAX_RECORDS_PER_JOB = int(os.environ.get("BEDROCK_BATCH_MAX_RECORDS_PER_JOB", "50000"))
+MAX_INPUT_FILE_BYTES = int(os.environ.get("BEDROCK_BATCH_MAX_INPUT_BYTES", str(1024 * 1024 * 1024)))
+
+TERMINAL_STATUSES = {"Completed", "PartiallyCompleted", "Failed", "Stopped", "Expired"}
+
+
+def parse_s3_uri(uri):
+    """s3://bucket/prefix を (bucket, prefix) に分解"""
+    parsed = urlparse(uri)
+    if parsed.scheme != "s3":
+        raise ValueError(f"S3 URIではありません: {uri}")
+    return parsed.netloc, parsed.path.lstrip("/")
+
+
+class S3ObjectStore:
+    """S3を使うオブジェクトストア"""
+
+    def __init__(self, region=DEFAULT_REGION):
+        import boto3
+
+        self.s3_client = boto3.client("s3", region_name=region)
+
+    def put_object(self, uri, data):
+        bucket, key = parse_s3_uri(uri)
+        self.s3_client.put_object(Bucket=bucket, Key=key, Body=data)
+
+    def upload_file(self, uri, path):
+        """ローカルファイルをアップロード（大きなファイルはマルチパートで送る）"""
+        bucket, key = parse_s3_uri(uri)
+        self.s3_client.upload_file(path, bucket, key)
+
+    def get_object(self, uri):
+        bucket, key = parse_s3_uri(uri)
+        return self.s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+
+    def list_objects(self, prefix_uri):
+        bucket, prefix = parse_s3_uri(prefix_uri)
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        uris = []
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                uris.append(f"s3://{bucket}/{item['Key']}")
+        return uris
+
+
+class LocalObjectStore:
+    """ローカルディレクトリをS3の代わりに使うオブジェクトストア（s3://bucket/key → root/bucket/key）"""
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def _path(self, uri):
+        bucket, key = parse_s3_uri(uri)
+        return os.path.join(self.root_dir, bucket, *key.split("/"))
+
+    def put_object(self, uri, data):
+        path = self._path(uri)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def upload_file(self, uri, path):
+        target = self._path(uri)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(path, target)
+
+    def get_object(self, uri):
+        with open(self._path(uri), "rb") as f:
+            return f.read()
+
+    def list_objects(self, prefix_uri):
+        bucket, prefix = parse_s3_uri(prefix_uri)
+        bucket_dir = os.path.join(self.root_dir, bucket)
+        uris = []
+        for current_dir, _, file_names in os.walk(bucket_dir):
+            for file_name in file_names:
+                key = os.path.relpath(os.path.join(current_dir, file_name), bucket_dir).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    uris.append(f"s3://{bucket}/{key}")
+        return sorted(uris)
+
+
+class BedrockBatchControlPlane:
+    """Bedrockのバッチ推論API（create/get_model_invocation_job）"""
+
+    def __init__(self, role_arn, region=DEFAULT_REGION):
+        import boto3
+
+        self.role_arn = role_arn
+        self.bedrock_client = boto3.client("bedrock", region_name=region)
+
+    def create_job(self, job_name, model_id, input_uri, output_uri):
+        response = self.bedrock_client.create_model_invocation_job(
+            jobName=job_name,
+            roleArn=self.role_arn,
+            modelId=model_id,
+            inputDataConfig={"s3InputDataConfig": {"s3Uri": input_uri, "s3InputFormat": "JSONL"}},
+            outputDataConfig={"s3OutputDataConfig": {"s3Uri": output_uri}},
+        )
+        return response["jobArn"]
+
+    def get_job(self, job_arn):
+        response = self.bedrock_client.get_model_invocation_job(jobIdentifier=job_arn)
+        return {"status": response["status"], "message": response.get("message", "")}
+
+
+def echo_model_output(model_input):
+    """ローカル実行用のダミー推論（プロンプトの先頭行を見出しにした固定テキストを返す）"""
+    text_blocks = [
+        block["text"]
+        for message in model_input.get("messages", [])
+        for block in message.get("content", [])
+        if block.get("type") == "text"
+    ]
+    heading = text_blocks[0].splitlines()[0] if text_blocks else "output"
+    return {
+        "content": [{"type": "text", "text": f"# {heading}\n\n(local batch output)"}],
+        "usage": {"input_tokens": 0, "output_tokens": 0},
+    }
+
+
+class LocalBatchControlPlane:
+    """バッチ推論のコントロールプレーンをローカルで模倣する代替実装
+
+    ジョブはバックグラウンドスレッドで処理され、入力JSONLの各レコードに
+    invoke_model（modelInput→modelOutputの関数）を適用して出力JSONLを書き出す。
+    """
+
+    def __init__(self, object_store, invoke_model=echo_model_output):
+        self.object_store = object_store
+        self.invoke_model = invoke_model
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create_job(self, job_name, model_id, input_uri, output_uri):
+        job_id = uuid.uuid4().hex[:12]
+        job_arn = f"arn:aws:bedrock:local:000000000000:model-invocation-job/{job_id}"
+        with self._lock:
+            self._jobs[job_arn] = {"status": "Submitted", "message": ""}
+
+        thread = threading.Thread(
+            target=self._run_job, args=(job_arn, job_id, input_uri, output_uri), daemon=True
+        )
+        thread.start()
+        return job_arn
+
+    def _run_job(self, job_arn, job_id, input_uri, output_uri):
+        self._set_status(job_arn, "InProgress")
+        try:
+            input_name = input_uri.rstrip("/").split("/")[-1]
+            lines = []
+            for line in self.object_store.get_object(input_uri).decode("utf-8").splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                try:
+                    record["modelOutput"] = self.invoke_model(record["modelInput"])
+                except Exception as e:
+                    record["error"] = {"errorCode": 500, "errorMessage": str(e)}
+                lines.append(json.dumps(record, ensure_ascii=False))
+
+            self.object_store.put_object(
+                f"{output_uri.rstrip('/')}/{job_id}/{input_name}.out",
+                ("\n".join(lines) + "\n").encode("utf-8"),
+            )
+            self._set_status(job_arn, "Completed")
+        except Exception as e:
+            logger.error(f"ローカルバッチジョブ失敗: {str(e)}")
+            self._set_status(job_arn, "Failed", str(e))
+
+    def _set_status(self, job_arn, status, message=""):
+        with self._lock:
+            self._jobs[job_arn] = {"status": status, "message": message}
+
+    def get_job(self, job_arn):
+        with self._lock:
+            return dict(self._jobs[job_arn])
+
+
+def build_batch_record(record_id, document_bytes, prompt_text):
+    """バッチ推論用の1レコード（Anthropic Messages形式のmodelInput）を作成"""
+    return {
+        "recordId": record_id,
+        "modelInput": {
+            "anthropic_version": ANTHROPIC_VERSION,
+            "max_tokens": MAX_OUTPUT_TOKENS,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "document",
+                            "source": {
+                                "type": "base64",
+                                "media_type": "application/pdf",
+                                "data": base64.b64encode(document_bytes).decode("ascii"),
+                            },
+                        },
+                        {"type": "text", "text": prompt_text},
+                    ],
+                }
+            ],
+        },
+    }
+
+
+def _job_state_path(root_dir):
+    return os.path.join(root_dir, JOB_STATE_NAME)
+
+
+def load_job_state(root_dir):
+    """未回収のジョブ情報を読み込む（なければNone）"""
+    path = _job_state_path(root_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+
+    # 1ジョブだけを記録していた頃の形式は、ジョブ1件の一覧として扱う
+    if "jobs" not in state:
+        state["jobs"] = [
+            {
+                "job_arn": state.pop("job_arn"),
+                "job_name": state.pop("job_name"),
+                "input_uri": state.pop("input_uri"),
+                "records": {
+                    record_id: {"path": relative_path} for record_id, relative_path in state.pop("records").items()
+                },
+            }
+        ]
+    return state
+
+
+def save_job_state(root_dir, state):
+    """ジョブ情報を保存"""
+    with open(_job_state_path(root_dir), "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+
+
+class _InputShard:
+    """1ジョブ分の入力JSONL（一時ファイルに書き出し、メモリには1レコード分しか持たない）"""
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix="bedrock-batch-", suffix=".jsonl")
+        self.file = os.fdopen(fd, "wb")
+        self.size = 0
+        self.records = {}
+
+    def fits(self, line):
+        return len(self.records) < MAX_RECORDS_PER_JOB and self.size + len(line) <= MAX_INPUT_FILE_BYTES
+
+    def add(self, record_id, line, entry):
+        self.file.write(line)
+        self.size += len(line)
+        self.records[record_id] = entry
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.path)
+
+
+def _encode_record(pdf_file, record_id, prompt_text):
+    """PDFのサイズ・ページ数を確認し、JSONLの1行（bytes）を作成"""
+    with open_document(pdf_file, max_bytes=MAX_DOCUMENT_BYTES) as document:
+        check_page_count(count_pages(document.data))
+        record = build_batch_record(record_id, document.data, prompt_text)
+    line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+    if len(line) > MAX_INPUT_FILE_BYTES:
+        raise ValueError("バッチ推論の入力ファイルの上限を超えるため、1レコードに収まりません")
+    return line
+
+
+def submit_batch_job(
+    pdf_files,
+    root_dir,
+    output_format,
+    object_store,
+    control_plane,
+    input_prefix_uri,
+    output_prefix_uri,
+    model_id,
+):
+    """PDF群をJSONLにまとめて配置し、バッチ推論ジョブを投入する
+
+    各PDFは1回のリクエストと同じサイズ・ページ数の上限で確認し、上限を超えるものは
+    マニフェストに失敗として記録して除外する。変換済みのPDFは投入しない。
+    入力ファイルのサイズ・レコード数がクォータを超える場合は、複数のジョブに分けて投入する。
+    """
+    prompt_text = load_prompt(OUTPUT_FORMATS[output_format].prompt_name)
+    job_prefix = f"bedrock-pdf-{output_format}-{time.strftime('%Y%m%d%H%M%S')}"
+    manifest = BatchManifest(root_dir)
+    state = {
+        "output_format": output_format,
+        "output_uri": output_prefix_uri,
+        "model_id": model_id,
+        "jobs": [],
+        # サイズ・ページ数の上限を超えて投入しなかったPDF
+        "rejected": [],
+    }
+
+    def submit(shard):
+        shard.file.close()
+        job_name = f"{job_prefix}-{len(state['jobs']) + 1:03d}"
+        input_uri = f"{input_prefix_uri.rstrip('/')}/{job_name}.jsonl"
+        try:
+            object_store.upload_file(input_uri, shard.path)
+        finally:
+            os.remove(shard.path)
+        logger.info(f"バッチ入力を配置しました: {input_uri}（{len(shard.records)} 件）")
+
+        job_arn = control_plane.create_job(job_name, model_id, input_uri, output_prefix_uri)
+        state["jobs"].append(
+            {"job_arn": job_arn, "job_name": job_name, "input_uri": input_uri, "records": shard.records}
+        )
+        # 途中で中断しても投入済みのジョブを回収できるよう、1ジョブごとに記録する
+        save_job_state(root_dir, state)
+        logger.info(f"バッチ推論ジョブを投入しました: {job_arn}")
+
+    shard = _InputShard()
+    try:
+        record_count = 0
+        for pdf_file in pdf_files:
+            relative_path = os.path.relpath(pdf_file, root_dir)
+            stat = os.stat(pdf_file)
+            if manifest.is_done(relative_path, output_format, stat):
+                continue
+
+            record_id = f"{record_count:08d}"
+            try:
+                line = _encode_record(pdf_file, record_id, prompt_text)
+            except Exception as e:
+                logger.error(f"バッチ推論の対象外: {relative_path} - {str(e)}")
+                manifest.record(relative_path, output_format, stat, status="failed", error=str(e))
+                state["rejected"].append(relative_path)
+                continue
+
+            if shard.records and not shard.fits(line):
+                submit(shard)
+                shard = _InputShard()
+            shard.add(record_id, line, {"path": relative_path, "size": stat.st_size, "mtime": stat.st_mtime})
+            record_count += 1
+
+        if shard.records:
+            submit(shard)
+        else:
+            shard.discard()
+    except BaseException:
+        if not shard.file.closed:
+            shard.discard()
+        raise
+    return state
+
+
+def wait_for_job(control_plane, job_arn, poll_interval=POLL_INTERVAL, status_callback=None):
+    """ジョブが終了状態になるまでポーリングし、最終状態を返す"""
+    while True:
+        job = control_plane.get_job(job_arn)
+        if status_callback is not None:
+            status_callback(job)
+        if job["status"] in TERMINAL_STATUSES:
+            return job
+        time.sleep(poll_interval)
+
+
+def wait_for_jobs(control_plane, state, poll_interval=POLL_INTERVAL, status_callback=None):
+    """投入した全ジョブの終了を待ち、最終状態（status・message）をstateの各ジョブに記録する"""
+    for job_state in state["jobs"]:
+        job = wait_for_job(
+            control_plane,
+            job_state["job_arn"],
+            poll_interval=poll_interval,
+            status_callback=None if status_callback is None else lambda job: status_callback(job_state, job),
+        )
+        job_state["status"] = job["status"]
+        job_state["message"] = job.get("message", "")
+
+
+def _record_stat(root_dir, entry):
+    """投入時のサイズ・更新時刻（古い形式の記録では現在のファイル）をマニフェスト用に返す"""
+    if "size" in entry:
+        return SimpleNamespace(st_size=entry["size"], st_mtime=entry["mtime"])
+    return os.stat(os.path.join(root_dir, entry["path"]))
+
+
+def collect_batch_results(root_dir, state, object_store):
+    """各ジョブの出力JSONLを読み、PDFごとの出力ファイルに展開してマニフェストに記録する
+
+    完了しなかったジョブ・出力のなかったレコードは失敗として記録する。
+    戻り値は (成功件数, 失敗件数, 入力トークン合計, 出力トークン合計)。
+    """
+    output_format = state["output_format"]
+    spec = OUTPUT_FORMATS[output_format]
+    manifest = BatchManifest(root_dir)
+
+    succeeded = failed = input_tokens = output_tokens = 0
+    for job_state in state["jobs"]:
+        records = job_state["records"]
+        pending = set(records)
+
+        if job_state.get("status") in ("Completed", "PartiallyCompleted"):
+            job_id = job_state["job_arn"].split("/")[-1]
+            input_name = job_state["input_uri"].rstrip("/").split("/")[-1]
+            output_uri = f"{state['output_uri'].rstrip('/')}/{job_id}/{input_name}.out"
+            for line in object_store.get_object(output_uri).decode("utf-8").splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                entry = records.get(record.get("recordId"))
+                if entry is None:
+                    continue
+                pending.discard(record["recordId"])
+                relative_path = entry["path"]
+                stat = _record_stat(root_dir, entry)
+
+                model_output = record.get("modelOutput")
+                if not model_output:
+                    error = record.get("error", {})
+                    message = error.get("errorMessage", str(error))
+                    logger.error(f"バッチ推論失敗: {relative_path} - {message}")
+                    manifest.record(relative_path, output_format, stat, status="failed", error=message)
+                    failed += 1
+                    continue
+
+                text = "".join(
+                    block.get("text", "")
+                    for block in model_output.get("content", [])
+                    if block.get("type") == "text"
+                )
+                output_file = output_path_for(os.path.join(root_dir, relative_path), output_format)
+                with open(output_file, "w", encoding="utf-8") as f:
+                    f.write(strip_code_fence(text, spec.fence_language).strip() + "\n")
+
+                usage = model_output.get("usage", {})
+                record_usage = {
+                    "inputTokens": usage.get("input_tokens", 0),
+                    "outputTokens": usage.get("output_tokens", 0),
+                }
+                input_tokens += record_usage["inputTokens"]
+                output_tokens += record_usage["outputTokens"]
+                manifest.record(
+                    relative_path,
+                    output_format,
+                    stat,
+                    status="done",
+                    output=os.path.relpath(output_file, root_dir),
+                    usage=record_usage,
+                    model_id=state.get("model_id"),
+                )
+                succeeded += 1
+            message = "ジョブの出力に結果がありませんでした"
+        else:
+            message = f"ジョブが完了しませんでした: {job_state.get('status')} {job_state.get('message', '')}".strip()
+
+        for record_id in sorted(pending):
+            entry = records[record_id]
+            logger.error(f"バッチ推論失敗: {entry['path']} - {message}")
+            manifest.record(entry["path"], output_format, _record_stat(root_dir, entry), status="failed", error=message)
+            failed += 1
+
+    os.remove(_job_state_path(root_dir))
+    return succeeded, failed, input_tokens, output_tokens
@@ -0,0 +1,307 @@
+"""
+フォルダ一括変換
+ディレクトリ内のPDFをワーカープールで変換し、入力と同じ場所に出力を書き出す
+マニフェストに進捗を記録するため、中断しても続きから再開できる
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+from utils.bedrock_client import get_processor
+from utils.file_loader import load_prompt
+from utils.multi_format import RENDERED_FORMATS, extract_structure, write_outputs
+from utils.pdf_chunker import (
+    DEFAULT_PAGES_PER_CHUNK,
+    merge_markdown_chunks,
+    merge_yaml_chunks,
+    strip_code_fence,
+)
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".bedrock_batch_manifest.jsonl"
+# 1ファイルにまとめて書き直していた頃のマニフェスト（あれば読み込んで引き継ぐ）
+LEGACY_MANIFEST_NAME = ".bedrock_batch_manifest.json"
+
+
+@dataclass
+class OutputFormat:
+    """一括変換の出力形式"""
+
+    prompt_name: str
+    extension: str
+    fence_language: str
+    merge_chunks: object
+
+
+OUTPUT_FORMATS = {
+    "markdown": OutputFormat("pdf_to_markdown_prompt", ".md", "markdown", merge_markdown_chunks),
+    "yaml": OutputFormat("pdf_to_yaml_prompt", ".yaml", "yaml", merge_yaml_chunks),
+}
+
+# 1回の変換から書き出す場合（single_pass）に構造を取り出すプロセッサの出力形式
+SINGLE_PASS_PROCESSOR = "yaml"
+
+
+@dataclass
+class BatchStats:
+    """一括変換の集計"""
+
+    converted: int = 0
+    skipped: int = 0
+    failed: int = 0
+    cache_hits: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def summary(self):
+        """集計結果を表示用の文字列に整形"""
+        minutes = self.elapsed / 60
+        files_per_minute = self.converted / minutes if minutes > 0 else 0.0
+        total_tokens = self.input_tokens + self.output_tokens
+        tokens_per_second = total_tokens / self.elapsed if self.elapsed > 0 else 0.0
+        return (
+            f"✅ 変換 {self.converted} 件 / ⏭️ スキップ {self.skipped} 件 / ❌ 失敗 {self.failed} 件 "
+            f"(♻️ キャッシュヒット {self.cache_hits} 件)\n"
+            f"⏱️ 経過 {self.elapsed:.1f}秒 / 📄 {files_per_minute:.1f} ファイル/分 / "
+            f"📊 {tokens_per_second:.1f} トークン/秒 (入力 {self.input_tokens}, 出力 {self.output_tokens})"
+        )
+
+
+class BatchManifest:
+    """変換の進捗を記録するマニフェスト（JSON Lines）
+
+    変換結果ごとに1行を追記し、読み込み時に同じキーの行は後のもので上書きする。
+    1件ごとにファイル全体を書き直さないため、数千件のフォルダでも記録のコストは一定。
+    """
+
+    def __init__(self, root_dir):
+        self.path = os.path.join(root_dir, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self.entries = {}
+
+        legacy_path = os.path.join(root_dir, LEGACY_MANIFEST_NAME)
+        if not os.path.exists(self.path) and os.path.exists(legacy_path):
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+            self._compact()
+        elif os.path.exists(self.path):
+            line_count, broken = self._load()
+            # 壊れた行の後ろに追記しないよう、また上書きされた行が溜まっていれば、再開時に1回だけ詰め直す
+            if broken or line_count > len(self.entries) * 2:
+                self._compact()
+
+    def _load(self):
+        """行を順に読み込んでキーごとにまとめ、(読んだ行数, 壊れた行があったか) を返す"""
+        line_count = 0
+        broken = False
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 書き込み中に中断された最後の行は読み飛ばす（そのファイルは再変換される）
+                    logger.warning(f"マニフェストの壊れた行を読み飛ばしました: {self.path}")
+                    broken = True
+                    continue
+                self.entries[entry.pop("key")] = entry
+                line_count += 1
+        return line_count, broken
+
+    def _compact(self):
+        """現在の内容だけを書き出す（中断されても壊れないように一時ファイル経由で置き換える）"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for key, entry in self.entries.items():
+                f.write(json.dumps({"key": key, **entry}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def entry_key(relative_path, output_format):
+        return f"{output_format}:{relative_path}"
+
+    def is_done(self, relative_path, output_format, stat):
+        """同じファイル（サイズ・更新時刻が一致）を変換済みかどうか"""
+        entry = self.entries.get(self.entry_key(relative_path, output_format))
+        return (
+            entry is not None
+            and entry.get("status") == "done"
+            and entry.get("size") == stat.st_size
+            and entry.get("mtime") == stat.st_mtime
+        )
+
+    def record(self, relative_path, output_format, stat, **values):
+        """変換結果を記録し、マニフェストに1行追記する"""
+        key = self.entry_key(relative_path, output_format)
+        entry = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            **values,
+        }
+        line = json.dumps({"key": key, **entry}, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.entries[key] = entry
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+def create_processors(formats):
+    """出力形式ごとのプロセッサを作成"""
+    from tabs.pdf_to_markdown_tab import PDFToMarkdownProcessor
+    from tabs.pdf_to_yaml_tab import PDFToYAMLProcessor
+
+    processor_classes = {
+        "markdown": PDFToMarkdownProcessor,
+        "yaml": PDFToYAMLProcessor,
+    }
+    return {name: get_processor(processor_classes[name]) for name in formats}
+
+
+def find_pdf_files(root_dir):
+    """ディレクトリ以下のPDFファイルを列挙"""
+    pdf_files = []
+    for current_dir, _, file_names in os.walk(root_dir):
+        for file_name in file_names:
+            if file_name.lower().endswith(".pdf"):
+                pdf_files.append(os.path.join(current_dir, file_name))
+    return sorted(pdf_files)
+
+
+def output_path_for(pdf_file, output_format):
+    """入力PDFと同じ場所の出力ファイルパスを返す"""
+    spec = OUTPUT_FORMATS.get(output_format) or RENDERED_FORMATS[output_format]
+    return os.path.splitext(pdf_file)[0] + spec.extension
+
+
+def run_batch(
+    root_dir,
+    processors,
+    formats=("markdown",),
+    max_workers=4,
+    chunked=False,
+    pages_per_chunk=DEFAULT_PAGES_PER_CHUNK,
+    retry_failed=True,
+    progress_callback=None,
+    user="batch",
+    model_hint=None,
+    single_pass=False,
+):
+    """ディレクトリ内のPDFを一括変換し、BatchStatsを返す
+
+    processors は出力形式名→プロセッサ（BedrockDocumentProcessor）の辞書。
+    使用量は user の名前で台帳に記録され、トークン予算の対象になる。
+    model_hint を省略するとファイルごとにルールでモデルを選び、使われたモデルをマニフェストに記録する。
+    single_pass=True ではPDFごとに1回だけ変換し（processors["yaml"] を使用）、
+    formats の各形式（json / csv も可）は取り出した構造からローカルで書き出す。
+    """
+    manifest = BatchManifest(root_dir)
+    stats = BatchStats()
+    stats_lock = threading.Lock()
+
+    tasks = []
+    for pdf_file in find_pdf_files(root_dir):
+        relative_path = os.path.relpath(pdf_file, root_dir)
+        stat = os.stat(pdf_file)
+        pending_formats = []
+        for output_format in formats:
+            entry = manifest.entries.get(manifest.entry_key(relative_path, output_format), {})
+            if manifest.is_done(relative_path, output_format, stat) or (
+                not retry_failed and entry.get("status") == "failed"
+            ):
+                stats.skipped += 1
+                continue
+            pending_formats.append(output_format)
+        # 1タスクで書き出す形式のタプル（single_pass では未完了の形式をまとめて1回で変換する）
+        if single_pass and pending_formats:
+            tasks.append((pdf_file, relative_path, stat, tuple(pending_formats)))
+        elif not single_pass:
+            tasks.extend((pdf_file, relative_path, stat, (output_format,)) for output_format in pending_formats)
+
+    total_outputs = sum(len(task[3]) for task in tasks)
+    logger.info(f"一括変換: 対象 {total_outputs} 件（スキップ {stats.skipped} 件、Bedrock呼び出し {len(tasks)} 件）")
+
+    def convert(task):
+        pdf_file, relative_path, stat, output_formats = task
+        if single_pass:
+            result, data = extract_structure(
+                processors[SINGLE_PASS_PROCESSOR],
+                pdf_file,
+                chunked=chunked,
+                pages_per_chunk=pages_per_chunk,
+                user=user,
+                model_hint=model_hint,
+            )
+            return write_outputs(data, output_formats, os.path.splitext(pdf_file)[0]), result
+
+        output_format = output_formats[0]
+        spec = OUTPUT_FORMATS[output_format]
+        processor = processors[output_format]
+        prompt_text = load_prompt(spec.prompt_name, user)
+
+        if chunked:
+            result = processor.run_chunked_document_request(
+                pdf_file,
+                prompt_text,
+                spec.merge_chunks,
+                pages_per_chunk=pages_per_chunk,
+                user=user,
+                model_hint=model_hint,
+            )
+        else:
+            result = processor.run_document_request(pdf_file, prompt_text, user=user, model_hint=model_hint)
+        result = processor.finalize_result(pdf_file, result, user=user, model_hint=model_hint)
+
+        output_file = output_path_for(pdf_file, output_format)
+        with open(output_file, "w", encoding="utf-8") as f:
+            f.write(strip_code_fence(result.text, spec.fence_language).strip() + "\n")
+        return {output_format: output_file}, result
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(convert, task): task for task in tasks}
+        for future in as_completed(futures):
+            pdf_file, relative_path, stat, output_formats = futures[future]
+            try:
+                output_files, result = future.result()
+            except Exception as e:
+                logger.error(f"変換失敗: {relative_path} ({', '.join(output_formats)}) - {str(e)}")
+                for output_format in output_formats:
+                    manifest.record(relative_path, output_format, stat, status="failed", error=str(e))
+                with stats_lock:
+                    stats.failed += len(output_formats)
+            else:
+                usage = {} if result.cache_hit else result.usage
+                for index, (output_format, output_file) in enumerate(output_files.items()):
+                    manifest.record(
+                        relative_path,
+                        output_format,
+                        stat,
+                        status="done",
+                        output=os.path.relpath(output_file, root_dir),
+                        # 1回の変換から複数形式を書き出した場合、使用量は最初の形式にだけ記録する
+                        usage=result.usage if index == 0 else {},
+                        cache_hit=result.cache_hit,
+                        model_id=result.model_id,
+                    )
+                with stats_lock:
+                    stats.converted += len(output_files)
+                    stats.cache_hits += int(result.cache_hit)
+                    stats.input_tokens += usage.get("inputTokens", 0)
+                    stats.output_tokens += usage.get("outputTokens", 0)
+
+            if progress_callback is not None:
+                progress_callback(stats, total_outputs)
+
+    return stats
@@ -0,0 +1,156 @@
+"""
+Bedrockクライアントの共有ファクトリ
+プロセス内でbedrock-runtimeクライアント・AWS認証確認・プロセッサを共有する
+
+BEDROCK_BACKEND でバックエンドを切り替えられる:
+- aws: 実際のAWS（既定）
+- mock: ローカルのモックサーバー（mock_bedrock_server.py）。STSは呼ばず、ダミーの認証情報で署名する
+"""
+
+import logging
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGION = "ap-northeast-1"
+
+BEDROCK_BACKENDS = ("aws", "mock")
+BEDROCK_BACKEND = os.environ.get("BEDROCK_BACKEND", "aws")
+MOCK_ENDPOINT_URL = "http://127.0.0.1:8765"
+BEDROCK_ENDPOINT_URL = os.environ.get("BEDROCK_ENDPOINT_URL") or (
+    MOCK_ENDPOINT_URL if BEDROCK_BACKEND == "mock" else None
+)
+
+# モックバックエンドで verify_aws_credentials が返す固定のID
+MOCK_IDENTITY = {
+    "UserId": "MOCKUSER",
+    "Account": "000000000000",
+    "Arn": "arn:aws:iam::000000000000:user/mock-bedrock",
+}
+
+MAX_POOL_CONNECTIONS = int(os.environ.get("BEDROCK_MAX_POOL_CONNECTIONS", "50"))
+# 1リクエストあたりの最大試行回数（再試行は utils/failover.py で行う）
+MAX_ATTEMPTS = int(os.environ.get("BEDROCK_MAX_ATTEMPTS", "4"))
+CONNECT_TIMEOUT = int(os.environ.get("BEDROCK_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = int(os.environ.get("BEDROCK_READ_TIMEOUT", "300"))
+
+BEDROCK_CLIENT_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,
+    connect_timeout=CONNECT_TIMEOUT,
+    read_timeout=READ_TIMEOUT,
+    # botocoreでは再試行せず、リトライ予算とフェイルオーバーを持つ utils/failover.py に任せる
+    retries={"mode": "standard", "total_max_attempts": 1},
+)
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+_identities = {}
+_processors = {}
+
+
+def _get_session():
+    """プロセス共有のboto3セッションを取得"""
+    global _session
+    if _session is None:
+        if BEDROCK_BACKEND not in BEDROCK_BACKENDS:
+            raise ValueError(
+                f"BEDROCK_BACKEND が不正です: {BEDROCK_BACKEND}（{', '.join(BEDROCK_BACKENDS)} のいずれか）"
+            )
+        if BEDROCK_BACKEND == "mock":
+            # モックサーバーは署名を検証しないため、ダミーの認証情報で十分
+            _session = boto3.Session(
+                aws_access_key_id="mock",
+                aws_secret_access_key="mock",
+                region_name=DEFAULT_REGION,
+            )
+        else:
+            _session = boto3.Session()
+    return _session
+
+
+def get_aws_credentials():
+    """共有セッションの認証情報を取得（署名に使う時点で get_frozen_credentials を呼ぶこと）"""
+    with _lock:
+        return _get_session().get_credentials()
+
+
+def get_bedrock_client(region=DEFAULT_REGION):
+    """リージョンごとに共有されるbedrock-runtimeクライアントを取得"""
+    with _lock:
+        client = _clients.get(region)
+        if client is None:
+            client = _get_session().client(
+                "bedrock-runtime",
+                region_name=region,
+                endpoint_url=BEDROCK_ENDPOINT_URL,
+                config=BEDROCK_CLIENT_CONFIG,
+            )
+            _clients[region] = client
+        return client
+
+
+def verify_aws_credentials(region=DEFAULT_REGION):
+    """STSでAWS認証を確認（プロセス内で1回だけ実行し、結果を再利用）"""
+    with _lock:
+        identity = _identities.get(region)
+        if identity is None and BEDROCK_BACKEND == "mock":
+            identity = _identities[region] = MOCK_IDENTITY
+            logger.info(f"モックバックエンドを使用します: {BEDROCK_ENDPOINT_URL}")
+        if identity is None:
+            sts_client = _get_session().client("sts", region_name=region)
+            identity = sts_client.get_caller_identity()
+            _identities[region] = identity
+            logger.info(f"AWS認証成功: {identity['Arn']}")
+        return identity
+
+
+def get_processor(processor_cls, **kwargs):
+    """プロセッサのインスタンスを取得（同じクラス・引数なら同じインスタンスを返す）"""
+    key = (processor_cls, tuple(sorted(kwargs.items())))
+    with _lock:
+        processor = _processors.get(key)
+    if processor is not None:
+        return processor
+
+    processor = processor_cls(**kwargs)
+    with _lock:
+        return _processors.setdefault(key, processor)
+
+
+def start_credential_check(region=DEFAULT_REGION):
+    """AWS認証の確認をバックグラウンドで1回だけ実行（起動を待たせず、失敗はログに残す）"""
+
+    def check():
+        try:
+            verify_aws_credentials(region)
+        except Exception as e:
+            # 失敗した結果はキャッシュしないため、最初のリクエストで再確認される
+            logger.error(f"AWS認証エラー: {str(e)}")
+
+    thread = threading.Thread(target=check, name="aws-credential-check", daemon=True)
+    thread.start()
+    return thread
+
+
+class LazyProcessor:
+    """最初に使われたときに get_processor でプロセッサを作成するプロキシ
+
+    タブの構築時にはboto3クライアントの作成やSTS呼び出しを行わず、アプリの起動を速くする
+    """
+
+    def __init__(self, processor_cls, **kwargs):
+        self.processor_cls = processor_cls
+        self.kwargs = kwargs
+
+    def get(self):
+        """プロセッサのインスタンスを取得（初回のみ作成）"""
+        return get_processor(self.processor_cls, **self.kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
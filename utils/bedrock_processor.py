@@ -0,0 +1,897 @@
+"""
+Bedrock処理の共通基盤
+PDF Q&A・YAML変換・マークダウン変換の各プロセッサが共有する
+ドキュメント読み込み、結果キャッシュ、Converse API呼び出し、結果整形を提供する
+"""
+
+import asyncio
+import os
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+from utils.async_bedrock import get_async_bedrock_client
+from utils.bedrock_client import DEFAULT_REGION, get_bedrock_client
+from utils.document_loader import (
+    MAX_DOCUMENT_BYTES,
+    MAX_DOCUMENT_PAGES,
+    MAX_UPLOAD_BYTES,
+    aopen_document,
+    check_byte_count,
+    check_page_count,
+    open_document,
+)
+from utils.failover import FAILOVER_TARGETS, FailoverPolicy, parse_targets, retarget
+from utils.metrics import METRICS_ENABLED, PREFLIGHT_SAVED_BYTES, RequestTrace
+from utils.model_router import DEFAULT_MODEL_ID, get_model_router
+from utils.pdf_chunker import (
+    DEFAULT_PAGES_PER_CHUNK,
+    build_chunk_note,
+    count_pages,
+    split_pdf,
+)
+from utils.pdf_preflight import PREFLIGHT_ENABLED, PREFLIGHT_MAX_BYTES, PreflightReport, preflight_pdf
+from utils.result_cache import get_result_cache, hash_document, make_cache_key
+from utils.scheduler import estimate_request_tokens, get_scheduler
+from utils.usage_ledger import get_usage_ledger
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_WORKERS = int(os.environ.get("BEDROCK_PDF_CHUNK_WORKERS", "4"))
+PROMPT_CACHING_ENABLED = os.environ.get("BEDROCK_PROMPT_CACHING", "1") == "1"
+
+# プロンプトキャッシュの区切り（ここまでの入力がキャッシュ対象になる）
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+
+# 変換プロンプトをシステムプロンプトに置いた場合のユーザーメッセージ
+CONVERSION_INSTRUCTION = "上記のドキュメントを指示に従って変換してください。"
+
+
+@dataclass
+class ConversionResult:
+    """Bedrock呼び出しの結果"""
+
+    text: str
+    usage: dict = field(default_factory=dict)
+    model_id: str = DEFAULT_MODEL_ID
+    cache_hit: bool = False
+    citations: list = field(default_factory=list)
+    # 送信前にPDFを最適化した場合の結果（PreflightReport）
+    preflight: object = None
+    # 出力を検証した場合の結果（ValidationReport）
+    validation: object = None
+    # ページ範囲に分割して変換した結果か（文書全体を1回で送り直せないことがある）
+    chunked: bool = False
+    # 結果キャッシュのキーと元のドキュメントの内容ハッシュ（キャッシュを使わない場合はNone）
+    cache_key: str = None
+    document_hash: str = None
+
+
+def sanitize_document_name(pdf_file):
+    """ファイル名をBedrockのドキュメント名として使える形にサニタイズ"""
+    base_name = os.path.splitext(os.path.basename(pdf_file))[0]
+    return ''.join(c for c in base_name if c.isalnum()) or "PDF"
+
+
+def format_token_usage(usage, cache_hit=False):
+    """トークン使用量のフッターを整形"""
+    footer = f"\n\n---\n📊 トークン使用量: 入力 {usage.get('inputTokens', 'N/A')}, 出力 {usage.get('outputTokens', 'N/A')}, 合計 {usage.get('totalTokens', 'N/A')}"
+    if usage.get('cacheReadInputTokens') or usage.get('cacheWriteInputTokens'):
+        footer += f"\n💾 プロンプトキャッシュ: 読み込み {usage.get('cacheReadInputTokens', 0)}, 書き込み {usage.get('cacheWriteInputTokens', 0)}"
+    if cache_hit:
+        footer += "\n♻️ キャッシュヒット: Bedrock呼び出しなし（今回の消費トークン 0、上記は初回実行時の使用量）"
+    return footer
+
+
+def format_citations(citations):
+    """引用情報を一覧形式に整形"""
+    lines = []
+    seen = set()
+    # 複数ドキュメントからの引用ならドキュメント名も表示する
+    show_titles = len({citation.get("title") for citation in citations}) > 1
+    for citation in citations:
+        location = citation.get("location", {})
+        if "documentPage" in location:
+            page = location["documentPage"]
+            place = f"p.{page.get('start')}" if page.get("start") == page.get("end") else f"p.{page.get('start')}-{page.get('end')}"
+        elif "documentChar" in location:
+            chars = location["documentChar"]
+            place = f"文字 {chars.get('start')}-{chars.get('end')}"
+        elif "documentChunk" in location:
+            chunk = location["documentChunk"]
+            place = f"チャンク {chunk.get('start')}-{chunk.get('end')}"
+        else:
+            place = "位置不明"
+
+        source = "".join(s.get("text", "") for s in citation.get("sourceContent", []))
+        source = " ".join(source.split())
+        if len(source) > 80:
+            source = source[:80] + "…"
+
+        if show_titles and citation.get("title"):
+            place = f"{citation['title']} {place}"
+
+        if (place, source) in seen:
+            continue
+        seen.add((place, source))
+        lines.append(f"- {place}: 「{source}」" if source else f"- {place}")
+
+    if not lines:
+        return ""
+    return "\n\n📚 引用元:\n" + "\n".join(lines)
+
+
+def format_result_text(result, include_citations=False):
+    """結果テキストに引用元とトークン使用量のフッターを付与"""
+    text = result.text
+    if include_citations and result.citations:
+        text += format_citations(result.citations)
+    if result.usage:
+        text += format_token_usage(result.usage, result.cache_hit)
+        text += f"\n🤖 モデル: {result.model_id}"
+    if result.preflight is not None:
+        text += f"\n🗜️ PDF最適化: {result.preflight.summary()}"
+    if result.validation is not None:
+        text += f"\n🧩 YAML検証: {result.validation.summary()}"
+    return text
+
+
+def sum_usage(results):
+    """複数の結果のトークン使用量を合算"""
+    usage = {}
+    for result in results:
+        for key, value in result.usage.items():
+            if isinstance(value, int):
+                usage[key] = usage.get(key, 0) + value
+    return usage
+
+
+def extract_response_content(output_message):
+    """Converseの出力メッセージからテキストと引用情報を抽出"""
+    result_text = ""
+    citations = []
+
+    for content in output_message['content']:
+        if 'text' in content:
+            result_text += content['text']
+        elif 'citationsContent' in content:
+            cited = content['citationsContent']
+            for generated in cited.get('content', []):
+                result_text += generated.get('text', '')
+            citations.extend(cited.get('citations', []))
+
+    return result_text, citations
+
+
+def format_client_error(e):
+    """ClientErrorをユーザー向けのメッセージに変換"""
+    error_msg = str(e)
+    if "Extra inputs are not permitted" in error_msg and "citations" in error_msg:
+        return f"❌ Citations機能エラー: {error_msg}\n\n対処法: リージョンを ap-northeast-1 に変更し、AWSサポートに機能の利用可能性を確認してください。"
+    return f"AWS APIエラー: {error_msg}"
+
+
+@dataclass
+class PreparedRequest:
+    """Converse呼び出しの準備結果"""
+
+    cache_key: str = None
+    document_hash: str = None
+    cached: ConversionResult = None
+    request: dict = None
+    estimated_tokens: int = 0
+    trace: RequestTrace = None
+    user: str = None
+    preflight: PreflightReport = None
+    # 読み込んだドキュメント（LoadedDocument）。呼び出しが終わったら release() で閉じる
+    document: object = None
+
+    def release(self):
+        """ドキュメントのメモリマップを閉じ、処理中バイト数の枠を返す"""
+        if self.document is not None:
+            self.document.close()
+            self.document = None
+
+
+class BedrockDocumentProcessor:
+    """ドキュメント付きのConverse呼び出しを行う共通基底クラス"""
+
+    # スケジューラでの同時実行数制限に使うタブ名
+    tab_name = "default"
+
+    # Trueならプロンプトをシステムプロンプトとして送る（変換系のように毎回同じ指示文の場合）
+    prompt_as_system = False
+
+    # システムプロンプトとドキュメントの直後にプロンプトキャッシュの区切りを置く
+    prompt_caching = PROMPT_CACHING_ENABLED
+
+    # 送信前にPDFを最適化する（画像の縮小・空白ページの削除など）
+    preflight = PREFLIGHT_ENABLED
+
+    def __init__(
+        self,
+        region=DEFAULT_REGION,
+        result_cache=None,
+        scheduler=None,
+        bedrock_client=None,
+        async_bedrock_client=None,
+        usage_ledger=None,
+        failover_targets=None,
+        model_router=None,
+    ):
+        # クライアントは converse / converse_stream を持つものなら差し替えられる
+        self.region = region
+        self.bedrock_client = bedrock_client if bedrock_client is not None else get_bedrock_client(region)
+        self.async_bedrock_client = (
+            async_bedrock_client if async_bedrock_client is not None else get_async_bedrock_client(region)
+        )
+        # ルールに一致しないリクエストで使う既定のモデルID
+        self.model_id = DEFAULT_MODEL_ID
+        self.model_router = model_router if model_router is not None else get_model_router()
+        self.failover_targets = failover_targets or parse_targets(FAILOVER_TARGETS, region, self.model_id)
+        self._failover_policies = {}
+        self.result_cache = result_cache if result_cache is not None else get_result_cache()
+        self.scheduler = scheduler if scheduler is not None else get_scheduler()
+        self.usage_ledger = usage_ledger if usage_ledger is not None else get_usage_ledger()
+
+    def _new_trace(self):
+        """このプロセッサのリクエスト計測を開始"""
+        return RequestTrace(self.tab_name, self.model_id)
+
+    def _trace_for(self, prepared, operation):
+        """準備済みリクエストの計測を取得（準備段階で作られていなければここから計測）"""
+        trace = prepared.trace if prepared.trace is not None else self._new_trace()
+        trace.operation = operation
+        return trace
+
+    def _failover_for(self, model_id):
+        """モデルごとのフェイルオーバーポリシー（各リージョンの推論プロファイルに付け替えた呼び出し先）"""
+        policy = self._failover_policies.get(model_id)
+        if policy is None:
+            policy = self._failover_policies.setdefault(
+                model_id, FailoverPolicy(retarget(self.failover_targets, model_id))
+            )
+        return policy
+
+    def _route(self, page_count, document_size, model_hint=None):
+        """このタブのリクエストに使うモデルIDを選ぶ"""
+        decision = self.model_router.route(self.tab_name, page_count, document_size, model_hint)
+        logger.info(
+            f"モデル選択: {decision.model_id}（{self.tab_name}, {page_count}ページ, {document_size:,}バイト, {decision.reason}）"
+        )
+        return decision.model_id
+
+    def _client_for(self, target):
+        """呼び出し先のリージョンのクライアントを取得"""
+        if target.region == self.region:
+            return self.bedrock_client
+        return get_bedrock_client(target.region)
+
+    def _async_client_for(self, target):
+        """呼び出し先のリージョンの非同期クライアントを取得"""
+        if target.region == self.region:
+            return self.async_bedrock_client
+        return get_async_bedrock_client(target.region)
+
+    @staticmethod
+    def _request_for(prepared, target):
+        """呼び出し先のモデルID（推論プロファイル）に合わせたリクエスト"""
+        if prepared.request["modelId"] == target.model_id:
+            return prepared.request
+        return dict(prepared.request, modelId=target.model_id)
+
+    def _prepare_request(self, pdf_file, prompt_text, citations, user=None, model_hint=None, document=None):
+        """ドキュメントを読み込み、Converse呼び出しの準備を行う
+
+        ドキュメントはメモリマップで開き、ハッシュ計算・キャッシュ参照・リクエスト作成で同じバッファを使う。
+        返した PreparedRequest は呼び出し後に release() すること。
+        """
+        trace = self._new_trace()
+
+        # ファイル形式を取得
+        input_document_format = pdf_file.split(".")[-1]
+
+        # ドキュメントを読み込み（サイズの上限は読み込む前に確認する。最適化する場合は最適化後にも確認する）
+        if document is None:
+            with trace.span("file_read"):
+                document = open_document(pdf_file, max_bytes=self._max_read_bytes())
+
+        try:
+            prepared = self._prepare_bytes_request(
+                document.data,
+                sanitize_document_name(pdf_file),
+                input_document_format,
+                prompt_text,
+                citations,
+                trace=trace,
+                user=user,
+                model_hint=model_hint,
+            )
+        except BaseException:
+            document.close()
+            raise
+
+        if prepared.cached is not None:
+            # キャッシュヒットならドキュメントはもう使わない
+            document.close()
+        else:
+            prepared.document = document
+        return prepared
+
+    def _max_read_bytes(self):
+        """1回の呼び出しで送るファイルを読み込む前に確認するサイズの上限"""
+        return PREFLIGHT_MAX_BYTES if self.preflight else MAX_DOCUMENT_BYTES
+
+    def _prepare_bytes_request(
+        self,
+        input_document,
+        document_name,
+        document_format,
+        prompt_text,
+        citations,
+        page_note="",
+        trace=None,
+        user=None,
+        model_hint=None,
+        preflight=True,
+    ):
+        """読み込み済みのドキュメントからConverse呼び出しの準備を行う
+
+        preflight=False なら最適化済みのドキュメントとしてそのまま送る。
+        """
+        if trace is None:
+            trace = self._new_trace()
+
+        with trace.span("payload_build"):
+            prepared = self._build_bytes_request(
+                input_document,
+                document_name,
+                document_format,
+                prompt_text,
+                citations,
+                page_note,
+                model_hint,
+                trace=trace,
+                preflight=preflight and self.preflight,
+            )
+        prepared.trace = trace
+        prepared.user = user
+        return prepared
+
+    def _preflight(self, input_document, trace):
+        """PDFを最適化し、(送信するバイト列, PreflightReport) を返す"""
+        with trace.span("preflight"):
+            document, report = preflight_pdf(input_document)
+        if report.optimized and METRICS_ENABLED:
+            PREFLIGHT_SAVED_BYTES.labels(self.tab_name).inc(report.saved_bytes)
+        return document, report
+
+    def _build_bytes_request(
+        self,
+        input_document,
+        document_name,
+        document_format,
+        prompt_text,
+        citations,
+        page_note,
+        model_hint=None,
+        trace=None,
+        preflight=False,
+    ):
+        """モデルを選び、キャッシュを確認してConverseのリクエストを組み立てる
+
+        キャッシュキーは元のドキュメントから作るため、キャッシュヒット時は最適化を行わない。
+        """
+        try:
+            page_count = count_pages(input_document)
+        except Exception:
+            page_count = 1
+        model_id = self._route(page_count, len(input_document), model_hint)
+
+        # キャッシュを確認（モデルごとに別の結果として扱う）
+        cache_key = document_hash = None
+        if self.result_cache is not None:
+            document_hash = hash_document(input_document)
+            cache_key = make_cache_key(document_hash, model_id, prompt_text + page_note, citations)
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"結果キャッシュヒット: {document_name}")
+                result = ConversionResult(
+                    text=cached["text"],
+                    usage=cached["usage"],
+                    model_id=model_id,
+                    cache_hit=True,
+                    citations=cached.get("citations", []),
+                    cache_key=cache_key,
+                    document_hash=document_hash,
+                )
+                return PreparedRequest(cache_key=cache_key, document_hash=document_hash, cached=result)
+
+        # 最適化してから、1回の呼び出しの上限に収まるかを確認する
+        report = None
+        if preflight and trace is not None:
+            input_document, report = self._preflight(input_document, trace)
+            page_count = report.page_count or page_count
+            if not report.optimized:
+                report = None
+        check_byte_count(len(input_document))
+        check_page_count(page_count)
+
+        # 指示文はシステムプロンプトに、質問はドキュメントの後ろに置く
+        if self.prompt_as_system:
+            system = [{"text": prompt_text}]
+            user_text = CONVERSION_INSTRUCTION
+        else:
+            system = []
+            user_text = prompt_text
+        if page_note:
+            user_text += f"\n\n{page_note}"
+
+        # メッセージを構築（ドキュメントまでを先頭に置き、キャッシュ可能な接頭辞にする）
+        content = [
+            {
+                "document": {
+                    "name": document_name,
+                    "format": document_format,
+                    "source": {"bytes": input_document},
+                    "citations": {"enabled": citations},
+                }
+            },
+        ]
+        if self.prompt_caching:
+            if system:
+                system.append(CACHE_POINT)
+            content.append(CACHE_POINT)
+        content.append({"text": user_text})
+
+        request = {
+            "modelId": model_id,
+            "messages": [{"role": "user", "content": content}],
+        }
+        if system:
+            request["system"] = system
+
+        return PreparedRequest(
+            cache_key=cache_key,
+            document_hash=document_hash,
+            request=request,
+            estimated_tokens=estimate_request_tokens(page_count, prompt_text),
+            preflight=report,
+        )
+
+    def _store_result(self, cache_key, result):
+        """結果をキャッシュに保存"""
+        if cache_key is not None and self.result_cache is not None:
+            self.result_cache.set(cache_key, result.text, result.usage, result.citations)
+
+    def _check_budget(self, prepared):
+        """トークン予算を確認（超えるならBudgetExceededでBedrockを呼ばずに中止）"""
+        if self.usage_ledger is not None:
+            self.usage_ledger.check_budget(prepared.user, prepared.estimated_tokens)
+
+    def _record_usage(self, prepared, result):
+        """使用量を台帳に記録"""
+        if self.usage_ledger is not None:
+            self.usage_ledger.record(
+                prepared.user, self.tab_name, result.model_id, result.usage, cache_hit=result.cache_hit
+            )
+
+    def _complete(self, prepared, result):
+        """呼び出し完了後の保存処理（結果キャッシュと使用量台帳）"""
+        result.preflight = prepared.preflight
+        result.cache_key = prepared.cache_key
+        result.document_hash = prepared.document_hash
+        if prepared.preflight is not None:
+            # キャッシュキーは元のドキュメントから作るため、引用も元のページ番号で保存する
+            result.citations = prepared.preflight.map_citations(result.citations)
+        self._store_result(prepared.cache_key, result)
+        self._record_usage(prepared, result)
+
+    def finalize_result(self, pdf_file, result, user=None, model_hint=None):
+        """変換結果の後処理（出力形式ごとの検証など）。既定では何もしない"""
+        return result
+
+    async def afinalize_result(self, pdf_file, result, user=None, model_hint=None):
+        """finalize_resultの非同期版（再生成はBedrock呼び出しを伴うためスレッドで行う）"""
+        return await asyncio.to_thread(self.finalize_result, pdf_file, result, user, model_hint)
+
+    def run_document_request(self, pdf_file, prompt_text, citations=True, user=None, model_hint=None):
+        """PDFとプロンプトをBedrockに送信し、結果を返す（キャッシュがあれば再利用）
+
+        model_hint はモデル名（sonnet / haiku など）かモデルID。None か "auto" ならルールで選ぶ。
+        """
+        prepared = self._prepare_request(pdf_file, prompt_text, citations, user, model_hint)
+        try:
+            return self._execute(prepared)
+        finally:
+            prepared.release()
+
+    def _execute(self, prepared):
+        """準備済みのリクエストでConverse APIを呼び出す"""
+        trace = self._trace_for(prepared, "converse")
+        if prepared.cached is not None:
+            trace.model_id = prepared.cached.model_id
+            trace.finish("cache_hit")
+            self._record_usage(prepared, prepared.cached)
+            return prepared.cached
+
+        try:
+            self._check_budget(prepared)
+            response, target = self._converse_with_failover(prepared, trace)
+
+            with trace.span("response_assembly"):
+                result = self._result_from_response(response, target.model_id)
+                self._complete(prepared, result)
+        except Exception as e:
+            trace.fail(e)
+            raise
+
+        trace.finish("ok", result.usage)
+        return result
+
+    def _converse_with_failover(self, prepared, trace):
+        """一時的なエラーは再試行・フェイルオーバーしながらConverse APIを呼び出し、(レスポンス, 呼び出し先) を返す"""
+        attempts = self._failover_for(prepared.request["modelId"]).start()
+        while True:
+            target, delay = attempts.next_target()
+            if delay:
+                time.sleep(delay)
+            trace.model_id = target.model_id
+
+            try:
+                # 実行枠を確保してConverse APIを呼び出し（再試行も1リクエストとして枠を取り直す）
+                wait_started = time.perf_counter()
+                with self.scheduler.slot(self.tab_name, prepared.estimated_tokens) as ticket:
+                    trace.begin_call(wait_started)
+                    with trace.span("bedrock_call"):
+                        response = self._client_for(target).converse(**self._request_for(prepared, target))
+                    ticket.record_usage(response.get('usage'))
+            except Exception as e:
+                if not attempts.failed(target, e):
+                    raise
+                trace.record_error(e)
+                continue
+
+            attempts.succeeded(target)
+            return response, target
+
+    def _result_from_response(self, response, model_id=None):
+        """Converseのレスポンスから結果を抽出"""
+        result_text, result_citations = extract_response_content(response['output']['message'])
+        return ConversionResult(
+            text=result_text,
+            usage=response.get('usage', {}),
+            model_id=model_id or self.model_id,
+            citations=result_citations,
+        )
+
+    @staticmethod
+    def _apply_stream_event(result, event):
+        """ConverseStreamのイベントを結果に反映し、テキストが増えたらTrueを返す"""
+        if 'contentBlockDelta' in event:
+            delta = event['contentBlockDelta']['delta']
+            if 'citation' in delta:
+                result.citations.append(delta['citation'])
+            if 'text' in delta:
+                result.text += delta['text']
+                return True
+        elif 'metadata' in event:
+            result.usage = event['metadata'].get('usage', {})
+        return False
+
+    def run_chunked_document_request(
+        self,
+        pdf_file,
+        prompt_text,
+        merge_chunks,
+        pages_per_chunk=DEFAULT_PAGES_PER_CHUNK,
+        max_workers=DEFAULT_CHUNK_WORKERS,
+        citations=True,
+        progress_callback=None,
+        user=None,
+        model_hint=None,
+    ):
+        """PDFをページ範囲に分割して並列に変換し、merge_chunksで結合した結果を返す
+
+        merge_chunks は (チャンクのテキスト一覧, [(開始ページ, 終了ページ), ...], 総ページ数)
+        を受け取り、結合済みテキストを返す関数。
+        """
+        input_document_format = pdf_file.split(".")[-1]
+        document_name = sanitize_document_name(pdf_file)
+
+        # 分割してから送るため、1回の呼び出しの上限ではなくファイル全体の上限で確認する
+        with open_document(pdf_file, max_bytes=MAX_UPLOAD_BYTES) as document:
+            total_pages = count_pages(document.data)
+            check_page_count(total_pages, MAX_DOCUMENT_PAGES)
+            chunks = split_pdf(document.data, pages_per_chunk)
+            return self._run_chunks(
+                chunks,
+                total_pages,
+                document_name,
+                input_document_format,
+                prompt_text,
+                merge_chunks,
+                max_workers,
+                citations,
+                progress_callback,
+                user,
+                model_hint,
+                document_hash=hash_document(document.data) if self.result_cache is not None else None,
+            )
+
+    def _run_chunks(
+        self,
+        chunks,
+        total_pages,
+        document_name,
+        input_document_format,
+        prompt_text,
+        merge_chunks,
+        max_workers,
+        citations,
+        progress_callback,
+        user,
+        model_hint,
+        document_hash=None,
+    ):
+        """分割済みのチャンクを並列に変換して結合する"""
+
+        def convert_chunk(chunk):
+            start_page, end_page, chunk_bytes = chunk
+            return self._execute(
+                self._prepare_bytes_request(
+                    chunk_bytes,
+                    f"{document_name}p{start_page}to{end_page}",
+                    input_document_format,
+                    prompt_text,
+                    citations,
+                    page_note=build_chunk_note(start_page, end_page, total_pages),
+                    user=user,
+                    model_hint=model_hint,
+                )
+            )
+
+        results = [None] * len(chunks)
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+            futures = {executor.submit(convert_chunk, chunk): i for i, chunk in enumerate(chunks)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                results[futures[future]] = future.result()
+                if progress_callback is not None:
+                    progress_callback(done, len(chunks))
+
+        merged_text = merge_chunks(
+            [result.text for result in results],
+            [(start, end) for start, end, _ in chunks],
+            total_pages,
+        )
+        return ConversionResult(
+            text=merged_text,
+            usage=sum_usage(results),
+            # チャンクごとにモデルが選ばれるため、使われたモデルを列挙する
+            model_id=", ".join(sorted({result.model_id for result in results})),
+            cache_hit=all(result.cache_hit for result in results),
+            citations=[c for result in results for c in result.citations],
+            preflight=PreflightReport.combine(result.preflight for result in results),
+            chunked=True,
+            # 分割・モデル・プロンプトが同じなら同じキーになるよう、チャンクのキャッシュキーから作る
+            cache_key=(
+                hash_document("\n".join(result.cache_key for result in results).encode("utf-8"))
+                if all(result.cache_key for result in results)
+                else None
+            ),
+            document_hash=document_hash,
+        )
+
+    def stream_document_request(self, pdf_file, prompt_text, citations=True, user=None, model_hint=None):
+        """ConverseStreamで応答を逐次取得し、途中経過のConversionResultをyieldする
+
+        最後にyieldされる結果にのみトークン使用量が含まれる。
+        """
+        prepared = self._prepare_request(pdf_file, prompt_text, citations, user, model_hint)
+        try:
+            yield from self._stream(prepared)
+        finally:
+            prepared.release()
+
+    def _stream(self, prepared):
+        """準備済みのリクエストでConverseStream APIを呼び出す"""
+        trace = self._trace_for(prepared, "converse_stream")
+        if prepared.cached is not None:
+            trace.model_id = prepared.cached.model_id
+            trace.finish("cache_hit")
+            self._record_usage(prepared, prepared.cached)
+            yield prepared.cached
+            return
+
+        result = ConversionResult(text="", model_id=self.model_id)
+        try:
+            self._check_budget(prepared)
+
+            attempts = self._failover_for(prepared.request["modelId"]).start()
+            while True:
+                target, delay = attempts.next_target()
+                if delay:
+                    time.sleep(delay)
+                trace.model_id = target.model_id
+                result = ConversionResult(text="", model_id=target.model_id)
+
+                try:
+                    wait_started = time.perf_counter()
+                    with self.scheduler.slot(self.tab_name, prepared.estimated_tokens) as ticket:
+                        trace.begin_call(wait_started)
+                        # ストリーミングでは最後のイベントを受信するまでを呼び出し時間とする
+                        with trace.span("bedrock_call"):
+                            # ConverseStream APIを呼び出し
+                            response = self._client_for(target).converse_stream(
+                                **self._request_for(prepared, target)
+                            )
+
+                            for event in response['stream']:
+                                if self._apply_stream_event(result, event):
+                                    trace.mark_first_token()
+                                    yield result
+
+                        ticket.record_usage(result.usage)
+                except Exception as e:
+                    # テキストを返し始めた後は、表示が重複しないよう再試行しない
+                    if not attempts.failed(target, e, retry=not result.text):
+                        raise
+                    trace.record_error(e)
+                    continue
+
+                attempts.succeeded(target)
+                break
+
+            with trace.span("response_assembly"):
+                self._complete(prepared, result)
+            trace.finish("ok", result.usage)
+        except Exception as e:
+            trace.fail(e)
+            raise
+        finally:
+            # 利用者が途中で閉じた場合（GeneratorExit）も実行中の数を戻す
+            trace.finish("cancelled")
+
+        yield result
+
+    async def arun_document_request(self, pdf_file, prompt_text, citations=True, user=None, model_hint=None):
+        """run_document_requestの非同期版
+
+        ファイル読み込みとキャッシュ参照は短時間のためスレッドで行い、
+        Bedrockの応答待ちはイベントループ上で行う。
+        """
+        prepared = await self._aprepare_request(pdf_file, prompt_text, citations, user, model_hint)
+        try:
+            return await self._aexecute(prepared)
+        finally:
+            prepared.release()
+
+    async def _aprepare_request(self, pdf_file, prompt_text, citations, user=None, model_hint=None):
+        """_prepare_requestの非同期版（処理中バイト数の枠はスレッドを占有せずに待つ）"""
+        document = await aopen_document(pdf_file, max_bytes=self._max_read_bytes())
+        try:
+            return await asyncio.to_thread(
+                self._prepare_request, pdf_file, prompt_text, citations, user, model_hint, document
+            )
+        except BaseException:
+            document.close()
+            raise
+
+    async def _aexecute(self, prepared):
+        """_executeの非同期版"""
+        trace = self._trace_for(prepared, "converse")
+        if prepared.cached is not None:
+            trace.model_id = prepared.cached.model_id
+            trace.finish("cache_hit")
+            await asyncio.to_thread(self._record_usage, prepared, prepared.cached)
+            return prepared.cached
+
+        try:
+            await asyncio.to_thread(self._check_budget, prepared)
+            response, target = await self._aconverse_with_failover(prepared, trace)
+
+            with trace.span("response_assembly"):
+                result = self._result_from_response(response, target.model_id)
+                await asyncio.to_thread(self._complete, prepared, result)
+        except asyncio.CancelledError:
+            trace.finish("cancelled")
+            raise
+        except Exception as e:
+            trace.fail(e)
+            raise
+
+        trace.finish("ok", result.usage)
+        return result
+
+    async def _aconverse_with_failover(self, prepared, trace):
+        """_converse_with_failoverの非同期版"""
+        attempts = self._failover_for(prepared.request["modelId"]).start()
+        while True:
+            target, delay = attempts.next_target()
+            if delay:
+                await asyncio.sleep(delay)
+            trace.model_id = target.model_id
+
+            try:
+                wait_started = time.perf_counter()
+                async with self.scheduler.async_slot(self.tab_name, prepared.estimated_tokens) as ticket:
+                    trace.begin_call(wait_started)
+                    with trace.span("bedrock_call"):
+                        response = await self._async_client_for(target).converse(
+                            **self._request_for(prepared, target)
+                        )
+                    ticket.record_usage(response.get('usage'))
+            except Exception as e:
+                if not attempts.failed(target, e):
+                    raise
+                trace.record_error(e)
+                continue
+
+            attempts.succeeded(target)
+            return response, target
+
+    async def astream_document_request(self, pdf_file, prompt_text, citations=True, user=None, model_hint=None):
+        """stream_document_requestの非同期版"""
+        prepared = await self._aprepare_request(pdf_file, prompt_text, citations, user, model_hint)
+        try:
+            async for result in self._astream(prepared):
+                yield result
+        finally:
+            prepared.release()
+
+    async def _astream(self, prepared):
+        """_streamの非同期版"""
+        trace = self._trace_for(prepared, "converse_stream")
+        if prepared.cached is not None:
+            trace.model_id = prepared.cached.model_id
+            trace.finish("cache_hit")
+            await asyncio.to_thread(self._record_usage, prepared, prepared.cached)
+            yield prepared.cached
+            return
+
+        result = ConversionResult(text="", model_id=self.model_id)
+        try:
+            await asyncio.to_thread(self._check_budget, prepared)
+
+            attempts = self._failover_for(prepared.request["modelId"]).start()
+            while True:
+                target, delay = attempts.next_target()
+                if delay:
+                    await asyncio.sleep(delay)
+                trace.model_id = target.model_id
+                result = ConversionResult(text="", model_id=target.model_id)
+
+                try:
+                    wait_started = time.perf_counter()
+                    async with self.scheduler.async_slot(self.tab_name, prepared.estimated_tokens) as ticket:
+                        trace.begin_call(wait_started)
+                        with trace.span("bedrock_call"):
+                            async for event in self._async_client_for(target).converse_stream(
+                                **self._request_for(prepared, target)
+                            ):
+                                if self._apply_stream_event(result, event):
+                                    trace.mark_first_token()
+                                    yield result
+
+                        ticket.record_usage(result.usage)
+                except Exception as e:
+                    # テキストを返し始めた後は、表示が重複しないよう再試行しない
+                    if not attempts.failed(target, e, retry=not result.text):
+                        raise
+                    trace.record_error(e)
+                    continue
+
+                attempts.succeeded(target)
+                break
+
+            with trace.span("response_assembly"):
+                await asyncio.to_thread(self._complete, prepared, result)
+            trace.finish("ok", result.usage)
+        except Exception as e:
+            trace.fail(e)
+            raise
+        finally:
+            trace.finish("cancelled")
+
+        yield result
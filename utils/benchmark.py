@@ -0,0 +1,313 @@
+"""
+変換スループット・レイテンシのベンチマーク
+モックバックエンドに対して合成PDFでQ&A・YAML変換・マークダウン変換を実行し、
+p50/p95/p99レイテンシ・最初のトークンまでの時間・ファイル/秒・ピークRSSを計測する
+"""
+
+import json
+import os
+import platform
+import resource
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+
+# 処理関数がエラー時に返すメッセージの接頭辞
+ERROR_PREFIXES = ("AWS APIエラー", "エラー:", "❌")
+
+RSS_SAMPLE_INTERVAL = 0.05
+
+WORDS = (
+    "revenue growth quarterly report market share operating income customer "
+    "segment forecast analysis product region strategy performance summary"
+).split()
+
+
+@dataclass
+class DocumentProfile:
+    """合成PDFの条件"""
+
+    name: str
+    pages: int
+    target_bytes: int
+
+
+DEFAULT_PROFILES = [
+    DocumentProfile("small", 1, 50 * 1024),
+    DocumentProfile("medium", 20, 1024 * 1024),
+    DocumentProfile("large", 100, 4 * 1024 * 1024),
+]
+
+
+def parse_profile(value):
+    """名前:ページ数:サイズKB 形式の文字列をDocumentProfileに変換"""
+    name, pages, size_kb = value.split(":")
+    return DocumentProfile(name, int(pages), int(size_kb) * 1024)
+
+
+def make_synthetic_pdf(page_count, target_bytes):
+    """テキストを含む合成PDFを作成（ページごとのテキスト量で全体サイズを target_bytes に近づける）"""
+    overhead_per_page = 400
+    bytes_per_page = max(200, target_bytes // max(1, page_count) - overhead_per_page)
+
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(page_count)), page_count
+        ),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for page_index in range(page_count):
+        lines = [f"BT /F1 10 Tf 40 760 Td 12 TL (Page {page_index + 1} benchmark document) Tj"]
+        length = len(lines[0])
+        line_number = 0
+        while length < bytes_per_page:
+            words = " ".join(
+                WORDS[(page_index * 7 + line_number * 3 + i) % len(WORDS)] for i in range(10)
+            )
+            line = f"T* (section {line_number} {words}) Tj"
+            lines.append(line)
+            length += len(line) + 1
+            line_number += 1
+        lines.append("ET")
+        stream = "\n".join(lines)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * page_index} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    output = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+
+    xref_offset = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    output += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n"
+    ).encode("latin-1")
+    return output
+
+
+def percentile(values, q):
+    """線形補間によるパーセンタイル（q は 0〜100）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values):
+    """レイテンシ系の値を p50/p95/p99/平均/最大 にまとめる（秒）"""
+    if not values:
+        return None
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "mean": sum(values) / len(values),
+        "max": max(values),
+    }
+
+
+def current_rss_bytes():
+    """現在のRSS（Linuxでは/proc、それ以外はプロセスのピーク値）"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss はLinuxではKB、macOSではバイト
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if platform.system() == "Darwin" else max_rss * 1024
+
+
+class RssSampler:
+    """シナリオ実行中のRSSを定期的に計測し、ピーク値を記録する"""
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_bytes = max(self.peak_bytes, current_rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak_bytes = current_rss_bytes()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, current_rss_bytes())
+
+
+@dataclass
+class ScenarioResult:
+    """1シナリオ（処理×PDF条件）の計測結果"""
+
+    name: str
+    task: str
+    mode: str
+    pages: int
+    pdf_bytes: int
+    requests: int
+    concurrency: int
+    errors: int = 0
+    wall_seconds: float = 0.0
+    files_per_second: float = 0.0
+    latency: dict = None
+    ttft: dict = None
+    peak_rss_mb: float = 0.0
+    error_samples: list = field(default_factory=list)
+
+
+def _is_error(text):
+    return not text or text.startswith(ERROR_PREFIXES)
+
+
+def run_once(call, streaming):
+    """1リクエストを実行し、(レイテンシ, 最初のトークンまでの時間, 最終出力) を返す"""
+    started = time.perf_counter()
+    if not streaming:
+        text = call()
+        return time.perf_counter() - started, None, text
+
+    first_token = None
+    text = ""
+    for text in call():
+        if first_token is None and text:
+            first_token = time.perf_counter() - started
+    return time.perf_counter() - started, first_token, text
+
+
+def run_scenario(name, task, call, streaming, pdf_bytes, pages, requests, concurrency):
+    """同じ処理を requests 回（同時実行数 concurrency）実行して計測"""
+    latencies = []
+    ttfts = []
+    errors = []
+
+    with RssSampler() as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            futures = [executor.submit(run_once, call, streaming) for _ in range(requests)]
+            for future in futures:
+                try:
+                    latency, ttft, text = future.result()
+                except Exception as e:
+                    errors.append(str(e))
+                    continue
+                if _is_error(text):
+                    errors.append(text[:200])
+                    continue
+                latencies.append(latency)
+                if ttft is not None:
+                    ttfts.append(ttft)
+        wall_seconds = time.perf_counter() - started
+
+    return ScenarioResult(
+        name=name,
+        task=task,
+        mode="stream" if streaming else "sync",
+        pages=pages,
+        pdf_bytes=pdf_bytes,
+        requests=requests,
+        concurrency=concurrency,
+        errors=len(errors),
+        wall_seconds=wall_seconds,
+        files_per_second=len(latencies) / wall_seconds if wall_seconds > 0 else 0.0,
+        latency=summarize(latencies),
+        ttft=summarize(ttfts),
+        peak_rss_mb=sampler.peak_bytes / (1024 * 1024),
+        error_samples=errors[:3],
+    )
+
+
+def git_commit():
+    """計測時のgitコミット（取得できなければNone）"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(results, config):
+    """計測結果をJSONで保存する形にまとめる"""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "scenarios": [asdict(result) for result in results],
+    }
+
+
+def save_report(report, path):
+    """計測結果をJSONファイルに保存"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def format_report(report):
+    """計測結果を表形式の文字列に整形"""
+
+    def ms(summary, key):
+        return f"{summary[key] * 1000:8.0f}" if summary else f"{'-':>8}"
+
+    lines = [
+        f"{'シナリオ':<20} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'TTFT50':>8} {'files/s':>8} {'RSS MB':>8} {'err':>4}"
+    ]
+    for scenario in report["scenarios"]:
+        lines.append(
+            f"{scenario['name']:<24} {ms(scenario['latency'], 'p50')} {ms(scenario['latency'], 'p95')} "
+            f"{ms(scenario['latency'], 'p99')} {ms(scenario['ttft'], 'p50')} "
+            f"{scenario['files_per_second']:8.2f} {scenario['peak_rss_mb']:8.1f} {scenario['errors']:4d}"
+        )
+    return "\n".join(lines)
+
+
+def compare_reports(baseline, current, max_regression=0.2):
+    """2つの計測結果を比較し、(比較結果の行リスト, 劣化があればTrue) を返す
+
+    p95レイテンシが max_regression の割合を超えて増えるか、
+    ファイル/秒が同じ割合を超えて減ったシナリオを劣化とみなす。
+    """
+    baseline_scenarios = {scenario["name"]: scenario for scenario in baseline["scenarios"]}
+    lines = []
+    regressed = False
+    for scenario in current["scenarios"]:
+        before = baseline_scenarios.get(scenario["name"])
+        if before is None or not before.get("latency") or not scenario.get("latency"):
+            continue
+
+        p95_change = scenario["latency"]["p95"] / before["latency"]["p95"] - 1
+        throughput_change = (
+            scenario["files_per_second"] / before["files_per_second"] - 1
+            if before["files_per_second"]
+            else 0.0
+        )
+        worse = p95_change > max_regression or throughput_change < -max_regression
+        regressed = regressed or worse
+        lines.append(
+            f"{'❌' if worse else '✅'} {scenario['name']}: p95 {p95_change:+.1%}, files/s {throughput_change:+.1%}"
+        )
+    return lines, regressed
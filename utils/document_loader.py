@@ -0,0 +1,218 @@
+"""
+メモリ使用量を抑えたドキュメント読み込み
+PDFをメモリマップで開き、読み込む前にサイズ・ページ数の上限を確認する
+1リクエストの中ではハッシュ計算・キャッシュ・リクエスト作成で同じバッファを使い回し、
+プロセス全体で同時に処理中のドキュメントの合計バイト数を上限内に抑える
+"""
+
+import logging
+import mmap
+import os
+import threading
+import time
+
+from utils.fair_semaphore import FairSemaphore
+from utils.metrics import IN_FLIGHT_DOCUMENT_BYTES, METRICS_ENABLED
+
+logger = logging.getLogger(__name__)
+
+# 1回のConverse呼び出しで送れるドキュメントの上限（Bedrockの制限に合わせる）
+MAX_DOCUMENT_BYTES = int(os.environ.get("BEDROCK_MAX_DOCUMENT_BYTES", str(int(4.5 * 1024 * 1024))))
+MAX_REQUEST_PAGES = int(os.environ.get("BEDROCK_MAX_REQUEST_PAGES", "100"))
+
+# 分割変換・検索モードで受け付けるファイル全体の上限
+MAX_UPLOAD_BYTES = int(os.environ.get("BEDROCK_MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+MAX_DOCUMENT_PAGES = int(os.environ.get("BEDROCK_MAX_DOCUMENT_PAGES", "2000"))
+
+# 同時に処理中のドキュメントの合計バイト数の上限（0で無制限）
+IN_FLIGHT_BYTES = int(os.environ.get("BEDROCK_IN_FLIGHT_BYTES", str(512 * 1024 * 1024)))
+
+
+class DocumentTooLarge(ValueError):
+    """ドキュメントがサイズ・ページ数の上限を超えている"""
+
+
+def format_bytes(size):
+    """バイト数をMB表記に整形"""
+    return f"{size / (1024 * 1024):.1f}MB"
+
+
+def check_byte_count(size, max_bytes=MAX_DOCUMENT_BYTES):
+    """サイズが上限を超えていればDocumentTooLargeを送出"""
+    if max_bytes and size > max_bytes:
+        raise DocumentTooLarge(
+            f"PDFが大きすぎます（{format_bytes(size)} > 上限 {format_bytes(max_bytes)}）。"
+            "分割変換または検索モードをお試しください"
+        )
+
+
+def check_document_size(path, max_bytes=MAX_DOCUMENT_BYTES):
+    """ファイルを読み込まずにサイズを確認し、バイト数を返す"""
+    size = os.path.getsize(path)
+    check_byte_count(size, max_bytes)
+    return size
+
+
+def check_page_count(page_count, max_pages=MAX_REQUEST_PAGES):
+    """ページ数が上限を超えていればDocumentTooLargeを送出"""
+    if max_pages and page_count > max_pages:
+        raise DocumentTooLarge(
+            f"PDFのページ数が多すぎます（{page_count} ページ > 上限 {max_pages} ページ）。"
+            "分割変換または検索モードをお試しください"
+        )
+
+
+class ByteBudget:
+    """同時に処理中のドキュメントの合計バイト数を制限する（capacity=0で無制限）
+
+    同期版・非同期版の待ち手は到着順に確保する（非同期の待ち手が追い越され続けない）。
+    """
+
+    def __init__(self, capacity=IN_FLIGHT_BYTES):
+        self.capacity = capacity
+        self._semaphore = FairSemaphore(capacity)
+
+    @property
+    def in_flight(self):
+        return self._semaphore.in_use
+
+    def _amount(self, size):
+        # 上限を超える1件は上限分だけ確保する（永久に待たないように）
+        return min(size, self.capacity)
+
+    def try_acquire(self, size):
+        """確保できればTrue"""
+        if not self.capacity:
+            return True
+        if not self._semaphore.try_acquire(self._amount(size)):
+            return False
+        self._export()
+        return True
+
+    def acquire(self, size):
+        """空きができるまで待ってから確保し、待機した秒数を返す"""
+        started = time.monotonic()
+        if not self.capacity:
+            return 0.0
+        self._semaphore.acquire(self._amount(size))
+        self._export()
+        waited = time.monotonic() - started
+        if waited > 1:
+            logger.info(f"ドキュメント読み込みの待機: {format_bytes(size)} {waited:.1f}秒")
+        return waited
+
+    async def acquire_async(self, size):
+        """acquireの非同期版（スレッドを占有せずに待機）"""
+        if not self.capacity:
+            return
+        await self._semaphore.acquire_async(self._amount(size))
+        self._export()
+
+    def release(self, size):
+        if not self.capacity:
+            return
+        self._semaphore.release(self._amount(size))
+        self._export()
+
+    def _export(self):
+        if METRICS_ENABLED:
+            IN_FLIGHT_DOCUMENT_BYTES.set(self.in_flight)
+
+
+class LoadedDocument:
+    """メモリマップで開いたドキュメント
+
+    data はメモリマップ（bytesと同様にハッシュ計算・Converseのリクエストに渡せる）。
+    close() でマップを閉じ、処理中バイト数の枠を返す。
+    """
+
+    def __init__(self, path, size, data, file=None, budget=None):
+        self.path = path
+        self.size = size
+        self.data = data
+        self._file = file
+        self._budget = budget
+
+    def close(self):
+        if self._budget is not None:
+            self._budget.release(self.size)
+            self._budget = None
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_document(path, max_bytes=MAX_DOCUMENT_BYTES, budget=None):
+    """サイズを確認し、処理中バイト数の枠を確保してからメモリマップで開く"""
+    size = check_document_size(path, max_bytes)
+    budget = budget if budget is not None else get_byte_budget()
+    budget.acquire(size)
+    return _map_document(path, size, budget)
+
+
+async def aopen_document(path, max_bytes=MAX_DOCUMENT_BYTES, budget=None):
+    """open_documentの非同期版（枠の空きはイベントループ上で待つ）"""
+    size = check_document_size(path, max_bytes)
+    budget = budget if budget is not None else get_byte_budget()
+    await budget.acquire_async(size)
+    return _map_document(path, size, budget)
+
+
+def _map_document(path, size, budget):
+    """確保済みの枠でファイルをメモリマップする（失敗したら枠を返す）"""
+    file = None
+    try:
+        if size == 0:
+            return LoadedDocument(path, size, b"", budget=budget)
+        file = open(path, "rb")
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return LoadedDocument(path, size, data, file=file, budget=budget)
+    except BaseException:
+        if file is not None:
+            file.close()
+        budget.release(size)
+        raise
+
+
+def describe_document(path, count_pages):
+    """ファイル情報の表示用に (バイト数, ページ数, 注意事項のリスト) を返す"""
+    size = os.path.getsize(path)
+    if size > MAX_UPLOAD_BYTES:
+        # 受け付けないファイルは読み込まず、ページ数も数えない
+        return size, None, [f"ファイルサイズが上限（{format_bytes(MAX_UPLOAD_BYTES)}）を超えています"]
+
+    warnings = []
+    page_count = None
+    try:
+        with open_document(path, max_bytes=MAX_UPLOAD_BYTES) as document:
+            page_count = count_pages(document.data)
+    except Exception as e:
+        warnings.append(f"PDFを読み取れませんでした: {str(e)}")
+
+    if size > MAX_DOCUMENT_BYTES or (page_count or 0) > MAX_REQUEST_PAGES:
+        warnings.append(
+            f"1回で送れる上限（{format_bytes(MAX_DOCUMENT_BYTES)}・{MAX_REQUEST_PAGES}ページ）を超えています。"
+            "画像の縮小などの最適化で収まらない場合は分割変換を使ってください"
+        )
+    return size, page_count, warnings
+
+
+_default_budget = None
+_default_budget_lock = threading.Lock()
+
+
+def get_byte_budget():
+    """プロセス共有の処理中バイト数の枠を取得"""
+    global _default_budget
+    with _default_budget_lock:
+        if _default_budget is None:
+            _default_budget = ByteBudget()
+        return _default_budget
@@ -0,0 +1,357 @@
+"""
+Bedrock呼び出しのリトライとリージョン間フェイルオーバー
+スロットリングや一時的な障害に対して、ジッター付き指数バックオフで再試行する
+再試行はプロセス全体のリトライ予算の範囲に制限し、リージョン・モデルごとのサーキットブレーカーで
+飽和したリージョンを一時的に外して、設定されたリージョン・推論プロファイルに切り替える
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+import httpx
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, HTTPClientError
+
+from utils.bedrock_client import MAX_ATTEMPTS
+from utils.metrics import CIRCUIT_OPEN, FAILOVERS, METRICS_ENABLED, RETRIES, error_code
+
+logger = logging.getLogger(__name__)
+
+# リージョン=モデルID（推論プロファイル）を優先順にカンマ区切りで指定
+# 例: ap-northeast-1=apac.anthropic.claude-sonnet-4-20250514-v1:0,us-west-2=us.anthropic.claude-sonnet-4-20250514-v1:0
+FAILOVER_TARGETS = os.environ.get("BEDROCK_FAILOVER_TARGETS", "")
+
+RETRY_BASE_DELAY = float(os.environ.get("BEDROCK_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.environ.get("BEDROCK_RETRY_MAX_DELAY", "20"))
+
+# リトライ予算: リクエスト1件ごとに RATIO 回分の再試行が貯まり、MIN 回分は常に使える
+RETRY_BUDGET_RATIO = float(os.environ.get("BEDROCK_RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN = int(os.environ.get("BEDROCK_RETRY_BUDGET_MIN", "10"))
+
+# 連続してこの回数失敗したリージョン・モデルは COOLDOWN 秒間呼び出さない
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("BEDROCK_CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_COOLDOWN = float(os.environ.get("BEDROCK_CIRCUIT_COOLDOWN", "30"))
+
+# 再試行・フェイルオーバーの対象とするエラーコード（小文字で比較）
+RETRYABLE_CODES = {
+    "throttlingexception",
+    "toomanyrequestsexception",
+    "servicequotaexceededexception",
+    "serviceunavailableexception",
+    "internalserverexception",
+    "modelnotreadyexception",
+    "modeltimeoutexception",
+    "modelstreamerrorexception",
+    "429",
+    "500",
+    "502",
+    "503",
+    "504",
+}
+
+
+class CircuitOpenError(Exception):
+    """全てのリージョン・モデルのサーキットブレーカーが開いていて呼び出せない"""
+
+
+@dataclass(frozen=True)
+class FailoverTarget:
+    """呼び出し先のリージョンとモデルID（推論プロファイル）"""
+
+    region: str
+    model_id: str
+
+    def __str__(self):
+        return f"{self.region}/{self.model_id}"
+
+
+def parse_targets(spec, default_region, default_model_id):
+    """"リージョン=モデルID,..." 形式の設定を FailoverTarget のリストに変換"""
+    targets = []
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        region, model_id = item.split("=", 1)
+        target = FailoverTarget(region.strip(), model_id.strip())
+        if target not in targets:
+            targets.append(target)
+    return targets or [FailoverTarget(default_region, default_model_id)]
+
+
+# クロスリージョン推論プロファイルの接頭辞
+PROFILE_PREFIXES = {"us", "us-gov", "eu", "apac", "jp", "au", "ca", "global"}
+
+
+def retarget(targets, model_id):
+    """フェイルオーバー先の各リージョンで model_id を呼び出す呼び出し先に変換
+
+    推論プロファイルの接頭辞（apac. / us. など）は各呼び出し先のものに付け替える。
+    global. のプロファイルと接頭辞のないモデルIDはそのまま使う。
+    """
+    prefix, base = model_id.split(".", 1) if "." in model_id else (None, model_id)
+    retargeted = []
+    for target in targets:
+        target_prefix = target.model_id.split(".", 1)[0]
+        if prefix in PROFILE_PREFIXES and prefix != "global" and target_prefix in PROFILE_PREFIXES - {"global"}:
+            target = FailoverTarget(target.region, f"{target_prefix}.{base}")
+        else:
+            target = FailoverTarget(target.region, model_id)
+        if target not in retargeted:
+            retargeted.append(target)
+    return retargeted
+
+
+def is_retryable(error):
+    """再試行・フェイルオーバーで回復が見込めるエラーか"""
+    if isinstance(error, ClientError):
+        return error_code(error).lower() in RETRYABLE_CODES
+    return isinstance(error, (BotocoreConnectionError, HTTPClientError, httpx.TransportError))
+
+
+def backoff_delay(round_index, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    """フルジッター付き指数バックオフの待ち秒数"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** round_index)))
+
+
+class RetryBudget:
+    """再試行の回数をリクエスト数の一定割合に制限する予算
+
+    障害時に全リクエストが再試行を繰り返して負荷を増幅しないよう、
+    リクエスト1件ごとに ratio 回分を積み立て、再試行のたびに1回分を消費する。
+    """
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, minimum=RETRY_BUDGET_MIN):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.capacity = minimum + max(minimum, 1) * 10 * ratio
+        self._balance = float(minimum)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._balance = min(self.capacity, self._balance + self.ratio)
+
+    def withdraw(self):
+        """再試行1回分を消費できればTrue"""
+        with self._lock:
+            if self._balance >= 1:
+                self._balance -= 1
+                return True
+            return False
+
+    @property
+    def balance(self):
+        with self._lock:
+            return self._balance
+
+
+class CircuitBreaker:
+    """リージョン・モデルごとのサーキットブレーカー（closed → open → half_open → closed）"""
+
+    def __init__(self, target, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, cooldown=CIRCUIT_COOLDOWN):
+        self.target = target
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def allow(self):
+        """呼び出してよいか（half_openでは試しの1件だけ通す）"""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            # 試しの呼び出しが中断されて結果が記録されなかった場合に備え、cooldown 後は次の1件を通す
+            now = time.monotonic()
+            if state == "half_open" and (
+                self._probe_started is None or now - self._probe_started >= self.cooldown
+            ):
+                self._probe_started = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            was_open = self.opened_at is not None
+            self.failures = 0
+            self.opened_at = None
+            self._probe_started = None
+        if was_open:
+            logger.info(f"サーキットブレーカーを閉じました: {self.target}")
+            self._export(0)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            probing = self._probe_started is not None
+            self._probe_started = None
+            if not probing and (self.opened_at is not None or self.failures < self.failure_threshold):
+                return
+            self.opened_at = time.monotonic()
+        logger.warning(f"サーキットブレーカーを開きました: {self.target}（{self.cooldown:g}秒間停止）")
+        self._export(1)
+
+    def _export(self, value):
+        if METRICS_ENABLED:
+            CIRCUIT_OPEN.labels(self.target.region, self.target.model_id).set(value)
+
+
+class FailoverPolicy:
+    """リトライ予算・サーキットブレーカー・フェイルオーバー先を共有するポリシー"""
+
+    def __init__(
+        self,
+        targets,
+        max_attempts=MAX_ATTEMPTS,
+        base_delay=RETRY_BASE_DELAY,
+        max_delay=RETRY_MAX_DELAY,
+        retry_budget=None,
+        breakers=None,
+    ):
+        self.targets = list(targets)
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # 予算とブレーカーは既定ではプロセス内の全プロセッサで共有する
+        self.retry_budget = retry_budget if retry_budget is not None else get_retry_budget()
+        breakers = breakers or {}
+        self.breakers = {
+            target: breakers.get(target) or get_circuit_breaker(target) for target in self.targets
+        }
+
+    def start(self):
+        """1リクエスト分の試行を開始"""
+        self.retry_budget.deposit()
+        return FailoverAttempts(self)
+
+
+class FailoverAttempts:
+    """1リクエストの試行状態
+
+    使い方:
+        attempts = policy.start()
+        while True:
+            target, delay = attempts.next_target()  # 試行できなければ最後のエラーを送出
+            time.sleep(delay)
+            try:
+                response = call(target)
+            except Exception as e:
+                if not attempts.failed(target, e):
+                    raise
+                continue
+            attempts.succeeded(target)
+            break
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.attempt = 0
+        self.last_error = None
+        self._tried = set()
+        self._round = 0
+        self._previous = None
+
+    def next_target(self):
+        """次に呼び出す (FailoverTarget, 待ち秒数) を返す"""
+        policy = self.policy
+        if self.attempt >= policy.max_attempts:
+            raise self.last_error
+        if self.attempt > 0 and not policy.retry_budget.withdraw():
+            logger.warning("リトライ予算を使い切ったため再試行しません")
+            raise self.last_error
+
+        # まだ試していない、ブレーカーが閉じている呼び出し先を優先順に選ぶ
+        delay = 0.0
+        target = self._pick(exclude=self._tried)
+        if target is None:
+            # 一巡したらバックオフしてから先頭から試し直す
+            self._tried.clear()
+            target = self._pick()
+            if target is not None and self.attempt > 0:
+                delay = backoff_delay(self._round, policy.base_delay, policy.max_delay)
+                self._round += 1
+
+        if target is None:
+            if self.last_error is not None:
+                raise self.last_error
+            raise CircuitOpenError(
+                "全てのリージョンで一時的に呼び出しを停止しています。しばらく待ってから再度お試しください"
+                f"（{', '.join(str(t) for t in policy.targets)}）"
+            )
+
+        if self._previous is not None and target != self._previous:
+            logger.info(f"Bedrockの呼び出し先を切り替えます: {self._previous} → {target}")
+            if METRICS_ENABLED:
+                FAILOVERS.labels(target.region, target.model_id).inc()
+        self._previous = target
+        self._tried.add(target)
+        self.attempt += 1
+        return target, delay
+
+    def _pick(self, exclude=()):
+        for target in self.policy.targets:
+            if target not in exclude and self.policy.breakers[target].allow():
+                return target
+        return None
+
+    def failed(self, target, error, retry=True):
+        """失敗を記録し、再試行してよければTrueを返す（retry=False なら記録のみ）"""
+        self.last_error = error
+        if not is_retryable(error):
+            # 入力の誤りなどは呼び出し先の障害ではないため、ブレーカーには失敗として数えない
+            self.policy.breakers[target].record_success()
+            return False
+
+        self.policy.breakers[target].record_failure()
+        if not retry or self.attempt >= self.policy.max_attempts:
+            return False
+
+        code = error_code(error)
+        if METRICS_ENABLED:
+            RETRIES.labels(target.region, target.model_id, code).inc()
+        logger.warning(f"Bedrock呼び出しの一時的なエラーのため再試行します（{target}、{self.attempt}回目）: {code}")
+        return True
+
+    def succeeded(self, target):
+        self.policy.breakers[target].record_success()
+
+
+_lock = threading.Lock()
+_retry_budget = None
+_breakers = {}
+
+
+def get_retry_budget():
+    """プロセス共有のリトライ予算を取得"""
+    global _retry_budget
+    with _lock:
+        if _retry_budget is None:
+            _retry_budget = RetryBudget()
+        return _retry_budget
+
+
+def get_circuit_breaker(target):
+    """リージョン・モデルごとに共有されるサーキットブレーカーを取得"""
+    with _lock:
+        breaker = _breakers.get(target)
+        if breaker is None:
+            breaker = _breakers[target] = CircuitBreaker(target)
+        return breaker
+
@@ -0,0 +1,116 @@
+"""
+スレッドとイベントループの両方から待てる公平なセマフォ
+同期版（スレッドでブロック）と非同期版（イベントループ上で待機）の待ち手を1つの待ち行列に並べ、
+空きができたら到着順に割り当てる（非同期の待ち手が同期の待ち手に追い越され続けることがない）
+"""
+
+import asyncio
+import threading
+from collections import deque
+
+
+class _Waiter:
+    """待ち行列に並んでいる1件の取得要求"""
+
+    def __init__(self, amount, loop=None):
+        self.amount = amount
+        self.granted = False
+        # 同期版はEventで、非同期版は待ち手のイベントループのFutureで割り当てを知らせる
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def wake(self):
+        """割り当てを知らせる（待ち手のイベントループが終了していればFalse）"""
+        if self.loop is None:
+            self.event.set()
+            return True
+        try:
+            self.loop.call_soon_threadsafe(self._set_result)
+        except RuntimeError:
+            return False
+        return True
+
+    def _set_result(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class FairSemaphore:
+    """量を指定して確保するFIFOのセマフォ
+
+    待ち手がいる間は、空きがあっても後から来た要求は先頭を追い越さない。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.in_use = 0
+        self._lock = threading.Lock()
+        self._waiters = deque()
+
+    def _fits(self, amount):
+        return self.in_use + amount <= self.capacity
+
+    def try_acquire(self, amount=1):
+        """待たずに確保できればTrue（待ち手がいれば追い越さずにFalse）"""
+        with self._lock:
+            if self._waiters or not self._fits(amount):
+                return False
+            self.in_use += amount
+            return True
+
+    def _enqueue(self, amount, loop=None):
+        """すぐに確保できればNone、できなければ待ち行列に並べた_Waiterを返す"""
+        with self._lock:
+            if not self._waiters and self._fits(amount):
+                self.in_use += amount
+                return None
+            waiter = _Waiter(amount, loop)
+            self._waiters.append(waiter)
+            return waiter
+
+    def acquire(self, amount=1):
+        """空きができるまでスレッドをブロックして確保"""
+        waiter = self._enqueue(amount)
+        if waiter is None:
+            return
+        try:
+            waiter.event.wait()
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    async def acquire_async(self, amount=1):
+        """acquireの非同期版（スレッドを占有せずに待機）"""
+        waiter = self._enqueue(amount, asyncio.get_running_loop())
+        if waiter is None:
+            return
+        try:
+            await waiter.future
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter):
+        """待機を中断した要求を取り消す（割り当て済みなら返却する）"""
+        with self._lock:
+            if waiter.granted:
+                self.in_use -= waiter.amount
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            self._wake_waiters()
+
+    def release(self, amount=1):
+        """確保した量を返却し、先頭から入る分だけ待ち手に割り当てる"""
+        with self._lock:
+            if amount > self.in_use:
+                raise ValueError("確保していない量を返却しようとしました")
+            self.in_use -= amount
+            self._wake_waiters()
+
+    def _wake_waiters(self):
+        while self._waiters and self._fits(self._waiters[0].amount):
+            waiter = self._waiters.popleft()
+            if waiter.wake():
+                self.in_use += waiter.amount
+                waiter.granted = True
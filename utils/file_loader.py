@@ -1,34 +1,188 @@
 """
 ファイル読み込みユーティリティ
 プロンプトやUIテキストを外部ファイルから読み込む
+
+prompts/ と ui_texts/ の .md はパッケージの場所を基準に最初の利用時にまとめて読み込み、メモリに保持する
+リクエストごとにはファイルを開かず、BEDROCK_TEMPLATE_RELOAD_INTERVAL 秒ごとに更新時刻だけを確認して、
+変わったファイルを読み直す（アプリを再起動せずにプロンプトを編集できる）
+「名前@バリアント.md」はA/Bテスト用のバリアントで、BEDROCK_PROMPT_VARIANTS の割合で利用者ごとに選ぶ
 """
 
-import os
+import hashlib
 import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
 
 logger = logging.getLogger(__name__)
 
+# 相対パスを起動ディレクトリではなくパッケージの場所から解決する
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROMPTS_DIR = os.path.join(PACKAGE_ROOT, "prompts")
+UI_TEXTS_DIR = os.path.join(PACKAGE_ROOT, "ui_texts")
+
+# 更新時刻を確認する間隔（秒、0 で再読み込みしない）
+TEMPLATE_RELOAD_INTERVAL = float(os.environ.get("BEDROCK_TEMPLATE_RELOAD_INTERVAL", "2"))
+
+# プロンプトごとのバリアントと利用者の割合（%）。例: pdf_to_yaml_prompt=v2:50,pdf_to_markdown_prompt=v2:10|v3:10
+PROMPT_VARIANTS = os.environ.get("BEDROCK_PROMPT_VARIANTS", "")
+
+VARIANT_SEPARATOR = "@"
+TEMPLATE_EXTENSION = ".md"
+
+
+class TemplateNotFoundError(FileNotFoundError):
+    """プロンプト・UIテキストのファイルが見つからない"""
+
+
+@dataclass
+class Template:
+    """読み込んだテンプレート"""
+
+    name: str
+    variant: str
+    path: str
+    text: str
+    mtime_ns: int
+
 
 def load_text_file(file_path):
     """テキストファイルを読み込む"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        logger.error(f"ファイルが見つかりません: {file_path}")
-        return f"ファイルが見つかりません: {file_path}"
-    except Exception as e:
-        logger.error(f"ファイル読み込みエラー: {file_path} - {str(e)}")
-        return f"ファイル読み込みエラー: {str(e)}"
+    with open(file_path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def parse_variants(spec):
+    """"名前=バリアント:割合|バリアント:割合,..." 形式の設定を 名前→[(バリアント, 割合)] の辞書に変換"""
+    variants = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, choices = item.split("=", 1)
+        weights = []
+        for choice in choices.split("|"):
+            variant, _, percent = choice.partition(":")
+            weights.append((variant.strip(), float(percent) if percent.strip() else 100.0))
+        if sum(weight for _, weight in weights) > 100:
+            raise ValueError(f"プロンプトのバリアントの割合の合計が100%を超えています: {item.strip()}")
+        variants[name.strip()] = weights
+    return variants
+
+
+class TemplateRegistry:
+    """ディレクトリ内の .md をメモリに保持し、更新時刻が変わったものだけ読み直す"""
+
+    def __init__(self, directory, reload_interval=TEMPLATE_RELOAD_INTERVAL):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._templates = {}
+        self._checked_at = time.monotonic()
+        self._scan()
+
+    def _scan(self):
+        """ディレクトリを走査して、新しいファイルと更新されたファイルを読み込む（削除されたものは外す）"""
+        templates = {}
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(TEMPLATE_EXTENSION) or not entry.is_file():
+                continue
+            name, _, variant = entry.name[: -len(TEMPLATE_EXTENSION)].partition(VARIANT_SEPARATOR)
+            key = (name, variant or None)
+            mtime_ns = entry.stat().st_mtime_ns
+            current = self._templates.get(key)
+            if current is not None and current.mtime_ns == mtime_ns:
+                templates[key] = current
+                continue
+            templates[key] = Template(name, variant or None, entry.path, load_text_file(entry.path), mtime_ns)
+            if current is not None:
+                logger.info(f"テンプレートを読み直しました: {entry.path}")
+        self._templates = templates
+
+    def _revalidate(self):
+        if self.reload_interval <= 0 or time.monotonic() - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = time.monotonic()
+        try:
+            self._scan()
+        except OSError as e:
+            # 編集中などで読めない場合は、前回読み込んだ内容を使い続ける
+            logger.warning(f"テンプレートの再読み込みに失敗しました: {str(e)}")
+
+    def get(self, name, variant=None):
+        """テンプレートの本文を返す（なければ TemplateNotFoundError）"""
+        with self._lock:
+            self._revalidate()
+            template = self._templates.get((name, variant))
+        if template is None:
+            file_name = name + (f"{VARIANT_SEPARATOR}{variant}" if variant else "") + TEMPLATE_EXTENSION
+            raise TemplateNotFoundError(f"ファイルが見つかりません: {os.path.join(self.directory, file_name)}")
+        return template.text
+
+    def variants(self, name):
+        """テンプレートのバリアント名の一覧"""
+        with self._lock:
+            return sorted(variant for template_name, variant in self._templates if template_name == name and variant)
+
+
+class PromptRegistry(TemplateRegistry):
+    """プロンプトのテンプレート（A/Bテスト用のバリアントを割合で選ぶ）"""
+
+    def __init__(self, directory=PROMPTS_DIR, variants=PROMPT_VARIANTS, reload_interval=TEMPLATE_RELOAD_INTERVAL):
+        super().__init__(directory, reload_interval)
+        self.variant_weights = parse_variants(variants)
+        # 設定したバリアントのファイルがなければ、起動時に失敗させる
+        for name, weights in self.variant_weights.items():
+            self.get(name)
+            for variant, _ in weights:
+                self.get(name, variant)
+
+    def select_variant(self, name, user=None):
+        """利用者に割り当てるバリアント（None は既定のプロンプト）
+
+        利用者とプロンプト名のハッシュで決めるため、同じ利用者には常に同じバリアントを使う。
+        """
+        weights = self.variant_weights.get(name)
+        if not weights:
+            return None
+        digest = hashlib.sha256(f"{name}:{user or ''}".encode("utf-8")).digest()
+        bucket = int.from_bytes(digest[:8], "big") % 10000 / 100
+        for variant, weight in weights:
+            if bucket < weight:
+                return variant
+            bucket -= weight
+        return None
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_prompt_registry():
+    """プロセス共有のプロンプトのレジストリを取得"""
+    with _registries_lock:
+        if "prompts" not in _registries:
+            _registries["prompts"] = PromptRegistry()
+        return _registries["prompts"]
+
+
+def get_ui_text_registry():
+    """プロセス共有のUIテキストのレジストリを取得"""
+    with _registries_lock:
+        if "ui_texts" not in _registries:
+            _registries["ui_texts"] = TemplateRegistry(UI_TEXTS_DIR)
+        return _registries["ui_texts"]
 
 
-def load_prompt(prompt_name):
-    """プロンプトファイルを読み込む"""
-    file_path = os.path.join("prompts", f"{prompt_name}.md")
-    return load_text_file(file_path)
+def load_prompt(prompt_name, user=None):
+    """プロンプトを取得（バリアントを設定していれば利用者ごとに選ぶ）"""
+    registry = get_prompt_registry()
+    variant = registry.select_variant(prompt_name, user)
+    if variant:
+        logger.debug(f"プロンプトのバリアントを使用します: {prompt_name}{VARIANT_SEPARATOR}{variant}（{user}）")
+    return registry.get(prompt_name, variant)
 
 
 def load_ui_text(text_name):
-    """UIテキストファイルを読み込む"""
-    file_path = os.path.join("ui_texts", f"{text_name}.md")
-    return load_text_file(file_path)
\ No newline at end of file
+    """UIテキストを取得"""
+    return get_ui_text_registry().get(text_name)
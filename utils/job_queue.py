@@ -0,0 +1,632 @@
+"""
+変換ジョブのキュー
+長時間かかる変換をSQLiteの永続キューに登録し、バックグラウンドのワーカープロセスで処理する
+ブラウザとの接続が切れても処理は続き、結果はジョブIDで後から取得できる
+複数のアプリ・ワーカーが同じデータベースファイル（BEDROCK_SHARED_BACKEND=redis ではRedis）を共有して使う
+入力PDFと結果ファイルは BEDROCK_JOB_FILES_DIR に置くため、複数のノードでは共有ストレージにする
+"""
+
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+
+from utils.redis_backend import get_redis, redis_key, use_redis
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_QUEUE_PATH = os.environ.get("BEDROCK_JOB_QUEUE_PATH", os.path.join(".cache", "jobs.sqlite3"))
+
+# 入力PDFと変換結果のファイルの保存先（アップロードの一時ファイルは消えるためコピーして保持する）
+DEFAULT_JOB_FILES_DIR = os.environ.get("BEDROCK_JOB_FILES_DIR", os.path.join(".cache", "job_files"))
+
+# ワーカーがこの秒数ハートビートを送らなければ、停止したとみなして別のワーカーが引き継ぐ
+JOB_LEASE_SECONDS = float(os.environ.get("BEDROCK_JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("BEDROCK_JOB_MAX_ATTEMPTS", "3"))
+
+# 完了したジョブと結果ファイルを保持する秒数
+JOB_RETENTION_SECONDS = int(os.environ.get("BEDROCK_JOB_RETENTION", str(7 * 24 * 60 * 60)))
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+STATUS_LABELS = {
+    STATUS_QUEUED: "⏳ 待機中",
+    STATUS_RUNNING: "🔄 実行中",
+    STATUS_DONE: "✅ 完了",
+    STATUS_FAILED: "❌ 失敗",
+}
+
+JOB_COLUMNS = (
+    "job_id",
+    "user",
+    "kind",
+    "document_name",
+    "input_path",
+    "options",
+    "status",
+    "created_at",
+    "started_at",
+    "finished_at",
+    "heartbeat_at",
+    "worker_id",
+    "attempts",
+    "result_text",
+    "output_path",
+    "error",
+    "model_id",
+    "usage",
+    "owner",
+)
+
+
+@dataclass
+class Job:
+    """変換ジョブ"""
+
+    job_id: str
+    user: str
+    kind: str
+    document_name: str
+    input_path: str
+    options: dict = field(default_factory=dict)
+    status: str = STATUS_QUEUED
+    created_at: float = 0.0
+    started_at: float = None
+    finished_at: float = None
+    heartbeat_at: float = None
+    worker_id: str = None
+    attempts: int = 0
+    result_text: str = None
+    output_path: str = None
+    error: str = None
+    model_id: str = None
+    usage: dict = field(default_factory=dict)
+    # 一覧・結果を見られる所有者（ログイン名、またはブラウザごとの推測できない識別子）
+    # user は使用量・予算の集計に使う利用者で、ログインしていなければ接続元IP
+    owner: str = None
+
+    @property
+    def status_label(self):
+        return STATUS_LABELS.get(self.status, self.status)
+
+    @property
+    def finished(self):
+        return self.status in (STATUS_DONE, STATUS_FAILED)
+
+    @classmethod
+    def from_row(cls, row):
+        values = dict(zip(JOB_COLUMNS, row))
+        values["options"] = json.loads(values["options"] or "{}")
+        values["usage"] = json.loads(values["usage"] or "{}")
+        return cls(**values)
+
+    def to_json(self):
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(**json.loads(value))
+
+
+class JobFiles:
+    """ジョブの入力・結果ファイルの置き場所"""
+
+    files_dir = DEFAULT_JOB_FILES_DIR
+
+    def job_dir(self, job_id):
+        """ジョブの入力・結果ファイルを置くディレクトリ"""
+        return os.path.join(self.files_dir, job_id)
+
+    def _copy_input(self, job_id, pdf_file):
+        """PDFをジョブ用の保存先にコピーし、(ドキュメント名, コピー先のパス) を返す"""
+        document_name = os.path.basename(pdf_file)
+        # 元のファイル名のまま保存し、ドキュメント名・結果ファイル名に使う
+        os.makedirs(self.job_dir(job_id), exist_ok=True)
+        input_path = os.path.join(self.job_dir(job_id), document_name)
+        shutil.copyfile(pdf_file, input_path)
+        return document_name, input_path
+
+    def _remove_files(self, job_ids):
+        for job_id in job_ids:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        if job_ids:
+            logger.info(f"保持期間を過ぎたジョブを {len(job_ids)} 件削除しました")
+
+
+class JobQueue(JobFiles):
+    """SQLiteに保存する変換ジョブのキュー（複数プロセスから共有できる）"""
+
+    def __init__(
+        self,
+        path=DEFAULT_JOB_QUEUE_PATH,
+        files_dir=DEFAULT_JOB_FILES_DIR,
+        lease_seconds=JOB_LEASE_SECONDS,
+        max_attempts=JOB_MAX_ATTEMPTS,
+    ):
+        self.path = path
+        self.files_dir = files_dir
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        os.makedirs(files_dir, exist_ok=True)
+
+        # トランザクションは明示的に開始する（取り出しは BEGIN IMMEDIATE で他のプロセスと排他）
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                user TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                document_name TEXT NOT NULL,
+                input_path TEXT NOT NULL,
+                options TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                heartbeat_at REAL,
+                worker_id TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result_text TEXT,
+                output_path TEXT,
+                error TEXT,
+                model_id TEXT,
+                usage TEXT,
+                owner TEXT
+            )
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            # 所有者の列がなかった頃のジョブは、登録した利用者を所有者にする
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            self._conn.execute("UPDATE jobs SET owner = user")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created_at)")
+
+    def submit(self, user, kind, pdf_file, options=None, owner=None):
+        """PDFをジョブ用の保存先にコピーしてジョブを登録し、ジョブIDを返す（owner の既定は user）"""
+        job_id = uuid.uuid4().hex
+        document_name, input_path = self._copy_input(job_id, pdf_file)
+
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO jobs (job_id, user, kind, document_name, input_path, options, status, created_at, owner)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    job_id,
+                    user,
+                    kind,
+                    document_name,
+                    input_path,
+                    json.dumps(options or {}, ensure_ascii=False),
+                    STATUS_QUEUED,
+                    time.time(),
+                    owner or user,
+                ),
+            )
+        logger.info(f"ジョブを登録しました: {job_id}（{kind}, {document_name}, {user}）")
+        return job_id
+
+    def claim(self, worker_id, kinds=None):
+        """次のジョブを取り出して実行中にする（なければNone）
+
+        待機中のジョブに加え、ハートビートが途絶えたワーカーのジョブも引き継ぐ。
+        """
+        now = time.time()
+        kind_filter = ""
+        params = [STATUS_QUEUED, STATUS_RUNNING, now - self.lease_seconds]
+        if kinds:
+            kind_filter = f" AND kind IN ({', '.join('?' for _ in kinds)})"
+            params.extend(kinds)
+
+        with self._lock:
+            while True:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self._conn.execute(
+                        f"""
+                        SELECT {', '.join(JOB_COLUMNS)} FROM jobs
+                        WHERE (status = ? OR (status = ? AND heartbeat_at < ?)){kind_filter}
+                        ORDER BY created_at
+                        LIMIT 1
+                        """,
+                        params,
+                    ).fetchone()
+                    if row is None:
+                        self._conn.execute("COMMIT")
+                        return None
+
+                    job = Job.from_row(row)
+                    if job.attempts >= self.max_attempts:
+                        # 何度引き継いでも完了しないジョブは失敗として打ち切り、次のジョブを探す
+                        self._conn.execute(
+                            "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE job_id = ?",
+                            (STATUS_FAILED, now, "ワーカーが応答しなくなったため中止しました", job.job_id),
+                        )
+                        self._conn.execute("COMMIT")
+                        logger.warning(f"ジョブを中止しました（試行 {job.attempts} 回）: {job.job_id}")
+                        continue
+
+                    self._conn.execute(
+                        """
+                        UPDATE jobs SET status = ?, started_at = ?, heartbeat_at = ?, worker_id = ?,
+                            attempts = attempts + 1
+                        WHERE job_id = ?
+                        """,
+                        (STATUS_RUNNING, now, now, worker_id, job.job_id),
+                    )
+                    self._conn.execute("COMMIT")
+                    break
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+
+        if job.status == STATUS_RUNNING:
+            logger.warning(f"停止したワーカー（{job.worker_id}）のジョブを引き継ぎます: {job.job_id}")
+        job.status = STATUS_RUNNING
+        job.started_at = job.heartbeat_at = now
+        job.worker_id = worker_id
+        job.attempts += 1
+        return job
+
+    def heartbeat(self, job_id, worker_id):
+        """実行中であることを記録（他のワーカーに引き継がれていればFalse）"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE job_id = ? AND worker_id = ? AND status = ?",
+                (time.time(), job_id, worker_id, STATUS_RUNNING),
+            )
+        return cursor.rowcount > 0
+
+    def complete(self, job_id, worker_id, result_text, output_path=None, model_id=None, usage=None):
+        """ジョブの結果を保存して完了にする"""
+        with self._lock:
+            self._conn.execute(
+                """
+                UPDATE jobs SET status = ?, finished_at = ?, result_text = ?, output_path = ?,
+                    model_id = ?, usage = ?, error = NULL
+                WHERE job_id = ? AND worker_id = ?
+                """,
+                (
+                    STATUS_DONE,
+                    time.time(),
+                    result_text,
+                    output_path,
+                    model_id,
+                    json.dumps(usage or {}),
+                    job_id,
+                    worker_id,
+                ),
+            )
+
+    def fail(self, job_id, worker_id, error):
+        """ジョブを失敗にする"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE job_id = ? AND worker_id = ?",
+                (STATUS_FAILED, time.time(), error, job_id, worker_id),
+            )
+
+    def get(self, job_id, owner=None):
+        """ジョブを取得（owner を指定すると本人のジョブのみ）"""
+        query = f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE job_id = ?"
+        params = [job_id]
+        if owner is not None:
+            query += " AND owner = ?"
+            params.append(owner)
+        with self._lock:
+            row = self._conn.execute(query, params).fetchone()
+        return Job.from_row(row) if row is not None else None
+
+    def list_jobs(self, owner=None, limit=50):
+        """新しい順にジョブを返す（owner を指定すると本人のジョブのみ）"""
+        query = f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs"
+        params = []
+        if owner is not None:
+            query += " WHERE owner = ?"
+            params.append(owner)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [Job.from_row(row) for row in rows]
+
+    def queue_position(self, job_id):
+        """待機中のジョブの前に何件あるか（待機中でなければNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT COUNT(*) FROM jobs
+                WHERE status = ? AND created_at < (
+                    SELECT created_at FROM jobs WHERE job_id = ? AND status = ?
+                )
+                """,
+                (STATUS_QUEUED, job_id, STATUS_QUEUED),
+            ).fetchone()
+            exists = self._conn.execute(
+                "SELECT 1 FROM jobs WHERE job_id = ? AND status = ?", (job_id, STATUS_QUEUED)
+            ).fetchone()
+        return row[0] if exists else None
+
+    def purge(self, retention_seconds=JOB_RETENTION_SECONDS):
+        """保持期間を過ぎた完了・失敗ジョブと、その入力・結果ファイルを削除し、削除件数を返す"""
+        cutoff = time.time() - retention_seconds
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (STATUS_DONE, STATUS_FAILED, cutoff),
+            ).fetchall()
+            self._conn.executemany("DELETE FROM jobs WHERE job_id = ?", rows)
+
+        self._remove_files([job_id for (job_id,) in rows])
+        return len(rows)
+
+
+def _decode(values):
+    """Redisから返ったメンバー（bytes）を文字列のリストにする"""
+    return [value.decode() if isinstance(value, bytes) else value for value in values]
+
+
+class RedisJobQueue(JobFiles):
+    """Redisに保存する変換ジョブのキュー（複数のノードのアプリ・ワーカーで共有できる）
+
+    ジョブはJSONで保存し、待機中（種類ごと）・実行中（ハートビート時刻）・完了・全件・ユーザー別の
+    ソート済みセットで引く。状態の変更は WATCH / MULTI で行い、同じジョブを2つのワーカーが取り出さない。
+    """
+
+    def __init__(
+        self,
+        client=None,
+        files_dir=DEFAULT_JOB_FILES_DIR,
+        lease_seconds=JOB_LEASE_SECONDS,
+        max_attempts=JOB_MAX_ATTEMPTS,
+    ):
+        self.client = client if client is not None else get_redis()
+        self.files_dir = files_dir
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(files_dir, exist_ok=True)
+
+    @staticmethod
+    def _job_key(job_id):
+        return redis_key("job", job_id)
+
+    @staticmethod
+    def _queued_key(kind):
+        return redis_key("jobs", "queued", kind)
+
+    @staticmethod
+    def _owner_key(owner):
+        return redis_key("jobs", "owner", owner)
+
+    def _write(self, pipe, job):
+        """ジョブ本体と、状態に応じた索引を更新する（pipe はMULTI中のパイプライン）"""
+        pipe.set(self._job_key(job.job_id), job.to_json())
+        if job.status == STATUS_RUNNING:
+            pipe.zrem(self._queued_key(job.kind), job.job_id)
+            pipe.zadd(redis_key("jobs", "running"), {job.job_id: job.heartbeat_at})
+        elif job.finished:
+            pipe.zrem(self._queued_key(job.kind), job.job_id)
+            pipe.zrem(redis_key("jobs", "running"), job.job_id)
+            pipe.zadd(redis_key("jobs", "finished"), {job.job_id: job.finished_at})
+
+    def _update(self, job_id, update):
+        """ジョブを読み込んで update(job) で変更し、他の更新と競合しなければ保存する
+
+        update がFalseを返した場合は保存せずNoneを返す。
+        """
+        from redis.exceptions import WatchError
+
+        key = self._job_key(job_id)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    value = pipe.get(key)
+                    job = Job.from_json(value) if value else None
+                    if job is None or not update(job):
+                        pipe.unwatch()
+                        return None
+                    pipe.multi()
+                    self._write(pipe, job)
+                    pipe.execute()
+                    return job
+                except WatchError:
+                    # 他のワーカーが先に更新したため、読み込み直して判定し直す
+                    continue
+
+    def _load(self, job_ids):
+        if not job_ids:
+            return []
+        values = self.client.mget([self._job_key(job_id) for job_id in job_ids])
+        return [Job.from_json(value) for value in values if value]
+
+    def submit(self, user, kind, pdf_file, options=None, owner=None):
+        """PDFをジョブ用の保存先にコピーしてジョブを登録し、ジョブIDを返す（owner の既定は user）"""
+        job_id = uuid.uuid4().hex
+        document_name, input_path = self._copy_input(job_id, pdf_file)
+        job = Job(
+            job_id=job_id,
+            user=user,
+            kind=kind,
+            document_name=document_name,
+            input_path=input_path,
+            options=options or {},
+            created_at=time.time(),
+            owner=owner or user,
+        )
+
+        with self.client.pipeline() as pipe:
+            pipe.set(self._job_key(job_id), job.to_json())
+            pipe.sadd(redis_key("jobs", "kinds"), kind)
+            pipe.zadd(self._queued_key(kind), {job_id: job.created_at})
+            pipe.zadd(redis_key("jobs", "all"), {job_id: job.created_at})
+            pipe.zadd(self._owner_key(job.owner), {job_id: job.created_at})
+            pipe.execute()
+        logger.info(f"ジョブを登録しました: {job_id}（{kind}, {document_name}, {user}）")
+        return job_id
+
+    def _candidates(self, kinds):
+        """取り出し候補（各種類の待機中の先頭と、ハートビートが途絶えた実行中のジョブ）を古い順に返す"""
+        if not kinds:
+            kinds = _decode(self.client.smembers(redis_key("jobs", "kinds")))
+        job_ids = []
+        for kind in kinds:
+            job_ids.extend(self.client.zrange(self._queued_key(kind), 0, 0))
+        job_ids.extend(
+            self.client.zrangebyscore(redis_key("jobs", "running"), "-inf", time.time() - self.lease_seconds)
+        )
+        jobs = [job for job in self._load(_decode(job_ids)) if job.kind in kinds]
+        return sorted(jobs, key=lambda job: job.created_at)
+
+    def claim(self, worker_id, kinds=None):
+        """次のジョブを取り出して実行中にする（なければNone）
+
+        待機中のジョブに加え、ハートビートが途絶えたワーカーのジョブも引き継ぐ。
+        """
+        while True:
+            candidates = self._candidates(kinds)
+            if not candidates:
+                return None
+
+            for candidate in candidates:
+                now = time.time()
+                previous = {}
+
+                def take(job):
+                    stale = job.status == STATUS_RUNNING and (job.heartbeat_at or 0) < now - self.lease_seconds
+                    if job.status != STATUS_QUEUED and not stale:
+                        return False
+                    previous.update(status=job.status, worker_id=job.worker_id)
+                    if job.attempts >= self.max_attempts:
+                        # 何度引き継いでも完了しないジョブは失敗として打ち切る
+                        job.status = STATUS_FAILED
+                        job.finished_at = now
+                        job.error = "ワーカーが応答しなくなったため中止しました"
+                    else:
+                        job.status = STATUS_RUNNING
+                        job.started_at = job.heartbeat_at = now
+                        job.worker_id = worker_id
+                        job.attempts += 1
+                    return True
+
+                job = self._update(candidate.job_id, take)
+                if job is None:
+                    # 他のワーカーが先に取り出した
+                    continue
+                if job.status == STATUS_FAILED:
+                    logger.warning(f"ジョブを中止しました（試行 {job.attempts} 回）: {job.job_id}")
+                    break
+                if previous["status"] == STATUS_RUNNING:
+                    logger.warning(f"停止したワーカー（{previous['worker_id']}）のジョブを引き継ぎます: {job.job_id}")
+                return job
+
+    def heartbeat(self, job_id, worker_id):
+        """実行中であることを記録（他のワーカーに引き継がれていればFalse）"""
+
+        def beat(job):
+            if job.worker_id != worker_id or job.status != STATUS_RUNNING:
+                return False
+            job.heartbeat_at = time.time()
+            return True
+
+        return self._update(job_id, beat) is not None
+
+    def complete(self, job_id, worker_id, result_text, output_path=None, model_id=None, usage=None):
+        """ジョブの結果を保存して完了にする"""
+
+        def done(job):
+            if job.worker_id != worker_id:
+                return False
+            job.status = STATUS_DONE
+            job.finished_at = time.time()
+            job.result_text = result_text
+            job.output_path = output_path
+            job.model_id = model_id
+            job.usage = usage or {}
+            job.error = None
+            return True
+
+        self._update(job_id, done)
+
+    def fail(self, job_id, worker_id, error):
+        """ジョブを失敗にする"""
+
+        def failed(job):
+            if job.worker_id != worker_id:
+                return False
+            job.status = STATUS_FAILED
+            job.finished_at = time.time()
+            job.error = error
+            return True
+
+        self._update(job_id, failed)
+
+    def get(self, job_id, owner=None):
+        """ジョブを取得（owner を指定すると本人のジョブのみ）"""
+        value = self.client.get(self._job_key(job_id))
+        job = Job.from_json(value) if value else None
+        if job is None or (owner is not None and job.owner != owner):
+            return None
+        return job
+
+    def list_jobs(self, owner=None, limit=50):
+        """新しい順にジョブを返す（owner を指定すると本人のジョブのみ）"""
+        index = self._owner_key(owner) if owner is not None else redis_key("jobs", "all")
+        return self._load(_decode(self.client.zrevrange(index, 0, limit - 1)))
+
+    def queue_position(self, job_id):
+        """待機中のジョブの前に何件あるか（待機中でなければNone）"""
+        job = self.get(job_id)
+        if job is None or job.status != STATUS_QUEUED:
+            return None
+        kinds = _decode(self.client.smembers(redis_key("jobs", "kinds")))
+        return sum(self.client.zcount(self._queued_key(kind), "-inf", f"({job.created_at}") for kind in kinds)
+
+    def purge(self, retention_seconds=JOB_RETENTION_SECONDS):
+        """保持期間を過ぎた完了・失敗ジョブと、その入力・結果ファイルを削除し、削除件数を返す"""
+        cutoff = time.time() - retention_seconds
+        job_ids = _decode(self.client.zrangebyscore(redis_key("jobs", "finished"), "-inf", f"({cutoff}"))
+        jobs = self._load(job_ids)
+
+        with self.client.pipeline() as pipe:
+            for job in jobs:
+                pipe.delete(self._job_key(job.job_id))
+                pipe.zrem(redis_key("jobs", "all"), job.job_id)
+                pipe.zrem(self._owner_key(job.owner), job.job_id)
+            if job_ids:
+                pipe.zrem(redis_key("jobs", "finished"), *job_ids)
+            pipe.execute()
+
+        self._remove_files([job.job_id for job in jobs])
+        return len(jobs)
+
+
+_default_queue = None
+_default_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """プロセス共有のジョブキューを取得（BEDROCK_SHARED_BACKEND=redis ではRedis）"""
+    global _default_queue
+    with _default_queue_lock:
+        if _default_queue is None:
+            _default_queue = RedisJobQueue() if use_redis() else JobQueue()
+        return _default_queue
@@ -0,0 +1,176 @@
+"""
+変換ジョブのワーカー
+ジョブキューからジョブを取り出して変換し、結果をキューに保存する
+実行中は定期的にハートビートを送り、停止したワーカーのジョブは他のワーカーが引き継ぐ
+"""
+
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from utils.batch_runner import OUTPUT_FORMATS, create_processors
+from utils.bedrock_processor import format_client_error, format_result_text
+from utils.file_loader import load_prompt
+from utils.job_queue import get_job_queue
+from utils.pdf_chunker import DEFAULT_PAGES_PER_CHUNK, strip_code_fence
+
+logger = logging.getLogger(__name__)
+
+# app.py から起動するワーカープロセス数（最初のジョブの登録時に起動する。0なら起動せず、job_worker.py を別に動かす）
+JOB_WORKERS = int(os.environ.get("BEDROCK_JOB_WORKERS", "2"))
+
+# キューが空のときに次のジョブを確認する間隔（秒）
+JOB_POLL_INTERVAL = float(os.environ.get("BEDROCK_JOB_POLL_INTERVAL", "2"))
+
+# 保持期間を過ぎたジョブを削除する間隔（秒）
+PURGE_INTERVAL = 60 * 60
+
+
+class JobWorker:
+    """ジョブキューからジョブを取り出して変換するワーカー"""
+
+    def __init__(self, queue, processors, worker_id=None, poll_interval=JOB_POLL_INTERVAL):
+        self.queue = queue
+        self.processors = processors
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_interval = poll_interval
+        self._last_purge = 0.0
+
+    def run_once(self):
+        """ジョブを1件処理し、処理したらTrueを返す"""
+        job = self.queue.claim(self.worker_id, kinds=list(self.processors))
+        if job is None:
+            return False
+
+        logger.info(f"ジョブを開始します: {job.job_id}（{job.kind}, {job.document_name}）")
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, stop_heartbeat), daemon=True)
+        heartbeat.start()
+        try:
+            result, output_path = self._convert(job)
+        except ClientError as e:
+            self.queue.fail(job.job_id, self.worker_id, format_client_error(e))
+            logger.error(f"ジョブが失敗しました: {job.job_id} - {str(e)}")
+        except Exception as e:
+            self.queue.fail(job.job_id, self.worker_id, f"エラー: {str(e)}")
+            logger.error(f"ジョブが失敗しました: {job.job_id} - {str(e)}")
+        else:
+            self.queue.complete(
+                job.job_id,
+                self.worker_id,
+                format_result_text(result),
+                output_path=output_path,
+                model_id=result.model_id,
+                usage=result.usage,
+            )
+            logger.info(f"ジョブが完了しました: {job.job_id}")
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+        return True
+
+    def _convert(self, job):
+        """ジョブの変換を実行し、(ConversionResult, 結果ファイルのパス) を返す"""
+        spec = OUTPUT_FORMATS[job.kind]
+        processor = self.processors[job.kind]
+        prompt_text = load_prompt(spec.prompt_name, job.user)
+        options = job.options
+        model_hint = options.get("model_hint")
+
+        if options.get("chunked"):
+            result = processor.run_chunked_document_request(
+                job.input_path,
+                prompt_text,
+                spec.merge_chunks,
+                pages_per_chunk=int(options.get("pages_per_chunk", DEFAULT_PAGES_PER_CHUNK)),
+                user=job.user,
+                model_hint=model_hint,
+            )
+        else:
+            result = processor.run_document_request(job.input_path, prompt_text, user=job.user, model_hint=model_hint)
+        result = processor.finalize_result(job.input_path, result, user=job.user, model_hint=model_hint)
+
+        output_path = os.path.splitext(job.input_path)[0] + spec.extension
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(strip_code_fence(result.text, spec.fence_language).strip() + "\n")
+        return result, output_path
+
+    def _heartbeat(self, job, stop):
+        """ジョブの実行中、リース期間の1/3ごとにハートビートを送る"""
+        interval = max(1.0, self.queue.lease_seconds / 3)
+        while not stop.wait(interval):
+            try:
+                if not self.queue.heartbeat(job.job_id, self.worker_id):
+                    logger.warning(f"ジョブが他のワーカーに引き継がれました: {job.job_id}")
+                    return
+            except Exception as e:
+                logger.warning(f"ハートビートの送信に失敗しました: {job.job_id} - {str(e)}")
+
+    def run_forever(self, stop=None):
+        """stop がセットされるまでジョブを処理し続ける"""
+        stop = stop or threading.Event()
+        logger.info(f"ジョブワーカーを起動しました: {self.worker_id}")
+        while not stop.is_set():
+            try:
+                if time.monotonic() - self._last_purge > PURGE_INTERVAL:
+                    self._last_purge = time.monotonic()
+                    self.queue.purge()
+                if not self.run_once():
+                    stop.wait(self.poll_interval)
+            except Exception as e:
+                logger.error(f"ジョブワーカーのエラー: {str(e)}")
+                stop.wait(self.poll_interval)
+
+
+def run_worker_process(formats=tuple(OUTPUT_FORMATS)):
+    """ワーカープロセスのエントリーポイント"""
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    JobWorker(get_job_queue(), create_processors(formats)).run_forever()
+
+
+def start_worker_processes(count=JOB_WORKERS, formats=tuple(OUTPUT_FORMATS)):
+    """ワーカープロセスを起動し、プロセスのリストを返す（親プロセスの終了時に一緒に終了する）"""
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for index in range(count):
+        process = context.Process(
+            target=run_worker_process, args=(tuple(formats),), name=f"job-worker-{index}", daemon=True
+        )
+        process.start()
+        processes.append(process)
+    if processes:
+        logger.info(f"ジョブワーカーを {len(processes)} プロセス起動しました")
+    return processes
+
+
+# app.py から有効にしたワーカープロセス（UIの起動時ではなく、ジョブが登録されてから起動する）
+_embedded_count = 0
+_embedded_processes = []
+_embedded_lock = threading.Lock()
+
+
+def enable_embedded_workers(count=JOB_WORKERS):
+    """このプロセスからワーカープロセスを起動できるようにする（起動は ensure_embedded_workers まで遅らせる）"""
+    global _embedded_count
+    with _embedded_lock:
+        _embedded_count = count
+
+
+def ensure_embedded_workers():
+    """有効にしたワーカープロセスが動いていなければ起動する（終了したプロセスは起動し直す）"""
+    with _embedded_lock:
+        if _embedded_count <= 0:
+            return
+        alive = [process for process in _embedded_processes if process.is_alive()]
+        try:
+            if len(alive) < _embedded_count:
+                alive.extend(start_worker_processes(_embedded_count - len(alive)))
+        except Exception as e:
+            # 登録したジョブはキューに残り、次の登録時か別のワーカーが処理する
+            logger.error(f"ジョブワーカーの起動に失敗しました: {str(e)}")
+        _embedded_processes[:] = alive
@@ -0,0 +1,226 @@
+"""
+リクエスト計測とPrometheusメトリクス
+Bedrock呼び出しごとに「ファイル読み込み → ペイロード作成 → Bedrock呼び出し → 応答の組み立て」の
+所要時間を計測し、トークン数・キャッシュヒット・スロットリング・エラーと合わせて
+タブ・モデルIDごとのカウンタ/ヒストグラムに記録する
+"""
+
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from botocore.exceptions import ClientError
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.environ.get("BEDROCK_METRICS_ENABLED", "1") == "1"
+
+# 各リクエストの計測結果をJSONでログ出力するか
+TRACE_LOG_ENABLED = os.environ.get("BEDROCK_TRACE_LOG", "0") == "1"
+
+THROTTLING_CODES = {"ThrottlingException", "throttlingException", "TooManyRequestsException"}
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+SPAN_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REQUESTS = Counter(
+    "bedrock_pdf_requests_total",
+    "Bedrockへのリクエスト数（status: ok / cache_hit / throttled / error）",
+    ["tab", "model_id", "operation", "status"],
+)
+REQUEST_SECONDS = Histogram(
+    "bedrock_pdf_request_seconds",
+    "リクエスト全体の所要時間",
+    ["tab", "model_id", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+SPAN_SECONDS = Histogram(
+    "bedrock_pdf_span_seconds",
+    "リクエスト内の各段階の所要時間（file_read / payload_build / scheduler_wait / bedrock_call / response_assembly）",
+    ["tab", "model_id", "span"],
+    buckets=SPAN_BUCKETS,
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "bedrock_pdf_time_to_first_token_seconds",
+    "ストリーミングで最初のテキストを受け取るまでの時間",
+    ["tab", "model_id"],
+    buckets=LATENCY_BUCKETS,
+)
+TOKENS = Counter(
+    "bedrock_pdf_tokens_total",
+    "Bedrockが報告したトークン数（kind: input / output / cache_read / cache_write）",
+    ["tab", "model_id", "kind"],
+)
+CACHE_HITS = Counter(
+    "bedrock_pdf_result_cache_hits_total",
+    "結果キャッシュのヒット数（Bedrock呼び出しなし）",
+    ["tab", "model_id"],
+)
+THROTTLES = Counter(
+    "bedrock_pdf_throttles_total",
+    "Bedrockのスロットリング応答数",
+    ["tab", "model_id"],
+)
+ERRORS = Counter(
+    "bedrock_pdf_errors_total",
+    "Bedrock呼び出しのエラー数",
+    ["tab", "model_id", "error_code"],
+)
+RETRIES = Counter(
+    "bedrock_pdf_retries_total",
+    "一時的なエラーによる再試行数（リージョン・モデルID・エラーコード別）",
+    ["region", "model_id", "error_code"],
+)
+FAILOVERS = Counter(
+    "bedrock_pdf_failovers_total",
+    "別のリージョン・モデルへの切り替え数（切り替え先別）",
+    ["region", "model_id"],
+)
+CIRCUIT_OPEN = Gauge(
+    "bedrock_pdf_circuit_open",
+    "サーキットブレーカーが開いているか（1: 停止中）",
+    ["region", "model_id"],
+)
+PREFLIGHT_SAVED_BYTES = Counter(
+    "bedrock_pdf_preflight_saved_bytes_total",
+    "PDFの最適化で削減した送信バイト数",
+    ["tab"],
+)
+IN_FLIGHT_DOCUMENT_BYTES = Gauge(
+    "bedrock_pdf_in_flight_document_bytes",
+    "処理中のドキュメントの合計バイト数",
+)
+IN_FLIGHT = Gauge(
+    "bedrock_pdf_in_flight_requests",
+    "実行中のBedrock呼び出し数",
+    ["tab"],
+)
+
+USAGE_TOKEN_KINDS = {
+    "inputTokens": "input",
+    "outputTokens": "output",
+    "cacheReadInputTokens": "cache_read",
+    "cacheWriteInputTokens": "cache_write",
+}
+
+
+def error_code(error):
+    """例外からエラーコードを取得"""
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code", "Unknown")
+    return type(error).__name__
+
+
+class RequestTrace:
+    """1リクエストの計測（段階ごとの所要時間とトークン数）"""
+
+    def __init__(self, tab, model_id, operation="converse"):
+        self.tab = tab
+        self.model_id = model_id
+        self.operation = operation
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.ttft = None
+        self.usage = {}
+        self.status = None
+        self.error_code = None
+        self._in_flight = False
+        self._recorded_error = None
+
+    @contextmanager
+    def span(self, name):
+        """with trace.span("file_read"): のように段階の所要時間を計測"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, time.perf_counter() - started)
+
+    def add_span(self, name, seconds):
+        """段階の所要時間を加算（ストリーミングのように細切れの処理向け）"""
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def mark_first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.started
+
+    def begin_call(self, wait_started=None):
+        """Bedrock呼び出しの開始（実行中の数に加え、実行枠の待ち時間を記録）"""
+        if wait_started is not None:
+            self.add_span("scheduler_wait", time.perf_counter() - wait_started)
+        if METRICS_ENABLED and not self._in_flight:
+            IN_FLIGHT.labels(self.tab).inc()
+        self._in_flight = True
+
+    def _end_call(self):
+        if METRICS_ENABLED and self._in_flight:
+            IN_FLIGHT.labels(self.tab).dec()
+        self._in_flight = False
+
+    def finish(self, status="ok", usage=None):
+        """計測を完了してメトリクスに記録（2回目以降の呼び出しは無視）"""
+        if self.status is not None:
+            return
+        self._end_call()
+        self.status = status
+        self.usage = usage or {}
+        total = time.perf_counter() - self.started
+
+        if METRICS_ENABLED:
+            labels = (self.tab, self.model_id)
+            REQUESTS.labels(*labels, self.operation, status).inc()
+            REQUEST_SECONDS.labels(*labels, self.operation).observe(total)
+            for name, seconds in self.spans.items():
+                SPAN_SECONDS.labels(*labels, name).observe(seconds)
+            if self.ttft is not None:
+                TIME_TO_FIRST_TOKEN.labels(*labels).observe(self.ttft)
+            if status == "cache_hit":
+                CACHE_HITS.labels(*labels).inc()
+            else:
+                for key, kind in USAGE_TOKEN_KINDS.items():
+                    value = self.usage.get(key)
+                    if value:
+                        TOKENS.labels(*labels, kind).inc(value)
+
+        if TRACE_LOG_ENABLED:
+            logger.info(f"request_trace {json.dumps(self.as_dict(total), ensure_ascii=False)}")
+
+    def record_error(self, error):
+        """エラーを数え、スロットリングならTrueを返す（再試行した呼び出しの失敗にも使う）"""
+        self._recorded_error = error
+        self.error_code = error_code(error)
+        throttled = self.error_code in THROTTLING_CODES
+        if METRICS_ENABLED:
+            if throttled:
+                THROTTLES.labels(self.tab, self.model_id).inc()
+            ERRORS.labels(self.tab, self.model_id, self.error_code).inc()
+        return throttled
+
+    def fail(self, error):
+        """エラーで終了したリクエストを記録"""
+        if self.status is not None:
+            return
+        if error is not self._recorded_error:
+            self.record_error(error)
+        self.finish("throttled" if self.error_code in THROTTLING_CODES else "error")
+
+    def as_dict(self, total=None):
+        return {
+            "tab": self.tab,
+            "model_id": self.model_id,
+            "operation": self.operation,
+            "status": self.status,
+            "error_code": self.error_code,
+            "total_ms": round((total if total is not None else time.perf_counter() - self.started) * 1000, 1),
+            "ttft_ms": round(self.ttft * 1000, 1) if self.ttft is not None else None,
+            "spans_ms": {name: round(seconds * 1000, 1) for name, seconds in self.spans.items()},
+            "usage": {key: self.usage[key] for key in USAGE_TOKEN_KINDS if key in self.usage},
+        }
+
+
+def metrics_response_body():
+    """/metrics の (本文, Content-Type) を返す"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,339 @@
+"""
+Converse/ConverseStream APIのモックサーバー
+AWSに接続せずに負荷試験・ベンチマークを行うため、bedrock-runtimeと同じ
+エンドポイント・レスポンス形式（ConverseStreamはAWS event stream形式）を返す
+
+遅延・出力トークンの生成速度・スロットリング・エラー注入を設定できる。
+"""
+
+import binascii
+import json
+import logging
+import random
+import re
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+PATH_PATTERN = re.compile(r"^/model/(?P<model_id>[^/]+)/(?P<operation>converse|converse-stream)$")
+
+# event streamのヘッダー値の型（7 = 文字列）
+HEADER_TYPE_STRING = 7
+
+# 1トークンあたりの文字数の目安（入力トークン数の概算に使う）
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class MockConfig:
+    """モックサーバーの動作設定"""
+
+    latency: float = 0.5
+    tokens_per_second: float = 200.0
+    output_tokens: int = 300
+    tokens_per_chunk: int = 10
+    throttle_rate: float = 0.0
+    error_rate: float = 0.0
+    stream_error_rate: float = 0.0
+    max_concurrency: int = 0
+    seed: int = None
+    # モデルIDにこの文字列を含む軽量モデルは、遅延・生成時間を speedup 分の1にする
+    fast_model_pattern: str = "haiku"
+    fast_model_speedup: float = 3.0
+
+
+def encode_event_message(headers, payload):
+    """AWS event stream形式の1メッセージをエンコード
+
+    構成: 全体長(4) ヘッダー長(4) プレリュードCRC(4) ヘッダー ペイロード メッセージCRC(4)
+    """
+    encoded_headers = b""
+    for name, value in headers.items():
+        name_bytes = name.encode("utf-8")
+        value_bytes = value.encode("utf-8")
+        encoded_headers += struct.pack("!B", len(name_bytes)) + name_bytes
+        encoded_headers += struct.pack("!BH", HEADER_TYPE_STRING, len(value_bytes)) + value_bytes
+
+    total_length = 12 + len(encoded_headers) + len(payload) + 4
+    prelude = struct.pack("!II", total_length, len(encoded_headers))
+    prelude += struct.pack("!I", binascii.crc32(prelude) & 0xFFFFFFFF)
+    message = prelude + encoded_headers + payload
+    return message + struct.pack("!I", binascii.crc32(message) & 0xFFFFFFFF)
+
+
+def encode_event(event_type, payload):
+    """ConverseStreamのイベントをエンコード"""
+    return encode_event_message(
+        {
+            ":event-type": event_type,
+            ":content-type": "application/json",
+            ":message-type": "event",
+        },
+        json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+    )
+
+
+def encode_exception(exception_type, message):
+    """ConverseStreamの例外イベントをエンコード"""
+    return encode_event_message(
+        {
+            ":exception-type": exception_type,
+            ":content-type": "application/json",
+            ":message-type": "exception",
+        },
+        json.dumps({"message": message}, ensure_ascii=False).encode("utf-8"),
+    )
+
+
+def _request_text(body):
+    """リクエストのシステムプロンプトとテキストブロックを連結（出力形式の判定用）"""
+    texts = [block.get("text", "") for block in body.get("system", [])]
+    for message in body.get("messages", []):
+        texts.extend(block.get("text", "") for block in message.get("content", []))
+    return "\n".join(texts)
+
+
+def generate_output_words(body, output_tokens):
+    """リクエストに応じたダミー出力を単語（≒トークン）のリストで返す
+
+    YAML変換のプロンプトならYAML、それ以外はマークダウン風のテキストを生成する。
+    """
+    as_yaml = "yaml" in _request_text(body).lower()
+    words = ["```yaml\n", "document:\n"] if as_yaml else ["# ", "Mock ", "response\n\n"]
+
+    section = 0
+    while len(words) < output_tokens:
+        section += 1
+        if as_yaml:
+            words.append(f"  section_{section}: ")
+            words.extend(f"value{i} " for i in range(8))
+            words.append("\n")
+        else:
+            words.append(f"\n## Section {section}\n\n")
+            words.extend(f"lorem{i} " for i in range(12))
+            words.append("\n")
+
+    words = words[:output_tokens]
+    if as_yaml:
+        words.append("\n```")
+    return words
+
+
+class MockBedrockServer(ThreadingHTTPServer):
+    """bedrock-runtimeのConverse/ConverseStreamを模倣するHTTPサーバー"""
+
+    daemon_threads = True
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, config=None):
+        super().__init__((host, port), MockBedrockHandler)
+        self.config = config or MockConfig()
+        self.random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0, "stream_errors": 0}
+
+    @property
+    def endpoint_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def chance(self, rate):
+        with self._lock:
+            return rate > 0 and self.random.random() < rate
+
+    def speedup(self, model_id):
+        """モデルIDに応じた速度の倍率"""
+        pattern = self.config.fast_model_pattern
+        if pattern and pattern in model_id and self.config.fast_model_speedup > 0:
+            return self.config.fast_model_speedup
+        return 1.0
+
+    def first_token_delay(self, model_id):
+        """最初のトークンまでの遅延（秒）"""
+        return self.config.latency / self.speedup(model_id)
+
+    def token_delay(self, token_count, model_id=""):
+        """token_count トークンの生成にかかる時間（秒）"""
+        if self.config.tokens_per_second <= 0:
+            return 0.0
+        return token_count / (self.config.tokens_per_second * self.speedup(model_id))
+
+    def enter(self):
+        """同時実行数を数え、上限を超えていればFalseを返す"""
+        with self._lock:
+            self.stats["requests"] += 1
+            if self.config.max_concurrency and self.in_flight >= self.config.max_concurrency:
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def start_background(self):
+        """バックグラウンドスレッドでサーバーを起動"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class MockBedrockHandler(BaseHTTPRequestHandler):
+    """モックサーバーのリクエストハンドラ"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "MockBedrock/1.0"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("x-amzn-RequestId", f"mock-{time.time_ns()}")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, error_type, message):
+        self._send_json(status, {"message": message}, {"x-amzn-ErrorType": f"{error_type}:"})
+
+    def _write_chunk(self, data):
+        """chunked転送エンコーディングで1チャンク書き出す"""
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/ping":
+            self._send_json(200, {"status": "ok", **self.server.stats})
+        else:
+            self._send_error(404, "UnknownOperationException", f"Unknown path: {self.path}")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", "0"))
+        raw_body = self.rfile.read(length)
+
+        match = PATH_PATTERN.match(self.path)
+        if match is None:
+            self._send_error(404, "UnknownOperationException", f"Unknown path: {self.path}")
+            return
+
+        try:
+            body = json.loads(raw_body or b"{}")
+        except ValueError:
+            self._send_error(400, "ValidationException", "Request body is not valid JSON")
+            return
+
+        server = self.server
+        config = server.config
+        if not server.enter():
+            server.count("throttled")
+            self._send_error(429, "ThrottlingException", "Too many concurrent requests (mock)")
+            return
+
+        try:
+            if server.chance(config.throttle_rate):
+                server.count("throttled")
+                self._send_error(429, "ThrottlingException", "Too many requests, please wait before trying again. (mock)")
+                return
+            if server.chance(config.error_rate):
+                server.count("errors")
+                self._send_error(500, "InternalServerException", "Injected internal error (mock)")
+                return
+
+            model_id = unquote(match.group("model_id"))
+            input_tokens = max(1, len(raw_body) // CHARS_PER_TOKEN)
+            words = generate_output_words(body, config.output_tokens)
+
+            if match.group("operation") == "converse":
+                self._converse(model_id, input_tokens, words)
+            else:
+                self._converse_stream(model_id, input_tokens, words)
+        finally:
+            server.leave()
+
+    def _usage(self, input_tokens, output_tokens):
+        return {
+            "inputTokens": input_tokens,
+            "outputTokens": output_tokens,
+            "totalTokens": input_tokens + output_tokens,
+        }
+
+    def _converse(self, model_id, input_tokens, words):
+        started = time.monotonic()
+        time.sleep(self.server.first_token_delay(model_id) + self.server.token_delay(len(words), model_id))
+        self._send_json(
+            200,
+            {
+                "output": {"message": {"role": "assistant", "content": [{"text": "".join(words)}]}},
+                "stopReason": "end_turn",
+                "usage": self._usage(input_tokens, len(words)),
+                "metrics": {"latencyMs": int((time.monotonic() - started) * 1000)},
+            },
+        )
+
+    def _converse_stream(self, model_id, input_tokens, words):
+        config = self.server.config
+        started = time.monotonic()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.amazon.eventstream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("x-amzn-RequestId", f"mock-{time.time_ns()}")
+        self.end_headers()
+
+        time.sleep(self.server.first_token_delay(model_id))
+        self._write_chunk(encode_event("messageStart", {"role": "assistant"}))
+
+        # 途中でエラーを注入する場合は出力の途中で例外イベントを送る
+        fail_at = None
+        if self.server.chance(config.stream_error_rate):
+            fail_at = self.server.random.randint(0, max(0, len(words) - 1))
+
+        step = max(1, config.tokens_per_chunk)
+        for index in range(0, len(words), step):
+            if fail_at is not None and index + step > fail_at:
+                self.server.count("stream_errors")
+                self._write_chunk(
+                    encode_exception("modelStreamErrorException", "Injected stream error (mock)")
+                )
+                self.wfile.write(b"0\r\n\r\n")
+                return
+
+            chunk_words = words[index:index + step]
+            self._write_chunk(
+                encode_event(
+                    "contentBlockDelta",
+                    {"contentBlockIndex": 0, "delta": {"text": "".join(chunk_words)}},
+                )
+            )
+            time.sleep(self.server.token_delay(len(chunk_words), model_id))
+
+        self._write_chunk(encode_event("contentBlockStop", {"contentBlockIndex": 0}))
+        self._write_chunk(encode_event("messageStop", {"stopReason": "end_turn"}))
+        self._write_chunk(
+            encode_event(
+                "metadata",
+                {
+                    "usage": self._usage(input_tokens, len(words)),
+                    "metrics": {"latencyMs": int((time.monotonic() - started) * 1000)},
+                },
+            )
+        )
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
@@ -0,0 +1,158 @@
+"""
+リクエストごとのモデル選択
+ページ数・ファイルサイズ・処理の種類（Q&A / YAML / マークダウン）と利用者の指定から、
+設定されたルールに従って呼び出すモデルを選ぶ。小さなPDFや単純な処理は軽量なモデルに振り分けて待ち時間を短くする
+"""
+
+import logging
+import os
+import threading
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_ID = "apac.anthropic.claude-sonnet-4-20250514-v1:0"
+
+# 利用者・ルールが名前で指定できるモデル（名前=モデルID、カンマ区切り）。sonnet は既定モデル
+MODEL_ALIASES = os.environ.get(
+    "BEDROCK_MODEL_ALIASES", "haiku=global.anthropic.claude-haiku-4-5-20251001-v1:0"
+)
+
+# 上から順に評価し、最初に一致したルールのモデルを使う（ルールはセミコロン区切り）
+# 条件: task=qa|yaml|markdown, min_pages / max_pages, max_bytes。どれにも一致しなければ既定モデル
+MODEL_ROUTES = os.environ.get(
+    "BEDROCK_MODEL_ROUTES",
+    "task=qa,max_pages=10,max_bytes=2097152,model=haiku;"
+    "task=yaml|markdown,max_pages=3,max_bytes=1048576,model=haiku",
+)
+
+ROUTING_ENABLED = os.environ.get("BEDROCK_MODEL_ROUTING", "1") == "1"
+
+# 利用者がルールに任せる場合の指定
+AUTO_HINT = "auto"
+
+
+@dataclass(frozen=True)
+class RouteRule:
+    """モデル選択のルール（None の条件は常に一致）"""
+
+    model: str
+    tasks: tuple = None
+    min_pages: int = None
+    max_pages: int = None
+    max_bytes: int = None
+
+    def matches(self, task, page_count, document_size):
+        if self.tasks is not None and task not in self.tasks:
+            return False
+        if self.min_pages is not None and page_count < self.min_pages:
+            return False
+        if self.max_pages is not None and page_count > self.max_pages:
+            return False
+        if self.max_bytes is not None and document_size > self.max_bytes:
+            return False
+        return True
+
+    def __str__(self):
+        conditions = []
+        if self.tasks is not None:
+            conditions.append(f"task={'|'.join(self.tasks)}")
+        for name in ("min_pages", "max_pages", "max_bytes"):
+            value = getattr(self, name)
+            if value is not None:
+                conditions.append(f"{name}={value}")
+        return ",".join(conditions + [f"model={self.model}"])
+
+
+@dataclass(frozen=True)
+class RouteDecision:
+    """モデル選択の結果と理由"""
+
+    model_id: str
+    reason: str
+
+
+def parse_aliases(spec):
+    """"名前=モデルID,..." 形式の設定を辞書に変換"""
+    aliases = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, model_id = item.split("=", 1)
+            aliases[name.strip()] = model_id.strip()
+    return aliases
+
+
+def parse_routes(spec):
+    """"task=qa,max_pages=10,model=haiku;..." 形式の設定を RouteRule のリストに変換"""
+    rules = []
+    for rule_spec in spec.split(";"):
+        values = parse_aliases(rule_spec)
+        if not values:
+            continue
+        if "model" not in values:
+            raise ValueError(f"モデル選択ルールに model がありません: {rule_spec.strip()}")
+        unknown = set(values) - {"model", "task", "min_pages", "max_pages", "max_bytes"}
+        if unknown:
+            raise ValueError(f"モデル選択ルールの条件が不正です: {', '.join(sorted(unknown))}")
+        rules.append(
+            RouteRule(
+                model=values["model"],
+                tasks=tuple(values["task"].split("|")) if "task" in values else None,
+                min_pages=int(values["min_pages"]) if "min_pages" in values else None,
+                max_pages=int(values["max_pages"]) if "max_pages" in values else None,
+                max_bytes=int(values["max_bytes"]) if "max_bytes" in values else None,
+            )
+        )
+    return rules
+
+
+class ModelRouter:
+    """ルールと利用者の指定からリクエストごとのモデルを選ぶ"""
+
+    def __init__(self, default_model_id=DEFAULT_MODEL_ID, aliases=None, rules=None, enabled=ROUTING_ENABLED):
+        self.default_model_id = default_model_id
+        self.aliases = {"sonnet": default_model_id}
+        self.aliases.update(aliases if aliases is not None else parse_aliases(MODEL_ALIASES))
+        self.rules = rules if rules is not None else parse_routes(MODEL_ROUTES)
+        self.enabled = enabled
+
+        for rule in self.rules:
+            self.resolve(rule.model)
+
+    def resolve(self, name):
+        """モデル名（エイリアス）またはモデルIDをモデルIDに変換"""
+        if name in self.aliases:
+            return self.aliases[name]
+        # エイリアスでなければ "anthropic.claude-..." のようなモデルIDとして扱う
+        if "." in name:
+            return name
+        raise ValueError(f"不明なモデル指定です: {name}（{', '.join(self.hint_choices())} またはモデルID）")
+
+    def hint_choices(self):
+        """UIで選べるモデル指定の一覧"""
+        return [AUTO_HINT] + list(self.aliases)
+
+    def route(self, task, page_count, document_size, hint=None):
+        """処理の種類・ページ数・サイズ・利用者の指定からモデルを選ぶ"""
+        if hint and hint != AUTO_HINT:
+            return RouteDecision(self.resolve(hint), f"指定: {hint}")
+        if not self.enabled:
+            return RouteDecision(self.default_model_id, "既定")
+
+        for rule in self.rules:
+            if rule.matches(task, page_count, document_size):
+                return RouteDecision(self.resolve(rule.model), f"ルール: {rule}")
+        return RouteDecision(self.default_model_id, "既定")
+
+
+_default_router = None
+_default_router_lock = threading.Lock()
+
+
+def get_model_router():
+    """プロセス共有のモデルルーターを取得"""
+    global _default_router
+    with _default_router_lock:
+        if _default_router is None:
+            _default_router = ModelRouter()
+        return _default_router
@@ -0,0 +1,208 @@
+"""
+複数形式の一括出力
+PDFを1回だけ変換して構造化データ（YAML変換と同じ document / metadata / summary / sections ...）を取り出し、
+マークダウン・YAML・JSON・CSVはその構造からローカルで書き出す
+形式ごとにBedrockを呼ばないため、N形式でも呼び出しは1回分で済む
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+from dataclasses import dataclass
+
+from utils.file_loader import load_prompt
+from utils.pdf_chunker import DEFAULT_PAGES_PER_CHUNK, merge_yaml_chunks
+from utils.yaml_output import YAMLOutput, derive_schema, extract_yaml_block, parse_yaml_output
+
+logger = logging.getLogger(__name__)
+
+# 中間構造を取り出すプロンプト（YAML変換と同じなので、YAML変換の結果キャッシュも使える）
+CANONICAL_PROMPT_NAME = "pdf_to_yaml_prompt"
+
+
+def _text(value):
+    """値を表示用の文字列にする（Noneは空文字）"""
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return ", ".join(_text(item) for item in value)
+    return str(value).strip()
+
+
+def _mapping(data, key):
+    value = data.get(key)
+    return value if isinstance(value, dict) else {}
+
+
+def _items(data, key):
+    value = data.get(key)
+    return value if isinstance(value, list) else []
+
+
+def _table_cell(value):
+    return _text(value).replace("|", "\\|").replace("\n", "<br>")
+
+
+def _table_rows(table):
+    """表の data を行（セルのリスト）のリストとして返す"""
+    return [row if isinstance(row, list) else [row] for row in _items(table, "data")]
+
+
+def render_markdown(data):
+    """構造化データをマークダウンに書き出す"""
+    document = _mapping(data, "document")
+    metadata = _mapping(data, "metadata")
+    summary = _mapping(data, "summary")
+    lines = [f"# {_text(document.get('title')) or 'ドキュメント'}", ""]
+
+    properties = [
+        ("種類", document.get("type")),
+        ("著者", metadata.get("author")),
+        ("作成日", metadata.get("date")),
+        ("ページ数", document.get("pages")),
+        ("キーワード", metadata.get("keywords")),
+    ]
+    lines += [f"- **{label}**: {_text(value)}" for label, value in properties if _text(value)]
+
+    if _text(summary.get("overview")) or _items(summary, "key_points"):
+        lines += ["", "## 概要", ""]
+        if _text(summary.get("overview")):
+            lines += [_text(summary.get("overview")), ""]
+        lines += [f"- {_text(point)}" for point in _items(summary, "key_points")]
+
+    for section in _items(data, "sections"):
+        section = section if isinstance(section, dict) else {"content": section}
+        lines += ["", f"## {_text(section.get('title')) or 'セクション'}", ""]
+        if _text(section.get("content")):
+            lines.append(_text(section.get("content")))
+
+    tables = [table for table in _items(data, "tables") if isinstance(table, dict)]
+    if tables:
+        lines += ["", "## 表"]
+        for table in tables:
+            rows = _table_rows(table)
+            lines += ["", f"### {_text(table.get('title')) or '表'}", ""]
+            if rows:
+                width = max(len(row) for row in rows)
+                cells = [[_table_cell(cell) for cell in row] + [""] * (width - len(row)) for row in rows]
+                lines.append("| " + " | ".join(cells[0]) + " |")
+                lines.append("|" + "---|" * width)
+                lines += ["| " + " | ".join(row) + " |" for row in cells[1:]]
+
+    figures = _items(data, "figures")
+    if figures:
+        lines += ["", "## 図", ""]
+        for figure in figures:
+            figure = figure if isinstance(figure, dict) else {"description": figure}
+            title = _text(figure.get("title"))
+            description = _text(figure.get("description"))
+            lines.append(f"- **{title}**: {description}" if title else f"- {description}")
+
+    references = _items(data, "references")
+    if references:
+        lines += ["", "## 参考文献", ""]
+        lines += [f"- {_text(reference)}" for reference in references]
+
+    return "\n".join(lines).strip() + "\n"
+
+
+def render_yaml(data):
+    """構造化データをYAMLに書き出す"""
+    return extract_yaml_block(YAMLOutput(data=data).to_text())
+
+
+def render_json(data):
+    """構造化データをJSONに書き出す"""
+    return json.dumps(data, ensure_ascii=False, indent=2, default=str) + "\n"
+
+
+def render_csv(data):
+    """表（tables）を1行1レコードのCSVに書き出す（列: 表, 行, 列1, 列2, ...）"""
+    records = []
+    for table in _items(data, "tables"):
+        if not isinstance(table, dict):
+            continue
+        title = _text(table.get("title"))
+        for index, row in enumerate(_table_rows(table)):
+            records.append([title, index] + [_text(cell) for cell in row])
+
+    width = max((len(record) - 2 for record in records), default=0)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(["表", "行"] + [f"列{i}" for i in range(1, width + 1)])
+    writer.writerows(records)
+    return buffer.getvalue()
+
+
+@dataclass
+class RenderedFormat:
+    """ローカルで書き出す出力形式"""
+
+    label: str
+    extension: str
+    render: object
+
+
+RENDERED_FORMATS = {
+    "markdown": RenderedFormat("📝 Markdown", ".md", render_markdown),
+    "yaml": RenderedFormat("📋 YAML", ".yaml", render_yaml),
+    "json": RenderedFormat("📄 JSON", ".json", render_json),
+    "csv": RenderedFormat("📊 CSV", ".csv", render_csv),
+}
+
+
+def render_outputs(data, formats):
+    """選んだ形式ごとに {形式名: テキスト} を返す"""
+    return {name: RENDERED_FORMATS[name].render(data) for name in formats}
+
+
+def write_outputs(data, formats, base_path):
+    """選んだ形式で base_path + 拡張子 のファイルに書き出し、{形式名: パス} を返す"""
+    paths = {}
+    for name, text in render_outputs(data, formats).items():
+        path = base_path + RENDERED_FORMATS[name].extension
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        paths[name] = path
+    return paths
+
+
+def extract_structure(
+    processor,
+    pdf_file,
+    chunked=False,
+    pages_per_chunk=DEFAULT_PAGES_PER_CHUNK,
+    progress_callback=None,
+    user=None,
+    model_hint=None,
+):
+    """PDFを1回だけ変換して構造化データを取り出し、(ConversionResult, データ) を返す
+
+    processor はYAML変換のプロセッサ（finalize_result で検証・再生成・保存が行われる）。
+    """
+    prompt_text = load_prompt(CANONICAL_PROMPT_NAME, user)
+    if chunked:
+        result = processor.run_chunked_document_request(
+            pdf_file,
+            prompt_text,
+            merge_yaml_chunks,
+            pages_per_chunk=pages_per_chunk,
+            progress_callback=progress_callback,
+            user=user,
+            model_hint=model_hint,
+        )
+    else:
+        result = processor.run_document_request(pdf_file, prompt_text, user=user, model_hint=model_hint)
+    result = processor.finalize_result(pdf_file, result, user=user, model_hint=model_hint)
+
+    output = parse_yaml_output(result.text, derive_schema(prompt_text))
+    if output.raw_blocks:
+        # YAML変換の結果には元のテキストのまま残るが、構造から書き出す形式には含められない
+        logger.warning(f"解析できなかったキーは出力に含まれません: {', '.join(output.raw_blocks)}")
+    data = output.data
+    if not data:
+        raise ValueError("変換結果から構造化データを取り出せませんでした")
+    logger.info(f"構造化データを取り出しました: {os.path.basename(pdf_file)}")
+    return result, data
@@ -0,0 +1,184 @@
+"""
+PDFのページ範囲分割と変換結果のマージ
+大きなPDFをページ範囲ごとに分割し、各範囲の変換結果を元の順序で1つにまとめる
+"""
+
+import io
+import logging
+import mmap
+import re
+
+import yaml
+from pypdf import PdfReader, PdfWriter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGES_PER_CHUNK = 20
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})(\s+.*)$")
+FENCE_PATTERN = re.compile(r"^\s*```")
+
+
+def open_pdf_reader(document_bytes):
+    """PdfReaderを作成（メモリマップはコピーせずそのままストリームとして読む）"""
+    if isinstance(document_bytes, mmap.mmap):
+        document_bytes.seek(0)
+        return PdfReader(document_bytes)
+    return PdfReader(io.BytesIO(document_bytes))
+
+
+def count_pages(document_bytes):
+    """PDFのページ数を取得"""
+    return len(open_pdf_reader(document_bytes).pages)
+
+
+def split_pdf(document_bytes, pages_per_chunk=DEFAULT_PAGES_PER_CHUNK):
+    """PDFをページ範囲ごとに分割し、(開始ページ, 終了ページ, PDFバイト列) のリストを返す
+
+    ページ番号は1始まり。ページ数が pages_per_chunk 以下なら元のバイト列をそのまま返す。
+    """
+    reader = open_pdf_reader(document_bytes)
+    total_pages = len(reader.pages)
+
+    if total_pages <= pages_per_chunk:
+        return [(1, total_pages, document_bytes)]
+
+    chunks = []
+    for start in range(0, total_pages, pages_per_chunk):
+        end = min(start + pages_per_chunk, total_pages)
+        writer = PdfWriter()
+        for page_index in range(start, end):
+            writer.add_page(reader.pages[page_index])
+
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        chunks.append((start + 1, end, buffer.getvalue()))
+
+    logger.info(f"PDFを {len(chunks)} チャンクに分割しました（全 {total_pages} ページ）")
+    return chunks
+
+
+def build_chunk_note(start_page, end_page, total_pages):
+    """チャンクのページ範囲を説明する注記を作成（PDF全体ならば空文字）"""
+    if start_page == 1 and end_page == total_pages:
+        return ""
+    return (
+        f"※ このドキュメントは全 {total_pages} ページのうち p.{start_page}-{end_page} の部分です。"
+        "この範囲の内容のみを出力してください。"
+    )
+
+
+def strip_code_fence(text, language):
+    """```language で囲まれたブロックがあれば中身を取り出す"""
+    match = re.search(rf"```{language}\s*\n(.*?)```", text, re.DOTALL)
+    if match:
+        return match.group(1)
+    return text
+
+
+def _heading_levels(lines):
+    """コードブロック外の見出しレベルを列挙"""
+    in_fence = False
+    for line in lines:
+        if FENCE_PATTERN.match(line):
+            in_fence = not in_fence
+            continue
+        if in_fence:
+            continue
+        match = HEADING_PATTERN.match(line)
+        if match:
+            yield len(match.group(1))
+
+
+def _shift_headings(text, shift):
+    """コードブロック外の見出しレベルをshift分ずらす（1〜6に収める）"""
+    if shift == 0:
+        return text
+
+    lines = text.splitlines()
+    in_fence = False
+    for i, line in enumerate(lines):
+        if FENCE_PATTERN.match(line):
+            in_fence = not in_fence
+            continue
+        if in_fence:
+            continue
+        match = HEADING_PATTERN.match(line)
+        if match:
+            level = max(1, min(6, len(match.group(1)) + shift))
+            lines[i] = "#" * level + match.group(2)
+    return "\n".join(lines)
+
+
+def merge_markdown_chunks(chunk_texts, chunk_ranges=None, total_pages=None):
+    """チャンクごとのマークダウンを順番に結合し、見出しレベルを揃える
+
+    先頭チャンクにH1が1つだけある場合はそれを文書タイトルとみなし、
+    後続チャンクの最上位見出しがH2になるように調整する。
+    chunk_ranges と total_pages は merge_yaml_chunks と引数を揃えるためのもの。
+    """
+    bodies = [strip_code_fence(text, "markdown").strip() for text in chunk_texts]
+    if not bodies:
+        return ""
+
+    first_levels = list(_heading_levels(bodies[0].splitlines()))
+    base_level = min(first_levels) if first_levels else 1
+    if first_levels.count(base_level) == 1 and len(bodies) > 1:
+        base_level += 1
+
+    merged = [bodies[0]]
+    for body in bodies[1:]:
+        levels = list(_heading_levels(body.splitlines()))
+        shift = base_level - min(levels) if levels else 0
+        merged.append(_shift_headings(body, shift))
+
+    return "\n\n".join(merged)
+
+
+def _merge_values(base, addition):
+    """YAMLの値を再帰的にマージ（リストは連結、辞書は再帰、スカラーは先勝ち）"""
+    if isinstance(base, dict) and isinstance(addition, dict):
+        for key, value in addition.items():
+            base[key] = _merge_values(base[key], value) if key in base else value
+        return base
+    if isinstance(base, list) and isinstance(addition, list):
+        for item in addition:
+            if isinstance(item, (dict, list)) or item not in base:
+                base.append(item)
+        return base
+    if base in (None, "", [], {}):
+        return addition
+    return base
+
+
+def merge_yaml_chunks(chunk_texts, chunk_ranges, total_pages):
+    """チャンクごとのYAMLをトップレベルキー単位でマージ"""
+    merged = {}
+    overviews = []
+
+    for text, (start_page, end_page) in zip(chunk_texts, chunk_ranges):
+        try:
+            data = yaml.safe_load(strip_code_fence(text, "yaml"))
+        except yaml.YAMLError as e:
+            logger.warning(f"YAMLの解析に失敗しました（p.{start_page}-{end_page}）: {str(e)}")
+            data = None
+
+        if not isinstance(data, dict):
+            merged.setdefault("sections", []).append(
+                {"title": f"p.{start_page}-{end_page}（YAML解析失敗）", "content": text}
+            )
+            continue
+
+        summary = data.get("summary")
+        overview = summary.get("overview") if isinstance(summary, dict) else None
+        if overview:
+            overviews.append(overview)
+        _merge_values(merged, data)
+
+    if len(overviews) > 1 and isinstance(merged.get("summary"), dict):
+        merged["summary"]["overview"] = "\n".join(overviews)
+    if isinstance(merged.get("document"), dict):
+        merged["document"]["pages"] = total_pages
+
+    dumped = yaml.safe_dump(merged, allow_unicode=True, sort_keys=False, width=1000)
+    return f"```yaml\n{dumped}```"
@@ -0,0 +1,219 @@
+"""
+Bedrockに送る前のPDFの事前チェックと最適化
+スキャンや画像の多いPDFをそのまま送ると送信サイズと入力トークンが大きくなるため、
+使われていないオブジェクトの削除・大きすぎる画像の縮小・空白ページの削除を行い、
+削減できたバイト数を報告する
+"""
+
+import io
+import logging
+import os
+import re
+from dataclasses import dataclass
+
+from pypdf import PdfWriter
+
+from utils.document_loader import format_bytes
+from utils.pdf_chunker import open_pdf_reader
+
+logger = logging.getLogger(__name__)
+
+PREFLIGHT_ENABLED = os.environ.get("BEDROCK_PREFLIGHT", "1") == "1"
+
+# これより小さいPDFは最適化しない（効果が小さく、処理時間の方が大きくなるため）
+PREFLIGHT_MIN_BYTES = int(os.environ.get("BEDROCK_PREFLIGHT_MIN_BYTES", str(512 * 1024)))
+
+# 最適化の対象にする最大サイズ（超えるものは最適化しても1回の呼び出しの上限に収まらない前提で拒否）
+PREFLIGHT_MAX_BYTES = int(os.environ.get("BEDROCK_PREFLIGHT_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# 画像の長辺の上限（ピクセル）とJPEGで再圧縮するときの品質
+MAX_IMAGE_DIMENSION = int(os.environ.get("BEDROCK_PREFLIGHT_MAX_IMAGE_DIMENSION", "1600"))
+IMAGE_QUALITY = int(os.environ.get("BEDROCK_PREFLIGHT_IMAGE_QUALITY", "80"))
+
+STRIP_BLANK_PAGES = os.environ.get("BEDROCK_PREFLIGHT_STRIP_BLANK_PAGES", "1") == "1"
+
+# 最適化後のサイズがこの割合より小さくならなければ元のPDFを送る（引用のページ位置などを保つため）
+MIN_SAVING_RATIO = 0.05
+
+# コンテンツストリーム中の描画オペレータ（これが無いページは何も描かれていない）
+PAINTING_OPERATORS = re.compile(rb"(?<![A-Za-z])(?:S|s|f\*?|F|B\*?|b\*?|sh|Do|Tj|TJ|'|\")(?![A-Za-z])")
+
+# 縮小時にそのまま扱える画像のモード（透過つきの画像はマスクが崩れるため縮小しない）
+RESAMPLABLE_MODES = {"L", "RGB", "CMYK"}
+
+
+class PreflightError(ValueError):
+    """PDFを処理できない（暗号化されている、壊れているなど）"""
+
+
+@dataclass
+class PreflightReport:
+    """事前チェック・最適化の結果"""
+
+    original_bytes: int
+    optimized_bytes: int
+    page_count: int = 0
+    removed_pages: int = 0
+    resized_images: int = 0
+    optimized: bool = False
+    # 空白ページを削除した場合、送信したPDFの各ページが元のPDFの何ページ目か（1始まり）
+    kept_pages: list = None
+
+    @property
+    def saved_bytes(self):
+        return max(0, self.original_bytes - self.optimized_bytes)
+
+    def original_page(self, page_number):
+        """送信したPDFのページ番号を元のPDFのページ番号に戻す"""
+        if self.kept_pages and isinstance(page_number, int) and 1 <= page_number <= len(self.kept_pages):
+            return self.kept_pages[page_number - 1]
+        return page_number
+
+    def map_citations(self, citations):
+        """空白ページの削除でずれた引用のページ位置を、元のPDFのページ番号に戻す"""
+        if not self.kept_pages:
+            return citations
+        mapped = []
+        for citation in citations:
+            location = citation.get("location", {})
+            page = location.get("documentPage")
+            if page is None:
+                mapped.append(citation)
+                continue
+            mapped.append(
+                {
+                    **citation,
+                    "location": {
+                        **location,
+                        "documentPage": {
+                            **page,
+                            "start": self.original_page(page.get("start")),
+                            "end": self.original_page(page.get("end")),
+                        },
+                    },
+                }
+            )
+        return mapped
+
+    def summary(self):
+        """表示用の1行の要約"""
+        details = []
+        if self.removed_pages:
+            details.append(f"空白ページ {self.removed_pages} 枚を削除")
+        if self.resized_images:
+            details.append(f"画像 {self.resized_images} 枚を縮小")
+        detail = f"（{'、'.join(details)}）" if details else ""
+        return (
+            f"{format_bytes(self.original_bytes)} → {format_bytes(self.optimized_bytes)}"
+            f"、{format_bytes(self.saved_bytes)} 削減{detail}"
+        )
+
+    @classmethod
+    def combine(cls, reports):
+        """分割変換などで複数の結果を合算（最適化したものが無ければNone）"""
+        reports = [report for report in reports if report is not None and report.optimized]
+        if not reports:
+            return None
+        return cls(
+            original_bytes=sum(r.original_bytes for r in reports),
+            optimized_bytes=sum(r.optimized_bytes for r in reports),
+            page_count=sum(r.page_count for r in reports),
+            removed_pages=sum(r.removed_pages for r in reports),
+            resized_images=sum(r.resized_images for r in reports),
+            optimized=True,
+        )
+
+
+def is_blank_page(page):
+    """テキスト・画像・描画のいずれも無いページか"""
+    contents = page.get_contents()
+    if contents is None:
+        return True
+    if PAINTING_OPERATORS.search(contents.get_data()):
+        return False
+    return not page.get("/Annots")
+
+
+def resize_images(page, max_dimension=MAX_IMAGE_DIMENSION, quality=IMAGE_QUALITY):
+    """ページ内の長辺が max_dimension を超える画像を縮小し、縮小した枚数を返す"""
+    resized = 0
+    for image_file in page.images:
+        # インライン画像は置き換えられないため対象外
+        if image_file.indirect_reference is None:
+            continue
+        try:
+            image = image_file.image
+            if max(image.size) <= max_dimension or image.mode not in RESAMPLABLE_MODES:
+                continue
+            if "/SMask" in image_file.indirect_reference.get_object():
+                continue
+            image.thumbnail((max_dimension, max_dimension))
+            image_file.replace(image, quality=quality)
+            resized += 1
+        except Exception as e:
+            logger.warning(f"画像の縮小をスキップしました（{image_file.name}）: {str(e)}")
+    return resized
+
+
+def preflight_pdf(
+    document_bytes,
+    min_bytes=PREFLIGHT_MIN_BYTES,
+    max_dimension=MAX_IMAGE_DIMENSION,
+    strip_blank_pages=STRIP_BLANK_PAGES,
+):
+    """PDFを確認・最適化し、(送信するPDFのバイト列, PreflightReport) を返す
+
+    最適化で十分に小さくならない場合は元のバッファをそのまま返す。
+    暗号化されたPDFはPreflightErrorを送出する。
+    """
+    original_bytes = len(document_bytes)
+    try:
+        reader = open_pdf_reader(document_bytes)
+        encrypted = reader.is_encrypted and not reader.decrypt("")
+    except Exception as e:
+        logger.warning(f"PDFの事前チェックをスキップしました: {str(e)}")
+        return document_bytes, PreflightReport(original_bytes, original_bytes)
+    if encrypted:
+        raise PreflightError("パスワードで保護されたPDFは処理できません。保護を解除してからお試しください")
+
+    page_count = len(reader.pages)
+    report = PreflightReport(original_bytes, original_bytes, page_count=page_count)
+    if original_bytes < min_bytes:
+        return document_bytes, report
+
+    try:
+        writer = PdfWriter()
+        kept_pages = []
+        for page_number, page in enumerate(reader.pages, start=1):
+            # 全ページが空白でも1ページは残す
+            if strip_blank_pages and is_blank_page(page) and report.removed_pages < page_count - 1:
+                report.removed_pages += 1
+                continue
+            writer.add_page(page)
+            kept_pages.append(page_number)
+
+        for page in writer.pages:
+            report.resized_images += resize_images(page, max_dimension)
+            page.compress_content_streams()
+
+        # 重複したオブジェクトと、どこからも参照されないオブジェクトを削除
+        writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        optimized = buffer.getvalue()
+    except Exception as e:
+        logger.warning(f"PDFの最適化に失敗したため元のPDFを送ります: {str(e)}")
+        return document_bytes, report
+
+    if len(optimized) > original_bytes * (1 - MIN_SAVING_RATIO):
+        return document_bytes, report
+
+    report.optimized_bytes = len(optimized)
+    report.page_count = page_count - report.removed_pages
+    if report.removed_pages:
+        # 引用のページ番号を元のPDFに戻せるよう、残したページを記録する
+        report.kept_pages = kept_pages
+    report.optimized = True
+    logger.info(f"PDFを最適化しました: {report.summary()}")
+    return optimized, report
@@ -0,0 +1,304 @@
+"""
+PDF Q&Aの会話セッション
+アップロードされたドキュメントをメモリに1回だけ読み込み、
+直近の会話履歴（古いやり取りは要約）と合わせて追加の質問を送る
+セッションはセッションIDでストアに保存し、BEDROCK_SHARED_BACKEND=redis ではどのレプリカからでも続きを話せる
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict
+
+from utils.bedrock_processor import CACHE_POINT, sanitize_document_name
+from utils.document_loader import MAX_DOCUMENT_BYTES, check_byte_count, check_page_count, open_document
+from utils.pdf_chunker import count_pages
+from utils.pdf_preflight import PREFLIGHT_ENABLED, PREFLIGHT_MAX_BYTES, PreflightReport, preflight_pdf
+from utils.redis_backend import get_redis, redis_key, use_redis
+from utils.result_cache import hash_document
+
+logger = logging.getLogger(__name__)
+
+QA_HISTORY_TURNS = int(os.environ.get("BEDROCK_QA_HISTORY_TURNS", "6"))
+QA_SESSION_TTL = int(os.environ.get("BEDROCK_QA_SESSION_TTL", str(60 * 60)))
+
+# プロセス内に保持するセッション数とドキュメントの合計バイト数の上限（超えたら最後に使ったのが古い順に破棄）
+QA_SESSION_MAX_ENTRIES = int(os.environ.get("BEDROCK_QA_SESSION_MAX_ENTRIES", "100"))
+QA_SESSION_MAX_BYTES = int(os.environ.get("BEDROCK_QA_SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+
+SUMMARY_PROMPT = (
+    "以下はPDFドキュメントについてのユーザーとアシスタントの会話です。"
+    "後続の質問に答えるために必要な事実・前提・結論を、箇条書きで簡潔に要約してください。"
+)
+
+
+class QASession:
+    """Gradioセッションごとのドキュメントと会話履歴"""
+
+    def __init__(self, max_turns=QA_HISTORY_TURNS, session_id=None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.max_turns = max_turns
+        self.document_bytes = None
+        self.document_name = None
+        self.document_format = None
+        self.document_hash = None
+        self.page_count = 1
+        self.preflight = None
+        self._source = None
+        self.turns = []
+        self.summary = ""
+
+    def load_document(self, pdf_file):
+        """ドキュメントを読み込む（同じファイルなら再読み込みせず、別のファイルなら会話をリセット）
+
+        ストアからドキュメントだけが追い出された場合は読み込み直し、内容が同じなら会話を続ける。
+        """
+        stat = os.stat(pdf_file)
+        source = (pdf_file, stat.st_size, stat.st_mtime)
+        if source == self._source and self.document_bytes is not None:
+            return False
+        previous_hash = self.document_hash
+
+        # 会話中は毎回送るため、1回の呼び出しの上限を確認し、最適化は読み込み時に1回だけ行う
+        # 読み込みと最適化の間は、処理中バイト数の枠を確保する
+        max_bytes = PREFLIGHT_MAX_BYTES if PREFLIGHT_ENABLED else MAX_DOCUMENT_BYTES
+        with open_document(pdf_file, max_bytes=max_bytes) as document:
+            document_bytes = document.data
+            preflight = None
+            if PREFLIGHT_ENABLED:
+                document_bytes, report = preflight_pdf(document.data)
+                preflight = report if report.optimized else None
+            check_byte_count(len(document_bytes))
+            # セッションに保持するため、メモリマップを閉じる前に複製する
+            document_bytes = bytes(document_bytes)
+        try:
+            page_count = count_pages(document_bytes)
+        except Exception:
+            page_count = 1
+        check_page_count(page_count)
+
+        self.document_bytes = document_bytes
+        self.preflight = preflight
+        self.page_count = page_count
+        self.document_name = sanitize_document_name(pdf_file)
+        self.document_format = pdf_file.split(".")[-1]
+        self.document_hash = hash_document(self.document_bytes)
+        self._source = source
+        if self.document_hash != previous_hash:
+            self.reset()
+        logger.info(f"Q&Aセッションにドキュメントを読み込みました: {self.document_name}")
+        return True
+
+    def reset(self):
+        """会話履歴をリセット"""
+        self.turns = []
+        self.summary = ""
+
+    @property
+    def has_history(self):
+        return bool(self.turns or self.summary)
+
+    def build_messages(self, question, citations=True, prompt_caching=True):
+        """ドキュメント・要約・直近の履歴・今回の質問からConverseのmessagesを作成
+
+        先頭のユーザーメッセージは常に「ドキュメント → キャッシュ区切り」で始まるため、
+        追加の質問でもドキュメント部分はプロンプトキャッシュから読み込まれる。
+        """
+        questions = [q for q, _ in self.turns] + [question]
+        answers = [a for _, a in self.turns]
+
+        first_text = questions[0]
+        if self.summary:
+            first_text = f"これまでの会話の要約:\n{self.summary}\n\n質問: {first_text}"
+
+        first_content = [
+            {
+                "document": {
+                    "name": self.document_name,
+                    "format": self.document_format,
+                    "source": {"bytes": self.document_bytes},
+                    "citations": {"enabled": citations},
+                }
+            },
+        ]
+        if prompt_caching:
+            first_content.append(CACHE_POINT)
+        first_content.append({"text": first_text})
+
+        messages = [{"role": "user", "content": first_content}]
+        for answer, next_question in zip(answers, questions[1:]):
+            messages.append({"role": "assistant", "content": [{"text": answer}]})
+            messages.append({"role": "user", "content": [{"text": next_question}]})
+        return messages
+
+    def add_turn(self, question, answer):
+        """やり取りを履歴に追加し、ウィンドウから溢れたやり取りを返す"""
+        self.turns.append((question, answer))
+        overflow = self.turns[: max(0, len(self.turns) - self.max_turns)]
+        self.turns = self.turns[len(overflow):]
+        return overflow
+
+    def build_summary_messages(self, overflow):
+        """溢れたやり取りを既存の要約に統合するための要約リクエストを作成"""
+        transcript = "\n\n".join(f"ユーザー: {q}\nアシスタント: {a}" for q, a in overflow)
+        if self.summary:
+            transcript = f"これまでの要約:\n{self.summary}\n\n{transcript}"
+        return [{"role": "user", "content": [{"text": f"{SUMMARY_PROMPT}\n\n{transcript}"}]}]
+
+    def chat_history(self):
+        """Gradio Chatbot（type="messages"）用の履歴"""
+        history = []
+        if self.summary:
+            history.append({"role": "assistant", "content": f"（これまでの会話の要約）\n{self.summary}"})
+        for question, answer in self.turns:
+            history.append({"role": "user", "content": question})
+            history.append({"role": "assistant", "content": answer})
+        return history
+
+    def to_state(self):
+        """ドキュメント以外の状態をJSONにできる辞書で返す（ドキュメントは document_hash で別に保存する）"""
+        return {
+            "session_id": self.session_id,
+            "max_turns": self.max_turns,
+            "document_name": self.document_name,
+            "document_format": self.document_format,
+            "document_hash": self.document_hash,
+            "page_count": self.page_count,
+            "preflight": asdict(self.preflight) if self.preflight is not None else None,
+            "source": list(self._source) if self._source is not None else None,
+            "turns": [list(turn) for turn in self.turns],
+            "summary": self.summary,
+        }
+
+    @classmethod
+    def from_state(cls, state, document_bytes):
+        """to_state の辞書とドキュメントからセッションを復元"""
+        session = cls(max_turns=state["max_turns"], session_id=state["session_id"])
+        session.document_bytes = document_bytes
+        session.document_name = state["document_name"]
+        session.document_format = state["document_format"]
+        session.document_hash = state["document_hash"]
+        session.page_count = state["page_count"]
+        session.preflight = PreflightReport(**state["preflight"]) if state["preflight"] else None
+        session._source = tuple(state["source"]) if state["source"] else None
+        session.turns = [tuple(turn) for turn in state["turns"]]
+        session.summary = state["summary"]
+        return session
+
+
+def _session_bytes(session):
+    return len(session.document_bytes) if session.document_bytes is not None else 0
+
+
+class LocalSessionStore:
+    """プロセス内に保持するセッションストア（1ノード用）
+
+    件数とドキュメントの合計バイト数に上限を設け、超えたら最後に使ったのが古いセッションから破棄する。
+    """
+
+    def __init__(self, ttl_seconds=QA_SESSION_TTL, max_entries=QA_SESSION_MAX_ENTRIES, max_bytes=QA_SESSION_MAX_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remove(self, session_id):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+    def load(self, session_id):
+        """セッションを取得（なければ・期限切れならNone）"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[1] < time.monotonic():
+                self._remove(session_id)
+                return None
+            self._sessions.move_to_end(session_id)
+            return entry[0]
+
+    def save(self, session):
+        """セッションを保存し、期限切れのセッションと上限を超えた分を破棄する"""
+        now = time.monotonic()
+        with self._lock:
+            for session_id in [key for key, entry in self._sessions.items() if entry[1] < now]:
+                self._remove(session_id)
+            self._remove(session.session_id)
+            size = _session_bytes(session)
+            self._sessions[session.session_id] = (session, now + self.ttl_seconds, size)
+            self.total_bytes += size
+
+            # 保存したばかりのセッションは残す
+            evicted = 0
+            while len(self._sessions) > 1 and (
+                (self.max_entries and len(self._sessions) > self.max_entries)
+                or (self.max_bytes and self.total_bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._sessions)))
+                evicted += 1
+        if evicted:
+            logger.info(f"上限を超えたためQ&Aセッションを {evicted} 件破棄しました")
+
+    def delete(self, session_id):
+        with self._lock:
+            self._remove(session_id)
+
+
+class RedisSessionStore:
+    """Redisに保存するセッションストア（複数のレプリカで共有）
+
+    ドキュメントは内容ハッシュをキーに1回だけ保存し、同じPDFを使うセッション同士で共有する。
+    """
+
+    def __init__(self, client=None, ttl_seconds=QA_SESSION_TTL):
+        self.client = client if client is not None else get_redis()
+        self.ttl_seconds = ttl_seconds
+
+    def load(self, session_id):
+        """セッションを取得（なければ・期限切れならNone）"""
+        value = self.client.get(redis_key("session", session_id))
+        if value is None:
+            return None
+        state = json.loads(value)
+        document_bytes = None
+        if state["document_hash"]:
+            # ドキュメントだけが追い出された場合はNoneのまま返し、次の質問で読み込み直す（会話は続ける）
+            document_bytes = self.client.get(redis_key("document", state["document_hash"]))
+        return QASession.from_state(state, document_bytes)
+
+    def save(self, session):
+        """セッションとドキュメントを保存（どちらも最後に使ってからTTLで期限切れ）"""
+        pipeline = self.client.pipeline()
+        pipeline.set(
+            redis_key("session", session.session_id),
+            json.dumps(session.to_state(), ensure_ascii=False),
+            ex=self.ttl_seconds,
+        )
+        if session.document_hash and session.document_bytes is not None:
+            # 同じドキュメントは書き直さず、期限だけ延ばす
+            document_key = redis_key("document", session.document_hash)
+            pipeline.set(document_key, session.document_bytes, ex=self.ttl_seconds, nx=True)
+            pipeline.expire(document_key, self.ttl_seconds)
+        pipeline.execute()
+
+    def delete(self, session_id):
+        self.client.delete(redis_key("session", session_id))
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """プロセス共有のセッションストアを取得"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = RedisSessionStore() if use_redis() else LocalSessionStore()
+        return _default_store
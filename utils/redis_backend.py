@@ -0,0 +1,54 @@
+"""
+共有バックエンドの設定
+結果キャッシュ・Q&Aセッション・変換ジョブの状態を、1ノードではローカル（SQLite・プロセス内）、
+複数のレプリカではRedis互換のストアに置いて共有する
+"""
+
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# local: SQLiteとプロセス内に保存（1ノード） / redis: Redis互換のストアで複数のレプリカと共有
+SHARED_BACKENDS = ("local", "redis")
+SHARED_BACKEND = os.environ.get("BEDROCK_SHARED_BACKEND", "local")
+
+REDIS_URL = os.environ.get("BEDROCK_REDIS_URL", "redis://localhost:6379/0")
+
+# 同じRedisを他の用途と共有できるよう、キーに付ける接頭辞
+REDIS_KEY_PREFIX = os.environ.get("BEDROCK_REDIS_KEY_PREFIX", "bedrock-pdf:")
+
+_lock = threading.Lock()
+_client = None
+
+
+def use_redis():
+    """共有バックエンドにRedisを使うか"""
+    if SHARED_BACKEND not in SHARED_BACKENDS:
+        raise ValueError(
+            f"BEDROCK_SHARED_BACKEND が不正です: {SHARED_BACKEND}（{', '.join(SHARED_BACKENDS)} のいずれか）"
+        )
+    return SHARED_BACKEND == "redis"
+
+
+def redis_key(*parts):
+    """接頭辞付きのキーを作成"""
+    return REDIS_KEY_PREFIX + ":".join(str(part) for part in parts)
+
+
+def get_redis():
+    """プロセス共有のRedisクライアントを取得（redis パッケージは redis 追加依存でインストール）"""
+    global _client
+    with _lock:
+        if _client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise ImportError(
+                    "BEDROCK_SHARED_BACKEND=redis には redis パッケージが必要です（uv sync --extra redis）"
+                ) from e
+            _client = redis.Redis.from_url(REDIS_URL)
+            # URLには認証情報が含まれることがあるため、ログには出さない
+            logger.info("共有バックエンドにRedisを使用します")
+        return _client
@@ -0,0 +1,227 @@
+"""
+変換結果キャッシュ
+PDFの内容ハッシュ・モデルID・プロンプト・Citations設定をキーにBedrockの応答をSQLiteへ永続化する
+BEDROCK_SHARED_BACKEND=redis ではRedisに保存し、複数のレプリカで同じ変換を繰り返さない
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from utils.redis_backend import get_redis, redis_key, use_redis
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    "BEDROCK_PDF_CACHE_PATH", os.path.join(".cache", "result_cache.sqlite3")
+)
+DEFAULT_MAX_ENTRIES = int(os.environ.get("BEDROCK_PDF_CACHE_MAX_ENTRIES", "1000"))
+DEFAULT_MAX_BYTES = int(os.environ.get("BEDROCK_PDF_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+DEFAULT_TTL_SECONDS = int(os.environ.get("BEDROCK_PDF_CACHE_TTL", str(7 * 24 * 60 * 60)))
+
+
+def hash_document(document_bytes):
+    """ドキュメントのバイト列からSHA-256ハッシュを計算"""
+    return hashlib.sha256(document_bytes).hexdigest()
+
+
+def make_cache_key(document_hash, model_id, prompt_text, citations):
+    """キャッシュキーを生成"""
+    key_source = json.dumps(
+        [document_hash, model_id, prompt_text, bool(citations)], ensure_ascii=False
+    )
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """LRU追い出しとTTLを備えたSQLiteバックエンドの結果キャッシュ"""
+
+    def __init__(
+        self,
+        path=DEFAULT_CACHE_PATH,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        max_bytes=DEFAULT_MAX_BYTES,
+        ttl_seconds=DEFAULT_TTL_SECONDS,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                usage TEXT NOT NULL,
+                citations TEXT NOT NULL DEFAULT '[]',
+                validation TEXT,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(results)")}
+        if "citations" not in columns:
+            self._conn.execute(
+                "ALTER TABLE results ADD COLUMN citations TEXT NOT NULL DEFAULT '[]'"
+            )
+        if "validation" not in columns:
+            self._conn.execute("ALTER TABLE results ADD COLUMN validation TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_results_last_access ON results(last_access)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        """キャッシュを参照し、ヒットすれば {"text", "usage", "citations", "validation"} を返す"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, usage, citations, validation, created_at FROM results WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+
+            text, usage, citations, validation, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+
+            self._conn.execute(
+                "UPDATE results SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+
+        return {
+            "text": text,
+            "usage": json.loads(usage),
+            "citations": json.loads(citations),
+            "validation": json.loads(validation) if validation else None,
+        }
+
+    def set(self, key, text, usage, citations=None, validation=None):
+        """結果をキャッシュに保存（validation は検証結果の辞書）"""
+        now = time.time()
+        usage_json = json.dumps(usage or {})
+        citations_json = json.dumps(citations or [], ensure_ascii=False)
+        validation_json = json.dumps(validation, ensure_ascii=False) if validation is not None else None
+        size = (
+            len(text.encode("utf-8"))
+            + len(usage_json)
+            + len(citations_json.encode("utf-8"))
+            + len((validation_json or "").encode("utf-8"))
+        )
+
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO results
+                    (key, text, usage, citations, validation, size, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (key, text, usage_json, citations_json, validation_json, size, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        """期限切れのエントリを削除し、上限を超えた分を古い順に追い出す"""
+        if self.ttl_seconds:
+            self._conn.execute(
+                "DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+
+        count, total_size = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+
+        rows = self._conn.execute(
+            "SELECT key, size FROM results ORDER BY last_access ASC"
+        )
+        evicted = []
+        for key, size in rows:
+            if count <= self.max_entries and total_size <= self.max_bytes:
+                break
+            evicted.append((key,))
+            count -= 1
+            total_size -= size
+
+        if evicted:
+            self._conn.executemany("DELETE FROM results WHERE key = ?", evicted)
+            logger.info(f"結果キャッシュから {len(evicted)} 件を追い出しました")
+
+    def clear(self):
+        """キャッシュを全削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.commit()
+
+    def stats(self):
+        """キャッシュの件数と合計サイズを返す"""
+        with self._lock:
+            count, total_size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+        return {"entries": count, "bytes": total_size}
+
+
+class RedisResultCache:
+    """Redisに保存する結果キャッシュ（複数のレプリカで共有）
+
+    エントリはTTLで期限切れになり、メモリの上限はRedisの maxmemory-policy（volatile-lru など）で追い出す。
+    """
+
+    def __init__(self, client=None, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.client = client if client is not None else get_redis()
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key):
+        """キャッシュを参照し、ヒットすれば {"text", "usage", "citations", "validation"} を返す"""
+        value = self.client.get(redis_key("cache", key))
+        if value is None:
+            return None
+        return {"validation": None, **json.loads(value)}
+
+    def set(self, key, text, usage, citations=None, validation=None):
+        """結果をキャッシュに保存（validation は検証結果の辞書）"""
+        value = json.dumps(
+            {"text": text, "usage": usage or {}, "citations": citations or [], "validation": validation},
+            ensure_ascii=False,
+        )
+        self.client.set(redis_key("cache", key), value, ex=self.ttl_seconds or None)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """プロセス共有の結果キャッシュを取得（BEDROCK_PDF_CACHE_DISABLED=1 で無効化）"""
+    global _default_cache
+
+    if os.environ.get("BEDROCK_PDF_CACHE_DISABLED") == "1":
+        return None
+
+    with _default_cache_lock:
+        if _default_cache is None:
+            try:
+                _default_cache = RedisResultCache() if use_redis() else ResultCache()
+            except Exception as e:
+                logger.error(f"結果キャッシュ初期化エラー: {str(e)}")
+                return None
+        return _default_cache
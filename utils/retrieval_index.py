@@ -0,0 +1,396 @@
+"""
+Q&A用のローカル検索インデックス
+PDFのページごとのテキストをローカルで抽出してBM25インデックスを作り、
+質問に関係するページだけをBedrockに送れるようにする
+インデックスはドキュメントのハッシュをキーにSQLiteへ保存し、再起動後も再利用する
+"""
+
+import io
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+
+from pypdf import PdfWriter
+
+from utils.pdf_chunker import open_pdf_reader
+from utils.result_cache import hash_document
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_PATH = os.environ.get(
+    "BEDROCK_RETRIEVAL_INDEX_PATH", os.path.join(".cache", "retrieval_index.sqlite3")
+)
+RETRIEVAL_TOP_K = int(os.environ.get("BEDROCK_RETRIEVAL_TOP_K", "5"))
+RETRIEVAL_CONTEXT_PAGES = int(os.environ.get("BEDROCK_RETRIEVAL_CONTEXT_PAGES", "1"))
+
+# Converseの1リクエストに含められるドキュメント数の上限
+MAX_DOCUMENTS_PER_REQUEST = 5
+
+# メモリ上に保持する読み込み済みインデックスの数
+MAX_LOADED_DOCUMENTS = 32
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 英数字は単語単位、日本語（かな・漢字）は連続部分をまとめて取り出す
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+")
+
+
+def tokenize(text):
+    """検索用にトークン化（英数字は単語、日本語は文字バイグラム）"""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(unicodedata.normalize("NFKC", text).lower()):
+        word = match.group()
+        if word.isascii() or len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def extract_page_texts(document_bytes):
+    """PDFのページごとのテキストを抽出"""
+    reader = open_pdf_reader(document_bytes)
+    page_texts = []
+    for page_number, page in enumerate(reader.pages, start=1):
+        try:
+            page_texts.append(page.extract_text() or "")
+        except Exception as e:
+            logger.warning(f"p.{page_number} のテキスト抽出に失敗しました: {str(e)}")
+            page_texts.append("")
+    return page_texts
+
+
+def merge_page_ranges(page_numbers, page_count, context_pages=RETRIEVAL_CONTEXT_PAGES):
+    """ページ番号に前後のページを加え、連続する範囲にまとめた [(開始, 終了), ...] を返す"""
+    pages = set()
+    for page_number in page_numbers:
+        start = max(1, page_number - context_pages)
+        end = min(page_count, page_number + context_pages)
+        pages.update(range(start, end + 1))
+
+    ranges = []
+    for page_number in sorted(pages):
+        if ranges and ranges[-1][1] == page_number - 1:
+            ranges[-1] = (ranges[-1][0], page_number)
+        else:
+            ranges.append((page_number, page_number))
+    return ranges
+
+
+def format_page_ranges(page_ranges):
+    """ページ範囲を表示用の文字列に整形（例: p.3-5, p.12）"""
+    return ", ".join(
+        f"p.{start}" if start == end else f"p.{start}-{end}" for start, end in page_ranges
+    )
+
+
+@dataclass
+class PageHit:
+    """検索でヒットしたページ"""
+
+    document_hash: str
+    document_name: str
+    page_number: int
+    score: float
+
+
+@dataclass
+class RetrievedDocument:
+    """質問に関係するページだけを抜き出したドキュメント"""
+
+    document_hash: str
+    document_name: str
+    page_count: int
+    page_ranges: list
+    score: float
+    pages: list = field(default_factory=list)
+    document_bytes: bytes = b""
+
+    @property
+    def request_name(self):
+        """Converseのドキュメント名（英数字・空白・ハイフン・括弧のみ使える）"""
+        ranges = " ".join(
+            f"p{start}" if start == end else f"p{start}-{end}" for start, end in self.page_ranges
+        )
+        return f"{self.document_name} ({ranges})"
+
+
+class RetrievalIndex:
+    """ドキュメントハッシュをキーにページ単位の語頻度をSQLiteへ保存するBM25インデックス"""
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._loaded = OrderedDict()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                document_hash TEXT PRIMARY KEY,
+                document_name TEXT NOT NULL,
+                page_count INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                document_hash TEXT NOT NULL,
+                page_number INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                terms TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                PRIMARY KEY (document_hash, page_number)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def add_document(self, document_bytes, document_name):
+        """ドキュメントをインデックスに登録し、ドキュメントハッシュを返す（登録済みなら何もしない）"""
+        document_hash = hash_document(document_bytes)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM documents WHERE document_hash = ?", (document_hash,)
+            ).fetchone()
+        if row is not None:
+            return document_hash
+
+        started = time.monotonic()
+        page_texts = extract_page_texts(document_bytes)
+        rows = []
+        for page_number, text in enumerate(page_texts, start=1):
+            terms = Counter(tokenize(text))
+            rows.append(
+                (
+                    document_hash,
+                    page_number,
+                    text,
+                    json.dumps(terms, ensure_ascii=False),
+                    sum(terms.values()),
+                )
+            )
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pages (document_hash, page_number, text, terms, length) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (document_hash, document_name, page_count, created_at) VALUES (?, ?, ?, ?)",
+                (document_hash, document_name, len(page_texts), time.time()),
+            )
+            self._conn.commit()
+
+        logger.info(
+            f"検索インデックスに登録しました: {document_name}（{len(page_texts)} ページ, {time.monotonic() - started:.1f}秒）"
+        )
+        return document_hash
+
+    def _load(self, document_hash):
+        """ドキュメントのページごとの語頻度を読み込む（メモリ上にLRUで保持）"""
+        with self._lock:
+            loaded = self._loaded.get(document_hash)
+            if loaded is not None:
+                self._loaded.move_to_end(document_hash)
+                return loaded
+
+            row = self._conn.execute(
+                "SELECT document_name, page_count FROM documents WHERE document_hash = ?",
+                (document_hash,),
+            ).fetchone()
+            if row is None:
+                raise KeyError(f"インデックスに登録されていないドキュメントです: {document_hash}")
+
+            pages = [
+                (page_number, json.loads(terms), length)
+                for page_number, terms, length in self._conn.execute(
+                    "SELECT page_number, terms, length FROM pages WHERE document_hash = ? ORDER BY page_number",
+                    (document_hash,),
+                )
+            ]
+            loaded = {"document_name": row[0], "page_count": row[1], "pages": pages}
+            self._loaded[document_hash] = loaded
+            while len(self._loaded) > MAX_LOADED_DOCUMENTS:
+                self._loaded.popitem(last=False)
+            return loaded
+
+    def page_count(self, document_hash):
+        return self._load(document_hash)["page_count"]
+
+    def page_text(self, document_hash, page_number):
+        """登録済みページのテキストを返す"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM pages WHERE document_hash = ? AND page_number = ?",
+                (document_hash, page_number),
+            ).fetchone()
+        return row[0] if row else ""
+
+    def search(self, question, document_hashes, top_k=RETRIEVAL_TOP_K):
+        """指定ドキュメント群のページをBM25で採点し、上位top_k件のPageHitを返す"""
+        query_terms = set(tokenize(question))
+        if not query_terms:
+            return []
+
+        documents = {document_hash: self._load(document_hash) for document_hash in document_hashes}
+        all_pages = [
+            (document_hash, page_number, terms, length)
+            for document_hash, loaded in documents.items()
+            for page_number, terms, length in loaded["pages"]
+        ]
+        if not all_pages:
+            return []
+
+        # 文書頻度と平均ページ長は検索対象のドキュメント群全体で計算する
+        page_total = len(all_pages)
+        average_length = sum(length for *_, length in all_pages) / page_total or 1.0
+        document_frequency = Counter()
+        for _, _, terms, _ in all_pages:
+            document_frequency.update(term for term in query_terms if term in terms)
+
+        idf = {
+            term: math.log(1 + (page_total - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+        hits = []
+        for document_hash, page_number, terms, length in all_pages:
+            score = 0.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+            for term, term_idf in idf.items():
+                frequency = terms.get(term, 0)
+                if frequency:
+                    score += term_idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+            if score > 0:
+                hits.append(
+                    PageHit(document_hash, documents[document_hash]["document_name"], page_number, score)
+                )
+
+        hits.sort(key=lambda hit: hit.score, reverse=True)
+        return hits[:top_k]
+
+
+def extract_pages(document_bytes, page_numbers):
+    """指定したページ（1始まり）だけを含むPDFを作成"""
+    reader = open_pdf_reader(document_bytes)
+    writer = PdfWriter()
+    for page_number in page_numbers:
+        writer.add_page(reader.pages[page_number - 1])
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def retrieve_documents(
+    index,
+    documents,
+    question,
+    top_k=RETRIEVAL_TOP_K,
+    context_pages=RETRIEVAL_CONTEXT_PAGES,
+):
+    """質問に関係するページを検索し、ドキュメントごとに抜き出したRetrievedDocumentのリストを返す
+
+    documents は ドキュメントハッシュ → (ドキュメント名, PDFバイト列) の辞書。
+    Converseの上限に合わせ、スコアの高いドキュメントから最大5件までを返す。
+    """
+    hits = index.search(question, list(documents), top_k=top_k)
+
+    grouped = OrderedDict()
+    for hit in hits:
+        grouped.setdefault(hit.document_hash, []).append(hit)
+
+    retrieved = []
+    for document_hash, document_hits in list(grouped.items())[:MAX_DOCUMENTS_PER_REQUEST]:
+        document_name, document_bytes = documents[document_hash]
+        page_count = index.page_count(document_hash)
+        page_ranges = merge_page_ranges(
+            [hit.page_number for hit in document_hits], page_count, context_pages
+        )
+        pages = [page for start, end in page_ranges for page in range(start, end + 1)]
+        retrieved.append(
+            RetrievedDocument(
+                document_hash=document_hash,
+                document_name=document_name,
+                page_count=page_count,
+                page_ranges=page_ranges,
+                score=max(hit.score for hit in document_hits),
+                pages=pages,
+                document_bytes=extract_pages(document_bytes, pages),
+            )
+        )
+
+    if len(grouped) > MAX_DOCUMENTS_PER_REQUEST:
+        logger.info(
+            f"ヒットしたドキュメント {len(grouped)} 件のうち上位 {MAX_DOCUMENTS_PER_REQUEST} 件を送信します"
+        )
+    return retrieved
+
+
+def map_citations(citations, retrieved):
+    """抜き出したPDF内のページ番号で返る引用位置を、元のドキュメント名・ページ番号に戻す"""
+    mapped = []
+    for citation in citations:
+        location = citation.get("location", {})
+        page = location.get("documentPage")
+        if page is None:
+            mapped.append(citation)
+            continue
+
+        document_index = page.get("documentIndex", 0)
+        if document_index >= len(retrieved):
+            mapped.append(citation)
+            continue
+
+        document = retrieved[document_index]
+
+        def original_page(page_number):
+            if isinstance(page_number, int) and 1 <= page_number <= len(document.pages):
+                return document.pages[page_number - 1]
+            return page_number
+
+        mapped.append(
+            {
+                **citation,
+                "title": document.document_name,
+                "location": {
+                    **location,
+                    "documentPage": {
+                        **page,
+                        "start": original_page(page.get("start")),
+                        "end": original_page(page.get("end")),
+                    },
+                },
+            }
+        )
+    return mapped
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_retrieval_index():
+    """プロセス共有の検索インデックスを取得"""
+    global _default_index
+
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = RetrievalIndex()
+        return _default_index
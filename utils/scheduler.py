@@ -0,0 +1,241 @@
+"""
+Bedrock呼び出しのスケジューラ
+全体・タブ単位の同時実行数制限と、RPM/TPMクォータに合わせたトークンバケットでBedrockへの流量を制御する
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from utils.fair_semaphore import FairSemaphore
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_CONCURRENCY = int(os.environ.get("BEDROCK_GLOBAL_CONCURRENCY", "8"))
+TAB_CONCURRENCY = os.environ.get("BEDROCK_TAB_CONCURRENCY", "qa=4,yaml=2,markdown=2")
+REQUESTS_PER_MINUTE = int(os.environ.get("BEDROCK_RPM", "50"))
+TOKENS_PER_MINUTE = int(os.environ.get("BEDROCK_TPM", "200000"))
+QUEUE_MAX_SIZE = int(os.environ.get("BEDROCK_QUEUE_MAX_SIZE", "100"))
+ESTIMATED_TOKENS_PER_PAGE = int(os.environ.get("BEDROCK_ESTIMATED_TOKENS_PER_PAGE", "2500"))
+ESTIMATED_OUTPUT_TOKENS = int(os.environ.get("BEDROCK_ESTIMATED_OUTPUT_TOKENS", "4000"))
+
+
+def parse_tab_limits(spec):
+    """"qa=4,yaml=2" 形式の設定をタブ名→上限の辞書に変換"""
+    limits = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, value = item.split("=", 1)
+        limits[name.strip()] = int(value)
+    return limits
+
+
+def estimate_request_tokens(page_count, prompt_text=""):
+    """ページ数とプロンプト長から1リクエストの消費トークンを見積もる"""
+    return page_count * ESTIMATED_TOKENS_PER_PAGE + len(prompt_text) // 2 + ESTIMATED_OUTPUT_TOKENS
+
+
+class TokenBucket:
+    """1分あたりの上限に合わせて補充されるトークンバケット（rate_per_minute=0で無制限）"""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = rate_per_minute
+        self.tokens = float(rate_per_minute)
+        self.fill_rate = rate_per_minute / 60.0
+        self.updated = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+
+    def try_acquire(self, amount):
+        """トークンを消費できれば0を、できなければ必要な待ち秒数を返す"""
+        if not self.capacity:
+            return 0.0
+
+        # バケット容量を超える要求は容量分だけ消費する（永久に待たないように）
+        amount = min(amount, self.capacity)
+        with self._cond:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.fill_rate
+
+    def acquire(self, amount):
+        """トークンが貯まるまで待ってから消費し、待機した秒数を返す"""
+        started = time.monotonic()
+        while True:
+            wait = self.try_acquire(amount)
+            if not wait:
+                return time.monotonic() - started
+            with self._cond:
+                self._cond.wait(wait)
+
+    async def acquire_async(self, amount):
+        """acquireの非同期版（スレッドを占有せずに待機）"""
+        started = time.monotonic()
+        while True:
+            wait = self.try_acquire(amount)
+            if not wait:
+                return time.monotonic() - started
+            await asyncio.sleep(wait)
+
+    def adjust(self, delta):
+        """見積もりと実績の差分を反映（正なら追加消費、負なら返却）"""
+        if not self.capacity:
+            return
+        with self._cond:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - delta)
+            self._cond.notify_all()
+
+
+class SchedulerTicket:
+    """スケジューラから払い出された実行枠"""
+
+    def __init__(self, bucket, estimated_tokens):
+        self._bucket = bucket
+        self.estimated_tokens = estimated_tokens
+
+    def record_usage(self, usage):
+        """実際のトークン使用量でTPMバケットを補正"""
+        actual = (usage or {}).get("totalTokens")
+        if isinstance(actual, int):
+            self._bucket.adjust(actual - self.estimated_tokens)
+
+
+class BedrockScheduler:
+    """全体・タブ単位の同時実行数とRPM/TPMを制御するスケジューラ"""
+
+    def __init__(
+        self,
+        global_limit=GLOBAL_CONCURRENCY,
+        tab_limits=None,
+        requests_per_minute=REQUESTS_PER_MINUTE,
+        tokens_per_minute=TOKENS_PER_MINUTE,
+    ):
+        self.global_limit = global_limit
+        self.tab_limits = tab_limits if tab_limits is not None else parse_tab_limits(TAB_CONCURRENCY)
+        # 同期版と非同期版の待ち手を到着順に通すため、スレッド・イベントループ共用のFIFOセマフォを使う
+        self._global = FairSemaphore(global_limit)
+        self._tabs = {}
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._lock = threading.Lock()
+        self._waiting = {}
+        self._active = {}
+
+    def tab_limit(self, tab):
+        """タブの同時実行数の上限を取得"""
+        return self.tab_limits.get(tab, self.global_limit)
+
+    def _tab_semaphore(self, tab):
+        with self._lock:
+            semaphore = self._tabs.get(tab)
+            if semaphore is None:
+                semaphore = FairSemaphore(self.tab_limit(tab))
+                self._tabs[tab] = semaphore
+            return semaphore
+
+    def _update(self, counter, tab, delta):
+        with self._lock:
+            counter[tab] = counter.get(tab, 0) + delta
+
+    @contextmanager
+    def slot(self, tab, estimated_tokens=0):
+        """実行枠を確保するコンテキストマネージャ"""
+        tab_semaphore = self._tab_semaphore(tab)
+
+        self._update(self._waiting, tab, 1)
+        started = time.monotonic()
+        try:
+            # RPM/TPMの待機中に実行枠を占有しないよう、先にトークンを確保してから実行枠を取る
+            self._requests.acquire(1)
+            try:
+                self._tokens.acquire(estimated_tokens)
+                try:
+                    tab_semaphore.acquire()
+                    try:
+                        self._global.acquire()
+                    except BaseException:
+                        tab_semaphore.release()
+                        raise
+                except BaseException:
+                    self._tokens.adjust(-estimated_tokens)
+                    raise
+            except BaseException:
+                self._requests.adjust(-1)
+                raise
+        finally:
+            self._update(self._waiting, tab, -1)
+
+        waited = time.monotonic() - started
+        if waited > 1:
+            logger.info(f"Bedrock実行枠の待機: {tab} {waited:.1f}秒")
+
+        self._update(self._active, tab, 1)
+        try:
+            yield SchedulerTicket(self._tokens, estimated_tokens)
+        finally:
+            self._update(self._active, tab, -1)
+            self._global.release()
+            tab_semaphore.release()
+
+    @asynccontextmanager
+    async def async_slot(self, tab, estimated_tokens=0):
+        """slotの非同期版（イベントループ上で待機し、スレッドを占有しない）"""
+        tab_semaphore = self._tab_semaphore(tab)
+
+        self._update(self._waiting, tab, 1)
+        try:
+            await self._requests.acquire_async(1)
+            try:
+                await self._tokens.acquire_async(estimated_tokens)
+                try:
+                    await tab_semaphore.acquire_async()
+                    try:
+                        await self._global.acquire_async()
+                    except BaseException:
+                        tab_semaphore.release()
+                        raise
+                except BaseException:
+                    self._tokens.adjust(-estimated_tokens)
+                    raise
+            except BaseException:
+                self._requests.adjust(-1)
+                raise
+        finally:
+            self._update(self._waiting, tab, -1)
+
+        self._update(self._active, tab, 1)
+        try:
+            yield SchedulerTicket(self._tokens, estimated_tokens)
+        finally:
+            self._update(self._active, tab, -1)
+            self._global.release()
+            tab_semaphore.release()
+
+    def stats(self):
+        """タブごとの待機数・実行数を返す"""
+        with self._lock:
+            return {"waiting": dict(self._waiting), "active": dict(self._active)}
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """プロセス共有のスケジューラを取得"""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = BedrockScheduler()
+        return _default_scheduler
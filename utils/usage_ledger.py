@@ -0,0 +1,362 @@
+"""
+トークン使用量・コストの台帳
+Bedrock呼び出しごとの入力・出力・プロンプトキャッシュのトークン数を
+ユーザー・タブ・モデルID単位でSQLiteに追記し、日別の集計を更新する
+ユーザーごと・1日全体のトークン予算を超える呼び出しは、Bedrockに送る前に拒否する
+"""
+
+import ipaddress
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEDGER_PATH = os.environ.get(
+    "BEDROCK_USAGE_LEDGER_PATH", os.path.join(".cache", "usage_ledger.sqlite3")
+)
+
+# 1日あたりのトークン予算（0で無制限）
+USER_DAILY_TOKEN_BUDGET = int(os.environ.get("BEDROCK_USER_DAILY_TOKEN_BUDGET", "0"))
+DAILY_TOKEN_BUDGET = int(os.environ.get("BEDROCK_DAILY_TOKEN_BUDGET", "0"))
+
+# ユーザー名=上限 の形式でユーザーごとの1日の予算を上書き（例: alice=500000,batch=0）
+USER_TOKEN_BUDGETS = os.environ.get("BEDROCK_USER_TOKEN_BUDGETS", "")
+
+# 100万トークンあたりの料金（USD）。既定値はClaude Sonnet 4のオンデマンド料金
+# BEDROCK_MODEL_TOKEN_PRICES に一致しないモデルIDにはこの料金を使う
+TOKEN_PRICES = os.environ.get(
+    "BEDROCK_TOKEN_PRICES", "input=3,output=15,cache_read=0.3,cache_write=3.75"
+)
+
+# モデルごとの料金（"モデルIDに含まれる文字列:料金;..."、長い文字列から順に照合）
+MODEL_TOKEN_PRICES = os.environ.get(
+    "BEDROCK_MODEL_TOKEN_PRICES",
+    "haiku-4-5:input=1,output=5,cache_read=0.1,cache_write=1.25;"
+    "3-5-haiku:input=0.8,output=4,cache_read=0.08,cache_write=1;"
+    "opus-4-5:input=5,output=25,cache_read=0.5,cache_write=6.25;"
+    "opus-4:input=15,output=75,cache_read=1.5,cache_write=18.75",
+)
+
+# ユーザーを識別できない場合の名前
+DEFAULT_USER = "anonymous"
+
+# X-Forwarded-For を信頼するプロキシ（IPアドレスまたはCIDRのカンマ区切り）
+# 未設定なら X-Forwarded-For は使わない（クライアントが自由に書けるため）
+TRUSTED_PROXIES = os.environ.get("BEDROCK_TRUSTED_PROXIES", "")
+
+USAGE_COLUMNS = {
+    "inputTokens": "input_tokens",
+    "outputTokens": "output_tokens",
+    "cacheReadInputTokens": "cache_read_tokens",
+    "cacheWriteInputTokens": "cache_write_tokens",
+}
+
+ROLLUP_KEYS = ("day", "user", "tab", "model_id")
+
+
+class BudgetExceeded(Exception):
+    """トークン予算を超えるため、Bedrockを呼び出さずに拒否した"""
+
+
+def parse_key_values(value, cast=float):
+    """"a=1,b=2" 形式の文字列を辞書に変換"""
+    result = {}
+    for item in value.split(","):
+        if "=" in item:
+            key, number = item.split("=", 1)
+            result[key.strip()] = cast(number.strip())
+    return result
+
+
+def parse_networks(spec):
+    """"10.0.0.0/8,192.168.1.10" 形式の設定をネットワークのリストに変換"""
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in spec.split(",") if item.strip()]
+
+
+_trusted_networks = parse_networks(TRUSTED_PROXIES)
+
+
+def _is_trusted(address, networks):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+def client_address(request, trusted_networks=None):
+    """リクエストの接続元アドレス
+
+    直接の接続元が信頼するプロキシの場合だけ X-Forwarded-For を使い、右から順に見て
+    最初の信頼しないアドレスを返す（左側はクライアントが書き換えられるため使わない）。
+    """
+    networks = _trusted_networks if trusted_networks is None else trusted_networks
+    client = getattr(request, "client", None)
+    address = getattr(client, "host", None)
+    if not address or not _is_trusted(address, networks):
+        return address
+
+    headers = getattr(request, "headers", None) or {}
+    hops = [hop.strip() for hop in (headers.get("x-forwarded-for") or "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted(hop, networks):
+            return hop
+    return hops[0] if hops else address
+
+
+def parse_model_prices(spec):
+    """"haiku-4-5:input=1,output=5;..." 形式の設定を (モデルIDに含まれる文字列, 料金) のリストに変換
+
+    モデルIDには ":" が含まれることがあるため、最後の ":" で区切る。長い文字列から順に並べる。
+    """
+    model_prices = []
+    for item in spec.split(";"):
+        pattern, _, prices = item.strip().rpartition(":")
+        if pattern and prices:
+            model_prices.append((pattern, parse_key_values(prices)))
+    return sorted(model_prices, key=lambda entry: len(entry[0]), reverse=True)
+
+
+def user_from_request(request):
+    """Gradioのリクエストから利用者を識別（ログイン名 → 接続元IPの順）"""
+    if request is None:
+        return DEFAULT_USER
+    username = getattr(request, "username", None)
+    if username:
+        return username
+    return client_address(request) or DEFAULT_USER
+
+
+def today():
+    return time.strftime("%Y-%m-%d")
+
+
+class UsageLedger:
+    """追記専用のイベントログと日別集計を持つSQLiteバックエンドの使用量台帳"""
+
+    def __init__(
+        self,
+        path=DEFAULT_LEDGER_PATH,
+        user_daily_budget=USER_DAILY_TOKEN_BUDGET,
+        daily_budget=DAILY_TOKEN_BUDGET,
+        user_budgets=None,
+        prices=None,
+        model_prices=None,
+    ):
+        self.path = path
+        self.user_daily_budget = user_daily_budget
+        self.daily_budget = daily_budget
+        self.user_budgets = (
+            user_budgets if user_budgets is not None else parse_key_values(USER_TOKEN_BUDGETS, int)
+        )
+        self.prices = prices if prices is not None else parse_key_values(TOKEN_PRICES)
+        self.model_prices = (
+            model_prices if model_prices is not None else parse_model_prices(MODEL_TOKEN_PRICES)
+        )
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS usage_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL,
+                day TEXT NOT NULL,
+                user TEXT NOT NULL,
+                tab TEXT NOT NULL,
+                model_id TEXT NOT NULL,
+                cache_hit INTEGER NOT NULL,
+                input_tokens INTEGER NOT NULL,
+                output_tokens INTEGER NOT NULL,
+                cache_read_tokens INTEGER NOT NULL,
+                cache_write_tokens INTEGER NOT NULL,
+                total_tokens INTEGER NOT NULL,
+                cost_usd REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS usage_daily (
+                day TEXT NOT NULL,
+                user TEXT NOT NULL,
+                tab TEXT NOT NULL,
+                model_id TEXT NOT NULL,
+                requests INTEGER NOT NULL,
+                cache_hits INTEGER NOT NULL,
+                input_tokens INTEGER NOT NULL,
+                output_tokens INTEGER NOT NULL,
+                cache_read_tokens INTEGER NOT NULL,
+                cache_write_tokens INTEGER NOT NULL,
+                total_tokens INTEGER NOT NULL,
+                cost_usd REAL NOT NULL,
+                PRIMARY KEY (day, user, tab, model_id)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def prices_for(self, model_id):
+        """モデルIDに対応する料金（一致するものがなければ BEDROCK_TOKEN_PRICES）"""
+        for pattern, prices in self.model_prices:
+            if pattern in (model_id or ""):
+                return prices
+        return self.prices
+
+    def cost_of(self, tokens, model_id=None):
+        """トークン数の辞書（input/output/cache_read/cache_write）から料金（USD）を計算"""
+        prices = self.prices_for(model_id)
+        return sum(tokens[kind] * prices.get(kind, 0.0) for kind in tokens) / 1_000_000
+
+    def record(self, user, tab, model_id, usage, cache_hit=False):
+        """1回の呼び出しを記録（結果キャッシュのヒットはトークン0として件数のみ数える）"""
+        usage = {} if cache_hit else (usage or {})
+        columns = {column: int(usage.get(key, 0) or 0) for key, column in USAGE_COLUMNS.items()}
+        total_tokens = int(usage.get("totalTokens") or sum(columns.values()))
+        cost = self.cost_of(
+            {
+                "input": columns["input_tokens"],
+                "output": columns["output_tokens"],
+                "cache_read": columns["cache_read_tokens"],
+                "cache_write": columns["cache_write_tokens"],
+            },
+            model_id,
+        )
+        values = (
+            columns["input_tokens"],
+            columns["output_tokens"],
+            columns["cache_read_tokens"],
+            columns["cache_write_tokens"],
+            total_tokens,
+            cost,
+        )
+        now = time.time()
+        day = time.strftime("%Y-%m-%d", time.localtime(now))
+        user = user or DEFAULT_USER
+
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO usage_events
+                    (created_at, day, user, tab, model_id, cache_hit, input_tokens, output_tokens,
+                     cache_read_tokens, cache_write_tokens, total_tokens, cost_usd)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (now, day, user, tab, model_id, int(cache_hit), *values),
+            )
+            self._conn.execute(
+                """
+                INSERT INTO usage_daily
+                    (day, user, tab, model_id, requests, cache_hits, input_tokens, output_tokens,
+                     cache_read_tokens, cache_write_tokens, total_tokens, cost_usd)
+                VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (day, user, tab, model_id) DO UPDATE SET
+                    requests = requests + 1,
+                    cache_hits = cache_hits + excluded.cache_hits,
+                    input_tokens = input_tokens + excluded.input_tokens,
+                    output_tokens = output_tokens + excluded.output_tokens,
+                    cache_read_tokens = cache_read_tokens + excluded.cache_read_tokens,
+                    cache_write_tokens = cache_write_tokens + excluded.cache_write_tokens,
+                    total_tokens = total_tokens + excluded.total_tokens,
+                    cost_usd = cost_usd + excluded.cost_usd
+                """,
+                (day, user, tab, model_id, int(cache_hit), *values),
+            )
+            self._conn.commit()
+
+    def used_tokens(self, day, user=None):
+        """指定日の使用トークン数（user を省略すると全体）"""
+        query = "SELECT COALESCE(SUM(total_tokens), 0) FROM usage_daily WHERE day = ?"
+        params = [day]
+        if user is not None:
+            query += " AND user = ?"
+            params.append(user)
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()[0]
+
+    def budget_for(self, user):
+        """ユーザーの1日の予算（0なら無制限）"""
+        return self.user_budgets.get(user, self.user_daily_budget)
+
+    def check_budget(self, user, estimated_tokens=0):
+        """今回の呼び出し（見積もりトークン数）で予算を超えるならBudgetExceededを送出"""
+        user = user or DEFAULT_USER
+        day = today()
+
+        user_budget = self.budget_for(user)
+        if user_budget:
+            used = self.used_tokens(day, user)
+            if used + estimated_tokens > user_budget:
+                raise BudgetExceeded(
+                    f"本日のトークン予算を超えるため処理を中止しました（{user}: 使用済み {used:,} + 見積もり {estimated_tokens:,} > 上限 {user_budget:,}）"
+                )
+
+        if self.daily_budget:
+            used = self.used_tokens(day)
+            if used + estimated_tokens > self.daily_budget:
+                raise BudgetExceeded(
+                    f"本日の全体のトークン予算を超えるため処理を中止しました（使用済み {used:,} + 見積もり {estimated_tokens:,} > 上限 {self.daily_budget:,}）"
+                )
+
+    def rollup(self, group_by=("day", "user"), since=None, until=None):
+        """日別集計をさらに group_by の単位でまとめた行（辞書）のリストを返す"""
+        group_by = [key for key in group_by if key in ROLLUP_KEYS]
+        select_keys = ", ".join(group_by)
+        query = (
+            f"SELECT {select_keys + ', ' if group_by else ''}"
+            "SUM(requests), SUM(cache_hits), SUM(input_tokens), SUM(output_tokens), "
+            "SUM(cache_read_tokens), SUM(cache_write_tokens), SUM(total_tokens), SUM(cost_usd) "
+            "FROM usage_daily WHERE 1 = 1"
+        )
+        params = []
+        if since:
+            query += " AND day >= ?"
+            params.append(since)
+        if until:
+            query += " AND day <= ?"
+            params.append(until)
+        if group_by:
+            query += f" GROUP BY {select_keys} ORDER BY {select_keys}"
+
+        names = list(group_by) + [
+            "requests",
+            "cache_hits",
+            "input_tokens",
+            "output_tokens",
+            "cache_read_tokens",
+            "cache_write_tokens",
+            "total_tokens",
+            "cost_usd",
+        ]
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [dict(zip(names, row)) for row in rows if row[len(group_by)] is not None]
+
+
+_default_ledger = None
+_default_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger():
+    """プロセス共有の使用量台帳を取得（BEDROCK_USAGE_LEDGER_DISABLED=1 で無効化）"""
+    global _default_ledger
+
+    if os.environ.get("BEDROCK_USAGE_LEDGER_DISABLED") == "1":
+        return None
+
+    with _default_ledger_lock:
+        if _default_ledger is None:
+            try:
+                _default_ledger = UsageLedger()
+            except Exception as e:
+                logger.error(f"使用量台帳の初期化エラー: {str(e)}")
+                return None
+        return _default_ledger
@@ -0,0 +1,374 @@
+"""
+YAML出力の検証
+モデルの応答からYAMLブロックを取り出し、プロンプトの出力例から作ったスキーマで検証する
+不正だったトップレベルキー（document, sections など）だけを再生成できるよう、キーごとに結果をまとめる
+"""
+
+import functools
+import logging
+import os
+import re
+from dataclasses import asdict, dataclass, field
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# 0 でYAMLの検証・再生成・保存を行わない
+YAML_VALIDATION_ENABLED = os.environ.get("BEDROCK_YAML_VALIDATION", "1") == "1"
+
+# 検証に失敗したキーを再生成する最大回数（0 で再生成しない）
+YAML_REPAIR_ATTEMPTS = int(os.environ.get("BEDROCK_YAML_REPAIR_ATTEMPTS", "1"))
+
+# 出力例のうち、どのPDFでも出力されるべきトップレベルキー（表・図・参考文献はPDFにあるときだけ出力される）
+REQUIRED_KEYS = ("document", "metadata", "summary", "sections")
+
+# 閉じていない（出力途中・出力上限で切れた）ブロックも取り出す
+YAML_BLOCK_PATTERN = re.compile(r"```ya?ml[^\n]*\n(.*?)(?:```|\Z)", re.DOTALL)
+TOP_LEVEL_KEY_PATTERN = re.compile(r"^([A-Za-z_][\w-]*)\s*:")
+LIST_ITEM_PATTERN = re.compile(r"^\s{0,2}-\s")
+
+
+class YAMLSchemaError(ValueError):
+    """プロンプトからスキーマを作れない"""
+
+
+@dataclass
+class ValidationIssue:
+    """検証で見つかった問題"""
+
+    key: str
+    path: str
+    message: str
+
+    def __str__(self):
+        return f"{self.path}: {self.message}"
+
+
+class _BlockStyleDumper(yaml.SafeDumper):
+    """複数行の文字列を | のブロック形式で書き出す（マークダウンの本文を読みやすく保つ）"""
+
+
+def _represent_str(dumper, value):
+    style = "|" if "\n" in value else None
+    return dumper.represent_scalar("tag:yaml.org,2002:str", value, style=style)
+
+
+_BlockStyleDumper.add_representer(str, _represent_str)
+
+
+@dataclass
+class YAMLOutput:
+    """トップレベルキーごとに解析したYAML出力"""
+
+    data: dict = field(default_factory=dict)
+    issues: list = field(default_factory=list)
+    # 解析できなかったトップレベルキーの元のテキスト（結果から内容を落とさないよう、そのまま書き戻す）
+    raw_blocks: dict = field(default_factory=dict)
+
+    @property
+    def failed_keys(self):
+        """問題のあったトップレベルキー（出現順）"""
+        return list(dict.fromkeys(issue.key for issue in self.issues))
+
+    @property
+    def valid(self):
+        return not self.issues
+
+    def merge_repaired(self, repaired, keys):
+        """再生成した結果のうち、問題がなくなったキーだけを取り込んだ結果を返す"""
+        data = dict(self.data)
+        issues = list(self.issues)
+        raw_blocks = dict(self.raw_blocks)
+        for key in keys:
+            if key in repaired.data and not any(issue.key == key for issue in repaired.issues):
+                data[key] = repaired.data[key]
+                issues = [issue for issue in issues if issue.key != key]
+                raw_blocks.pop(key, None)
+        return YAMLOutput(data=data, issues=issues, raw_blocks=raw_blocks)
+
+    def to_text(self, key_order=()):
+        """```yaml で囲んだテキストに戻す（key_order の順に並べ、残りは出現順）
+
+        解析できなかったキーは元のテキストのまま残す。
+        """
+        keys = [key for key in key_order if key in self.data or key in self.raw_blocks]
+        keys += [key for key in list(self.data) + list(self.raw_blocks) if key not in keys]
+        parts = []
+        for key in dict.fromkeys(keys):
+            if key in self.data:
+                parts.append(
+                    yaml.dump(
+                        {key: self.data[key]},
+                        Dumper=_BlockStyleDumper,
+                        allow_unicode=True,
+                        sort_keys=False,
+                        width=1000,
+                    )
+                )
+            else:
+                parts.append(self.raw_blocks[key].rstrip("\n") + "\n")
+        return f"```yaml\n{''.join(parts)}```"
+
+
+@dataclass
+class ValidationReport:
+    """検証と再生成の結果（結果テキストのフッターに表示）"""
+
+    issues: list = field(default_factory=list)
+    repaired_keys: list = field(default_factory=list)
+    repair_attempts: int = 0
+    # 構造化ストアに保存したセクション要素の数（保存しなかった場合はNone）
+    stored_rows: int = None
+    # 再生成しなかった・できなかった理由
+    repair_note: str = None
+
+    def to_dict(self):
+        """結果キャッシュに保存する形式"""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, values):
+        """to_dict の結果から復元"""
+        values = dict(values)
+        values["issues"] = [ValidationIssue(**issue) for issue in values.get("issues", [])]
+        return cls(**values)
+
+    def summary(self):
+        """フッター用の要約"""
+        repaired = f"（再生成: {', '.join(self.repaired_keys)}）" if self.repaired_keys else ""
+        if self.stored_rows is not None:
+            repaired += f"（保存: {self.stored_rows}件）"
+        if not self.issues:
+            return f"✅ スキーマに一致{repaired}"
+        shown = "; ".join(str(issue) for issue in self.issues[:3])
+        more = f" ほか{len(self.issues) - 3}件" if len(self.issues) > 3 else ""
+        note = f"\n⚠️ {self.repair_note}" if self.repair_note else ""
+        return f"⚠️ {len(self.issues)}件の問題{repaired}: {shown}{more}{note}"
+
+
+def extract_yaml_block(text):
+    """応答テキストから ```yaml ブロックの中身を取り出す（ブロックがなければ全体）"""
+    match = YAML_BLOCK_PATTERN.search(text)
+    if match:
+        return match.group(1)
+    return text
+
+
+@functools.lru_cache(maxsize=8)
+def derive_schema(prompt_text):
+    """プロンプトの出力例（```yaml ブロック）をスキーマとして使う
+
+    スキーマは出力例そのもので、マッピングはキーと値の形、リストは先頭要素の形を表す。
+    """
+    match = YAML_BLOCK_PATTERN.search(prompt_text)
+    if not match:
+        raise YAMLSchemaError("プロンプトにYAMLの出力例がありません")
+    try:
+        schema = yaml.safe_load(match.group(1))
+    except yaml.YAMLError as e:
+        raise YAMLSchemaError(f"プロンプトの出力例を解析できません: {str(e)}") from e
+    if not isinstance(schema, dict):
+        raise YAMLSchemaError("プロンプトの出力例がマッピングではありません")
+    return schema
+
+
+def _kind(value):
+    if isinstance(value, dict):
+        return "マッピング"
+    if isinstance(value, list):
+        return "リスト"
+    return "値"
+
+
+def _validate_value(value, example, key, path, issues):
+    """value が example と同じ形か再帰的に確認する（値は null も可）"""
+    if value is None:
+        return
+    if isinstance(example, dict):
+        if not isinstance(value, dict):
+            issues.append(ValidationIssue(key, path, f"マッピングが必要です（{_kind(value)}）"))
+            return
+        for name, child in example.items():
+            if name not in value:
+                issues.append(ValidationIssue(key, f"{path}.{name}", "キーがありません"))
+            else:
+                _validate_value(value[name], child, key, f"{path}.{name}", issues)
+    elif isinstance(example, list):
+        if not isinstance(value, list):
+            issues.append(ValidationIssue(key, path, f"リストが必要です（{_kind(value)}）"))
+            return
+        if example:
+            for index, item in enumerate(value):
+                _validate_value(item, example[0], key, f"{path}[{index}]", issues)
+    elif isinstance(value, (dict, list)):
+        issues.append(ValidationIssue(key, path, f"値が必要です（{_kind(value)}）"))
+
+
+def validate_key(key, value, schema):
+    """トップレベルキー1つ分の値を検証し、問題のリストを返す"""
+    issues = []
+    if key in schema:
+        _validate_value(value, schema[key], key, key, issues)
+    return issues
+
+
+def _split_top_level(yaml_text):
+    """YAMLテキストをトップレベルキーごとのブロックに分ける"""
+    blocks = []
+    for line in yaml_text.splitlines(keepends=True):
+        match = TOP_LEVEL_KEY_PATTERN.match(line)
+        if match:
+            blocks.append([match.group(1), line])
+        elif blocks:
+            blocks[-1][1] += line
+    return blocks
+
+
+def _parse_block(key, block):
+    """トップレベルキー1つ分のブロックを解析し、(値, 問題) を返す"""
+    try:
+        data = yaml.safe_load(block)
+    except yaml.YAMLError as e:
+        mark = getattr(e, "problem_mark", None)
+        where = f"（キー内の{mark.line + 1}行目）" if mark is not None else ""
+        problem = getattr(e, "problem", None) or str(e)
+        return None, [ValidationIssue(key, key, f"YAMLの構文エラー{where}: {problem}")]
+    if not isinstance(data, dict) or key not in data:
+        return None, [ValidationIssue(key, key, "YAMLの構文エラー")]
+    return data[key], []
+
+
+def parse_yaml_output(text, schema, keys=None):
+    """応答テキストを解析して検証し、YAMLOutput を返す
+
+    全体を解析できない場合はトップレベルキーごとに解析し、壊れたキーだけを問題として扱う。
+    keys を指定するとそのキーだけを対象にする（再生成の結果を取り込むとき）。
+    """
+    yaml_text = extract_yaml_block(text)
+    expected = list(keys) if keys is not None else list(REQUIRED_KEYS)
+    output = YAMLOutput()
+
+    try:
+        data = yaml.safe_load(yaml_text)
+    except yaml.YAMLError:
+        data = None
+    if isinstance(data, dict):
+        output.data = data
+    else:
+        for key, block in _split_top_level(yaml_text):
+            value, issues = _parse_block(key, block)
+            output.issues.extend(issues)
+            if not issues:
+                output.data[key] = value
+            else:
+                output.raw_blocks[key] = block
+
+    if keys is not None:
+        output.data = {key: value for key, value in output.data.items() if key in keys}
+        output.raw_blocks = {key: block for key, block in output.raw_blocks.items() if key in keys}
+        output.issues = [issue for issue in output.issues if issue.key in keys]
+
+    broken_keys = {issue.key for issue in output.issues}
+    for key in expected:
+        if key not in output.data and key not in broken_keys:
+            output.issues.append(ValidationIssue(key, key, "キーがありません"))
+    for key, value in output.data.items():
+        output.issues.extend(validate_key(key, value, schema))
+    return output
+
+
+def build_repair_prompt(prompt_text, output):
+    """検証に失敗したトップレベルキーだけを出力し直させるプロンプトを作成
+
+    形式はプロンプトの出力例から該当キーの部分をそのまま抜き出して示す。
+    """
+    keys = output.failed_keys
+    example_blocks = dict(_split_top_level(YAML_BLOCK_PATTERN.search(prompt_text).group(1)))
+    example = "".join(example_blocks[key].rstrip() + "\n" for key in keys if key in example_blocks)
+    problems = "\n".join(f"- {issue}" for issue in output.issues)
+    return (
+        "このPDFドキュメントを構造化されたYAMLに変換した結果のうち、"
+        f"次のトップレベルキーが形式に合っていませんでした: {', '.join(keys)}\n\n"
+        f"問題点：\n{problems}\n\n"
+        "このPDFについて、上記のキーだけを次の形式のYAMLで出力し直してください。"
+        "他のキーは出力しないでください。\n\n"
+        f"```yaml\n{example}```\n\n"
+        "重要な注意事項：\n"
+        "- 日本語の内容は日本語で出力\n"
+        "- YAMLの構文に従って正確にフォーマット（文字列に : や # を含む場合は引用符で囲む）"
+    )
+
+
+class IncrementalYAMLParser:
+    """ストリーミング中の応答から、書き終わったトップレベルキーを順に解析・検証する
+
+    次のトップレベルキーが現れた時点で直前のキーは完成しているため、
+    応答全体を待たずに壊れたキーを見つけられる。
+    前回までに読んだ位置と、書き途中のキーの開始位置を覚えておき、毎回は続きの行だけを読む。
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.results = {}
+        self.current_key = None
+        self.current_items = 0
+        # 次に読む行の開始位置と、書き途中のキー（直前に完成したキーの直後）の開始位置
+        self._scanned = 0
+        self._block_start = 0
+        self._in_fence = False
+        self._closed = False
+
+    def feed(self, text):
+        """これまでの応答テキスト全体を受け取り、前回の続きから新しく完成したキーを解析する"""
+        while not self._closed:
+            end = text.find("\n", self._scanned)
+            if end < 0:
+                break
+            line_start, self._scanned = self._scanned, end + 1
+            self._read_line(text, line_start, text[line_start:self._scanned])
+        # 応答の最後の閉じる ``` には改行が付かないことが多い（YAMLの行は ` で始まらない）
+        if self._in_fence and not self._closed and text.startswith("```", self._scanned):
+            self._finish_key(text, self._scanned)
+            self._closed = True
+        return self.results
+
+    def _read_line(self, text, line_start, line):
+        if line.lstrip().startswith("```"):
+            if self._in_fence:
+                # 閉じたブロックの最後のキーも完成している
+                self._finish_key(text, line_start)
+                self._closed = True
+            elif YAML_BLOCK_PATTERN.match(line.lstrip()):
+                # ```yaml より前の文章はYAMLではない
+                self._in_fence = True
+                self.current_key = None
+                self._block_start = self._scanned
+            return
+
+        match = TOP_LEVEL_KEY_PATTERN.match(line)
+        if match:
+            self._finish_key(text, line_start)
+            self.current_key = match.group(1)
+            self.current_items = 0
+            self._block_start = line_start
+        elif self.current_key is not None and LIST_ITEM_PATTERN.match(line):
+            self.current_items += 1
+
+    def _finish_key(self, text, end):
+        """書き途中だったキーのブロック（_block_start から end まで）を解析・検証する"""
+        key = self.current_key
+        if key is None or key in self.results:
+            return
+        value, issues = _parse_block(key, text[self._block_start:end])
+        if not issues:
+            issues = validate_key(key, value, self.schema)
+        self.results[key] = issues
+
+    def progress(self):
+        """途中経過の表示用テキスト"""
+        parts = [f"{'✅' if not issues else '⚠️'} {key}" for key, issues in self.results.items()]
+        if self.current_key is not None and self.current_key not in self.results:
+            count = f"（{self.current_items}件）" if self.current_items else ""
+            parts.append(f"⏳ {self.current_key}{count}")
+        return "🧩 YAML: " + " ".join(parts) if parts else ""
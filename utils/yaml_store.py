@@ -0,0 +1,197 @@
+"""
+YAML変換結果の構造化ストア
+検証済みのYAMLをドキュメント1行・セクション（sections / tables / figures / references の各要素）1行でSQLiteに保存する
+下流の処理は大きなYAMLを解析し直さずに、タイトルやドキュメント単位でセクションを取り出せる
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_PATH = os.environ.get(
+    "BEDROCK_YAML_STORE_PATH", os.path.join(".cache", "yaml_store.sqlite3")
+)
+
+# 1要素1行で保存するリスト形式のトップレベルキー
+SECTION_KINDS = ("sections", "tables", "figures", "references")
+
+
+def _to_json(value):
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _item_title(item):
+    """セクション要素のタイトル（文字列の要素はそれ自体）"""
+    if isinstance(item, dict):
+        title = item.get("title")
+        return str(title) if title is not None else None
+    if item is not None and not isinstance(item, list):
+        return str(item)
+    return None
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class YAMLStore:
+    """YAML変換結果をドキュメント・セクション単位で保存するSQLiteストア"""
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                document_hash TEXT PRIMARY KEY,
+                source_name TEXT NOT NULL,
+                title TEXT,
+                doc_type TEXT,
+                language TEXT,
+                pages INTEGER,
+                metadata TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                model_id TEXT,
+                valid INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sections (
+                document_hash TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                title TEXT,
+                body TEXT NOT NULL,
+                PRIMARY KEY (document_hash, kind, position)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sections_title ON sections(title)")
+        self._conn.commit()
+
+    def save(self, document_hash, source_name, data, model_id=None, valid=True):
+        """YAMLの内容を保存（同じドキュメントの以前の結果は置き換える）"""
+        document = data.get("document") if isinstance(data.get("document"), dict) else {}
+        rows = []
+        for kind in SECTION_KINDS:
+            items = data.get(kind)
+            if not isinstance(items, list):
+                continue
+            for position, item in enumerate(items):
+                rows.append((document_hash, kind, position, _item_title(item), _to_json(item)))
+
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    """
+                    INSERT OR REPLACE INTO documents
+                        (document_hash, source_name, title, doc_type, language, pages,
+                         metadata, summary, model_id, valid, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        document_hash,
+                        source_name,
+                        document.get("title"),
+                        document.get("type"),
+                        document.get("language"),
+                        _to_int(document.get("pages")),
+                        _to_json(data.get("metadata")),
+                        _to_json(data.get("summary")),
+                        model_id,
+                        int(bool(valid)),
+                        time.time(),
+                    ),
+                )
+                self._conn.execute("DELETE FROM sections WHERE document_hash = ?", (document_hash,))
+                self._conn.executemany(
+                    "INSERT INTO sections (document_hash, kind, position, title, body) VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+        return len(rows)
+
+    def get_document(self, document_hash):
+        """ドキュメント単位の情報を辞書で返す（なければNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT source_name, title, doc_type, language, pages, metadata, summary, model_id, valid, updated_at
+                FROM documents WHERE document_hash = ?
+                """,
+                (document_hash,),
+            ).fetchone()
+        if row is None:
+            return None
+        source_name, title, doc_type, language, pages, metadata, summary, model_id, valid, updated_at = row
+        return {
+            "document_hash": document_hash,
+            "source_name": source_name,
+            "title": title,
+            "type": doc_type,
+            "language": language,
+            "pages": pages,
+            "metadata": json.loads(metadata),
+            "summary": json.loads(summary),
+            "model_id": model_id,
+            "valid": bool(valid),
+            "updated_at": updated_at,
+        }
+
+    def list_sections(self, document_hash, kind="sections"):
+        """ドキュメントのセクション要素を順番に返す"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT body FROM sections WHERE document_hash = ? AND kind = ? ORDER BY position",
+                (document_hash, kind),
+            ).fetchall()
+        return [json.loads(body) for (body,) in rows]
+
+    def find_sections(self, title, kind="sections", limit=20):
+        """タイトルに title を含むセクションを (document_hash, position, 要素) のリストで返す"""
+        escaped = title.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT document_hash, position, body FROM sections
+                WHERE kind = ? AND title LIKE ? ESCAPE '\\'
+                ORDER BY document_hash, position LIMIT ?
+                """,
+                (kind, f"%{escaped}%", limit),
+            ).fetchall()
+        return [(document_hash, position, json.loads(body)) for document_hash, position, body in rows]
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_yaml_store():
+    """プロセス共有のYAMLストアを取得（初期化に失敗した場合はNone）"""
+    global _default_store
+
+    with _default_store_lock:
+        if _default_store is None:
+            try:
+                _default_store = YAMLStore()
+            except Exception as e:
+                logger.error(f"YAMLストア初期化エラー: {str(e)}")
+                return None
+        return _default_store